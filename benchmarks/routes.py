@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+
+    Latency and query count of the main routes at several data sizes.
+
+    Every size gets its own SQLite database, generated once with ``flask forge --seed``
+    and kept in ``benchmarks/data`` for the next runs. Each listing is requested
+    on its first page, on its last page through ``?page=`` and on the same page
+    through a cursor, and the results are written as JSON so two runs (e.g. two
+    commits) can be compared::
+
+        $ python -m benchmarks.routes --size 1k --size 10k --output before.json
+        $ python -m benchmarks.routes --size 1k --size 10k --output after.json --compare before.json
+"""
+import json
+import math
+import os
+import platform
+import sqlite3
+import subprocess
+import time
+
+import click
+from flask import url_for
+from sqlalchemy import event
+
+from bluelog import create_app
+from bluelog.extensions import db
+from bluelog.fakes import SCALES as SIZES
+from bluelog.models import Post, Category, Comment
+from bluelog.pagination import encode_cursor
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+# the same data for every run
+SEED = 2018
+
+
+def parse_size(value):
+    """Return ``(name, (categories, posts, comments))`` for a size name or ``POSTS:COMMENTS``."""
+    if value in SIZES:
+        return value, SIZES[value]
+    try:
+        posts, comments = [int(number) for number in value.split(':')]
+    except ValueError:
+        raise click.BadParameter('%s is neither one of %s nor POSTS:COMMENTS.' % (value, ', '.join(SIZES)))
+    return value.replace(':', '-'), (10, posts, comments)
+
+
+def make_app(name, counts, regenerate, workers):
+    app = create_app('testing')
+    filename = os.path.join(basedir, 'data', 'bench-%s.db' % name)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + filename,
+        # measure the views, not the page cache
+        BLUELOG_PAGE_CACHE=False,
+    )
+    if regenerate or not os.path.exists(filename):
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        click.echo('Generating %s: %d categories, %d posts, %d comments...' % ((name,) + counts))
+        args = ['forge', '--category', str(counts[0]), '--post', str(counts[1]), '--comment', str(counts[2]),
+                '--seed', str(SEED), '--workers', str(workers)]
+        result = app.test_cli_runner().invoke(args=args)
+        if result.exit_code != 0:
+            raise click.ClickException('forge failed:\n%s' % result.output)
+    return app
+
+
+def listings():
+    """Yield ``(endpoint, view arguments, listing query, per page setting)`` for the benchmarked routes."""
+    post = Post.query.order_by(Post.comment_count.desc()).first()
+    category = Category.query.order_by(Category.post_count.desc()).first()
+    yield 'blog.index', {}, Post.query, 'BLUELOG_POST_PER_PAGE', False
+    yield 'blog.show_category', {'category_id': category.id}, Post.query.with_parent(category), \
+        'BLUELOG_POST_PER_PAGE', False
+    # the post page paginates the threads, replies are shown under their top level comment
+    yield 'blog.show_post', {'post_id': post.id}, \
+        Comment.query.with_parent(post).filter_by(reviewed=True, depth=0), 'BLUELOG_COMMENT_PER_PAGE', True
+    yield 'admin.manage_post', {}, Post.query, 'BLUELOG_MANAGE_POST_PER_PAGE', False
+    yield 'admin.manage_comment', {'filter': 'all'}, Comment.query, 'BLUELOG_COMMENT_PER_PAGE', False
+
+
+def pages(app, endpoint, view_args, query, per_page_key, ascending):
+    """Return ``[(depth, url)]``: the first page, and the last page by offset and by cursor."""
+    per_page = app.config[per_page_key]
+    total = query.count()
+    offset = max(int(math.ceil(total / float(per_page))) - 1, 0) * per_page
+    urls = [('first', url_for(endpoint, **view_args)),
+            ('deep-offset', url_for(endpoint, page=offset // per_page + 1, **view_args))]
+    if offset:
+        model = query.column_descriptions[0]['entity']
+        order = [model.timestamp, model.id] if ascending else [model.timestamp.desc(), model.id.desc()]
+        item = query.order_by(*order).offset(offset - 1).first()
+        urls.append(('deep-cursor', url_for(endpoint, cursor=encode_cursor('after', item, offset), **view_args)))
+    return urls
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class QueryCounter(object):
+    """Count the statements an engine executes."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def measure(client, url, repeat, counter):
+    client.get(url)
+    durations = []
+    queries = 0
+    for i in range(repeat):
+        before = counter.count
+        started = time.perf_counter()
+        response = client.get(url)
+        durations.append((time.perf_counter() - started) * 1000)
+        queries = counter.count - before
+        if response.status_code != 200:
+            raise click.ClickException('%s returned %d' % (url, response.status_code))
+    return dict(p50=percentile(durations, 0.5), p90=percentile(durations, 0.9), p99=percentile(durations, 0.99),
+                mean=sum(durations) / len(durations), queries=queries)
+
+
+def run_size(name, counts, repeat, regenerate, workers):
+    app = make_app(name, counts, regenerate, workers)
+    with app.test_request_context():
+        login_url = url_for('auth.login')
+        targets = [(endpoint, depth, url) for endpoint, view_args, query, per_page_key, ascending in listings()
+                   for depth, url in pages(app, endpoint, view_args, query, per_page_key, ascending)]
+        engine = db.engine
+        db.session.remove()
+
+    # no outer context: like in production, every request gets its own g and session, nothing is served
+    # from the identity map of the previous ones
+    counter = QueryCounter(engine)
+    visitor = app.test_client()
+    admin = app.test_client()
+    admin.post(login_url, data=dict(username='admin', password='helloflask'))
+    results = []
+    for endpoint, depth, url in targets:
+        result = measure(admin if endpoint.startswith('admin.') else visitor, url, repeat, counter)
+        result.update(size=name, route=endpoint, depth=depth, url=url)
+        click.echo('%(size)6s %(route)-22s %(depth)-12s p50 %(p50)8.2fms  p90 %(p90)8.2fms  '
+                   'p99 %(p99)8.2fms  %(queries)3d queries' % result)
+        results.append(result)
+    engine.dispose()
+    return results
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=basedir,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, filename):
+    with open(filename) as f:
+        baseline = {(r['size'], r['route'], r['depth']): r for r in json.load(f)['results']}
+    click.echo('\nCompared with %s:' % filename)
+    for result in results:
+        old = baseline.get((result['size'], result['route'], result['depth']))
+        if old is not None:
+            click.echo('%6s %-22s %-12s p50 %+7.1f%%  p90 %+7.1f%%  queries %+d' % (
+                result['size'], result['route'], result['depth'],
+                (result['p50'] / old['p50'] - 1) * 100, (result['p90'] / old['p90'] - 1) * 100,
+                result['queries'] - old['queries']))
+
+
+@click.command()
+@click.option('--size', 'sizes', multiple=True, default=['1k'],
+              help='Data size: %s or POSTS:COMMENTS, repeatable, default is 1k.' % ', '.join(SIZES))
+@click.option('--repeat', default=20, help='Measured requests per page, default is 20.')
+@click.option('--regenerate', is_flag=True, help='Generate the databases again.')
+@click.option('--workers', default=os.cpu_count(), help='Processes generating the data, default is one per CPU.')
+@click.option('--output', type=click.Path(), help='Write the results to this JSON file.')
+@click.option('--compare', 'baseline', type=click.Path(exists=True),
+              help='Compare with the results of a previous run.')
+def main(sizes, repeat, regenerate, workers, output, baseline):
+    """Benchmark the main routes at several data sizes."""
+    results = []
+    for value in sizes:
+        name, counts = parse_size(value)
+        results.extend(run_size(name, counts, repeat, regenerate, workers))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(dict(revision=revision(), python=platform.python_version(), sqlite=sqlite3.sqlite_version,
+                           repeat=repeat, results=results), f, indent=2)
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,19 +7,22 @@
 """
 import logging
 import os
-from logging.handlers import SMTPHandler, RotatingFileHandler
+from logging.handlers import RotatingFileHandler
 
 import click
-from flask import Flask, render_template, request
+from flask import Flask, render_template
 from flask_login import current_user
-from flask_sqlalchemy import get_debug_queries
 from flask_wtf.csrf import CSRFError
 
 from bluelog.blueprints.admin import admin_bp
 from bluelog.blueprints.auth import auth_bp
 from bluelog.blueprints.blog import blog_bp
-from bluelog.extensions import bootstrap, db, login_manager, csrf, ckeditor, mail, moment, toolbar, migrate
+from bluelog.extensions import bootstrap, db, login_manager, csrf, ckeditor, mail, moment, toolbar, migrate, cache, \
+    outbox, metrics, slowlog, search, assets, images, uploads, throttle
+from bluelog.freeze import freeze
+from bluelog.logqueue import LogQueue, DigestMailHandler
 from bluelog.models import Admin, Post, Category, Comment, Link
+from bluelog.pagination import count
 from bluelog.settings import config
 
 basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
@@ -36,22 +39,22 @@ def create_app(config_name=None):
     register_extensions(app)
     register_blueprints(app)
     register_commands(app)
+    register_maintenance_commands(app)
+    register_diagnostic_commands(app)
+    register_asset_commands(app)
+    register_export_commands(app)
     register_errors(app)
     register_shell_context(app)
     register_template_context(app)
-    register_request_handlers(app)
     return app
 
 
 def register_logging(app):
-    class RequestFormatter(logging.Formatter):
+    if app.debug or app.testing:
+        return
 
-        def format(self, record):
-            record.url = request.url
-            record.remote_addr = request.remote_addr
-            return super(RequestFormatter, self).format(record)
-
-    request_formatter = RequestFormatter(
+    # url and remote_addr are attached by the queue handler while the request is still around
+    request_formatter = logging.Formatter(
         '[%(asctime)s] %(remote_addr)s requested %(url)s\n'
         '%(levelname)s in %(module)s: %(message)s'
     )
@@ -63,18 +66,20 @@ def register_logging(app):
     file_handler.setFormatter(formatter)
     file_handler.setLevel(logging.INFO)
 
-    mail_handler = SMTPHandler(
+    mail_handler = DigestMailHandler(
         mailhost=app.config['MAIL_SERVER'],
         fromaddr=app.config['MAIL_USERNAME'],
-        toaddrs=['ADMIN_EMAIL'],
+        toaddrs=[app.config['BLUELOG_EMAIL']],
         subject='Bluelog Application Error',
-        credentials=(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD']))
+        credentials=(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD']),
+        window=app.config['BLUELOG_ERROR_MAIL_WINDOW'])
     mail_handler.setLevel(logging.ERROR)
     mail_handler.setFormatter(request_formatter)
 
-    if not app.debug:
-        app.logger.addHandler(mail_handler)
-        app.logger.addHandler(file_handler)
+    # errors are only mailed when there is someone to mail them to
+    handlers = [mail_handler, file_handler] if app.config['BLUELOG_EMAIL'] else [file_handler]
+    # the handlers run in a background thread, a failing request never waits for SMTP or disk
+    LogQueue(app, *handlers)
 
 
 def register_extensions(app):
@@ -87,6 +92,15 @@ def register_extensions(app):
     moment.init_app(app)
     toolbar.init_app(app)
     migrate.init_app(app, db)
+    cache.init_app(app, db)
+    search.init_app(app, db)
+    outbox.init_app(app, db, mail)
+    slowlog.init_app(app)
+    metrics.init_app(app, slowlog)
+    assets.init_app(app)
+    images.init_app(app, cache)
+    uploads.init_app(app)
+    throttle.init_app(app)
 
 
 def register_blueprints(app):
@@ -104,11 +118,11 @@ def register_shell_context(app):
 def register_template_context(app):
     @app.context_processor
     def make_template_context():
-        admin = Admin.query.first()
-        categories = Category.query.order_by(Category.name).all()
-        links = Link.query.order_by(Link.name).all()
+        admin = Admin.get_settings()
+        categories = Category.get_all()
+        links = Link.get_all()
         if current_user.is_authenticated:
-            unread_comments = Comment.query.filter_by(reviewed=False).count()
+            unread_comments = count(Comment.query.filter_by(reviewed=False), Comment, ('unread', None))
         else:
             unread_comments = None
         return dict(
@@ -186,9 +200,15 @@ def register_commands(app):
     @click.option('--category', default=10, help='Quantity of categories, default is 10.')
     @click.option('--post', default=50, help='Quantity of posts, default is 50.')
     @click.option('--comment', default=500, help='Quantity of comments, default is 500.')
-    def forge(category, post, comment):
+    @click.option('--scale', type=click.Choice(['1k', '10k', '100k']),
+                  help='Preset quantities: 1k, 10k or 100k posts with ten times as many comments.')
+    @click.option('--seed', type=int, help='Seed of the random data, the same seed gives the same data.')
+    @click.option('--workers', default=0, help='Processes generating the data, default is 0 (no pool).')
+    def forge(category, post, comment, scale, seed, workers):
         """Generate fake data."""
-        from bluelog.fakes import fake_admin, fake_categories, fake_posts, fake_comments, fake_links
+        from bluelog.fakes import SCALES, fake_admin, fake_categories, fake_posts, fake_comments, fake_links
+
+        category, post, comment = SCALES.get(scale, (category, post, comment))
 
         db.drop_all()
         db.create_all()
@@ -197,27 +217,124 @@ def register_commands(app):
         fake_admin()
 
         click.echo('Generating %d categories...' % category)
-        fake_categories(category)
+        fake_categories(category, seed)
 
         click.echo('Generating %d posts...' % post)
-        fake_posts(post)
+        fake_posts(post, seed, workers)
 
         click.echo('Generating %d comments...' % comment)
-        fake_comments(comment)
+        fake_comments(comment, seed, workers)
 
         click.echo('Generating links...')
         fake_links()
 
+        # the rows were inserted in bulk, behind the back of the cache and the search index
+        cache.bump('settings', 'categories', 'links', 'posts', 'post-counts', 'comment-counts')
+        search.rebuild()
+        click.echo('Done.')
+
+
+def register_maintenance_commands(app):
+    @app.cli.command()
+    def recount():
+        """Rebuild the post and comment counters."""
+        click.echo('Counting posts of each category...')
+        Category.recount()
+        click.echo('Counting reviewed comments of each post...')
+        Post.recount()
+        db.session.commit()
+        cache.bump('categories')
         click.echo('Done.')
 
+    @app.cli.command()
+    @click.option('--batch', default=500, help='Posts updated per commit, default is 500.')
+    def excerpts(batch):
+        """Rebuild the excerpts of all posts."""
+        total = Post.rebuild_excerpts(batch)
+        click.echo('Updated %d excerpts.' % total)
+
+    @app.cli.command()
+    @click.option('--batch', default=500, help='Posts updated per commit, default is 500.')
+    def rerender(batch):
+        """Render the HTML of all posts again, after a change to the body transforms."""
+        total, changed = Post.rerender(batch)
+        click.echo('Rendered %d posts, %d changed.' % (total, changed))
 
-def register_request_handlers(app):
-    @app.after_request
-    def query_profiler(response):
-        for q in get_debug_queries():
-            if q.duration >= app.config['BLUELOG_SLOW_QUERY_THRESHOLD']:
-                app.logger.warning(
-                    'Slow query: Duration: %fs\n Context: %s\nQuery: %s\n '
-                    % (q.duration, q.context, q.statement)
-                )
-        return response
+    @app.cli.command()
+    @click.option('--batch', default=500, help='Posts indexed per statement, default is 500.')
+    def reindex(batch):
+        """Rebuild the full-text search index."""
+        total = search.rebuild(batch)
+        click.echo('Indexed %d posts.' % total if search.available() else
+                   'Full-text search is not available, searches use LIKE.')
+
+    @app.cli.command('outbox')
+    def deliver_outbox():
+        """Send the mails waiting in the outbox."""
+        sent, failed = outbox.flush()
+        click.echo('Sent %d mails, %d failed.' % (sent, failed))
+
+
+def register_diagnostic_commands(app):
+    @app.cli.command('slowlog')
+    @click.option('--limit', default=10, help='Number of queries shown, default is 10.')
+    @click.option('--sort', type=click.Choice(['total', 'max', 'count', 'slow']), default='total',
+                  help='Order of the queries, default is total time.')
+    @click.option('--reset', is_flag=True, help='Clear the statistics of all processes.')
+    def show_slowlog(limit, sort, reset):
+        """Show the queries that take the most time."""
+        if reset:
+            slowlog.reset()
+            click.echo('Cleared the slow query log.')
+            return
+        entries = sorted(slowlog.entries().items(), key=lambda item: item[1][sort], reverse=True)
+        for key, stats in entries[:limit]:
+            click.echo('%(count)d queries, %(slow)d slow, %(total).3fs total, %(max).3fs max' % stats)
+            click.echo('  %s' % key)
+            if stats['plan']:
+                click.echo('  ' + stats['plan'].replace('\n', '\n  '))
+        if not entries:
+            click.echo('No queries recorded.')
+
+
+def register_asset_commands(app):
+    @app.cli.group('assets')
+    def assets_group():
+        """Build the static assets."""
+
+    @assets_group.command('build')
+    def build_assets():
+        """Copy the static assets under hashed names with compressed variants."""
+        manifest = assets.build()
+        click.echo('Built %d assets in %s.' % (len(manifest), app.config['BLUELOG_ASSETS_PATH']))
+
+    @app.cli.group('images')
+    def images_group():
+        """Manage the variants of the uploaded images."""
+
+    @images_group.command('backfill')
+    @click.option('--force', is_flag=True, help='Make the variants of the images that already have them again.')
+    @click.option('--workers', default=0, help='Processes resizing the images, default is 0 (no pool).')
+    def backfill_images(force, workers):
+        """Make the resized and WebP variants of the images already uploaded."""
+        if not images.available:
+            raise click.ClickException('Pillow is not installed.')
+        total, errors = images.backfill(force, workers)
+        for error in errors:
+            click.echo('Failed: %s' % error, err=True)
+        click.echo('Processed %d images, %d failed.' % (total, len(errors)))
+
+
+def register_export_commands(app):
+    @app.cli.command('freeze')
+    @click.option('--output', type=click.Path(file_okay=False), help='Directory of the pages, default is frozen/.')
+    @click.option('--base-url', help='Root URL of the blog, used for the absolute links.')
+    @click.option('--workers', default=0, help='Processes rendering the pages, default is 0 (no pool).')
+    @click.option('--force', is_flag=True, help='Render all the pages, not only those that changed.')
+    def freeze_site(output, base_url, workers, force):
+        """Render the public pages to plain HTML files."""
+        rendered, kept, removed, failed = freeze(output or app.config['BLUELOG_FREEZE_PATH'],
+                                                 base_url or app.config['BLUELOG_FREEZE_BASE_URL'], workers, force)
+        for url, status in failed:
+            click.echo('Failed: %s %s' % (url, status), err=True)
+        click.echo('Rendered %d pages, %d unchanged, %d removed, %d failed.' % (rendered, kept, removed, len(failed)))
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import current_app, request, abort, send_file, safe_join
+
+try:
+    import brotli
+except ImportError:  # brotli variants are only built when the package is installed
+    brotli = None
+
+# built assets are served under /static/dist/
+PREFIX = 'dist/'
+MANIFEST = 'manifest.json'
+ASSET_EXTENSIONS = ('.css', '.js', '.ico', '.svg', '.png', '.gif', '.jpg', '.woff', '.woff2')
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.ico', '.svg')
+# the content of a hashed file never changes, it may be cached for a year
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+def hashed_name(filename, data):
+    """Return ``filename`` with the first 12 hex digits of the SHA-256 of ``data`` before the extension."""
+    root, ext = os.path.splitext(filename)
+    return '%s.%s%s' % (root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def compress(data):
+    """Return the precompressed variants of ``data`` that are smaller than it, by suffix."""
+    variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return dict((suffix, value) for suffix, value in variants.items() if len(value) < len(data))
+
+
+def write_file(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def iter_sources(static_folder, sources):
+    """Yield the paths, relative to the static folder, of the asset files in ``sources``."""
+    for source in sources:
+        path = os.path.join(static_folder, source)
+        if os.path.isfile(path):
+            yield source
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.endswith(ASSET_EXTENSIONS):
+                    yield os.path.relpath(os.path.join(root, filename), static_folder).replace(os.sep, '/')
+
+
+def build(static_folder, output_path, sources):
+    """Copy the assets to ``output_path`` under content-hashed names, along with their compressed variants.
+
+    Files that are already there are left alone, so pages rendered before a
+    build keep working. Return the manifest, which maps each source name to
+    its hashed name, after writing it to ``output_path``.
+    """
+    manifest = {}
+    for filename in iter_sources(static_folder, sources):
+        with open(os.path.join(static_folder, filename), 'rb') as f:
+            data = f.read()
+        manifest[filename] = name = hashed_name(filename, data)
+        path = os.path.join(output_path, name)
+        if os.path.exists(path):
+            continue
+        if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+            for suffix, value in compress(data).items():
+                write_file(path + suffix, value)
+        # the hashed file comes last, its presence means the variants are complete
+        write_file(path, data)
+    write_file(os.path.join(output_path, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+class Assets(object):
+    """Serve the static files built by ``flask assets build``.
+
+    When ``BLUELOG_ASSETS_MANIFEST`` is set, ``url_for('static', filename=...)``
+    resolves the files listed in the manifest to their hashed copies under
+    ``/static/dist/``, which are served with year-long immutable caching and
+    in their brotli or gzip variant when the client accepts it. Files missing
+    from the manifest keep their usual URL.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BLUELOG_ASSETS_PATH', os.path.join(app.static_folder, 'dist'))
+        app.config.setdefault('BLUELOG_ASSETS_SOURCES', ['css', 'js', 'favicon.ico'])
+        app.config.setdefault('BLUELOG_ASSETS_MANIFEST', False)
+        app.extensions['bluelog_assets'] = {'manifest': None}
+        app.url_defaults(self._resolve)
+        app.view_functions['static'] = self.send_static_file
+
+    def manifest(self):
+        """Return the manifest of the last build, an empty one if there was none."""
+        state = current_app.extensions['bluelog_assets']
+        if state['manifest'] is None:
+            try:
+                with open(os.path.join(current_app.config['BLUELOG_ASSETS_PATH'], MANIFEST)) as f:
+                    state['manifest'] = json.load(f)
+            except (IOError, OSError, ValueError):
+                state['manifest'] = {}
+        return state['manifest']
+
+    def build(self):
+        manifest = build(current_app.static_folder, current_app.config['BLUELOG_ASSETS_PATH'],
+                         current_app.config['BLUELOG_ASSETS_SOURCES'])
+        current_app.extensions['bluelog_assets']['manifest'] = manifest
+        return manifest
+
+    def _resolve(self, endpoint, values):
+        if endpoint == 'static' and current_app.config['BLUELOG_ASSETS_MANIFEST']:
+            name = self.manifest().get(values.get('filename'))
+            if name is not None:
+                values['filename'] = PREFIX + name
+
+    def send_static_file(self, filename):
+        if not filename.startswith(PREFIX):
+            return current_app.send_static_file(filename)
+
+        path = safe_join(current_app.config['BLUELOG_ASSETS_PATH'], filename[len(PREFIX):])
+        if not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        encoding = None
+        for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[name] and os.path.isfile(path + suffix):
+                encoding, path = name, path + suffix
+                break
+        response = send_file(path, mimetype=mimetype, conditional=True, cache_timeout=ONE_YEAR)
+        if encoding is not None:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
@@ -6,14 +6,16 @@
     :license: MIT, see LICENSE for more details.
 """
 import os
+from datetime import datetime, timedelta
 
-from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint, send_from_directory
+from flask import render_template, flash, redirect, url_for, request, current_app, Blueprint, abort
 from flask_login import login_required, current_user
 from flask_ckeditor import upload_success, upload_fail
 
-from bluelog.extensions import db
+from bluelog.extensions import db, cache, images, uploads
 from bluelog.forms import SettingForm, PostForm, CategoryForm, LinkForm
 from bluelog.models import Post, Category, Comment, Link
+from bluelog.pagination import paginate
 from bluelog.utils import redirect_back, allowed_file
 
 admin_bp = Blueprint('admin', __name__)
@@ -41,11 +43,10 @@ def settings():
 @admin_bp.route('/post/manage')
 @login_required
 def manage_post():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['BLUELOG_MANAGE_POST_PER_PAGE'])
+    pagination = paginate(Post.query.options(db.joinedload(Post.category), db.defer(Post.body_html)), Post,
+                          current_app.config['BLUELOG_MANAGE_POST_PER_PAGE'], count_key=('all', None))
     posts = pagination.items
-    return render_template('admin/manage_post.html', page=page, pagination=pagination, posts=posts)
+    return render_template('admin/manage_post.html', pagination=pagination, posts=posts)
 
 
 @admin_bp.route('/post/new', methods=['GET', 'POST'])
@@ -60,6 +61,7 @@ def new_post():
         # same with:
         # category_id = form.category.data
         # post = Post(title=title, body=body, category_id=category_id)
+        category.post_count = Category.post_count + 1
         db.session.add(post)
         db.session.commit()
         flash('Post created.', 'success')
@@ -75,7 +77,12 @@ def edit_post(post_id):
     if form.validate_on_submit():
         post.title = form.title.data
         post.body = form.body.data
-        post.category = Category.query.get(form.category.data)
+        if post.category_id != form.category.data:
+            category = Category.query.get(form.category.data)
+            if post.category is not None:
+                post.category.post_count = Category.post_count - 1
+            category.post_count = Category.post_count + 1
+            post.category = category
         db.session.commit()
         flash('Post updated.', 'success')
         return redirect(url_for('blog.show_post', post_id=post.id))
@@ -89,6 +96,8 @@ def edit_post(post_id):
 @login_required
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
+    if post.category is not None:
+        post.category.post_count = Category.post_count - 1
     db.session.delete(post)
     db.session.commit()
     flash('Post deleted.', 'success')
@@ -113,16 +122,16 @@ def set_comment(post_id):
 @login_required
 def manage_comment():
     filter_rule = request.args.get('filter', 'all')  # 'all', 'unreviewed', 'admin'
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config['BLUELOG_COMMENT_PER_PAGE']
     if filter_rule == 'unread':
         filtered_comments = Comment.query.filter_by(reviewed=False)
     elif filter_rule == 'admin':
         filtered_comments = Comment.query.filter_by(from_admin=True)
     else:
+        filter_rule = 'all'
         filtered_comments = Comment.query
 
-    pagination = filtered_comments.order_by(Comment.timestamp.desc()).paginate(page, per_page=per_page)
+    pagination = paginate(filtered_comments, Comment, per_page, count_key=(filter_rule, None))
     comments = pagination.items
     return render_template('admin/manage_comment.html', comments=comments, pagination=pagination)
 
@@ -131,7 +140,9 @@ def manage_comment():
 @login_required
 def approve_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
-    comment.reviewed = True
+    if not comment.reviewed:
+        comment.reviewed = True
+        comment.post.comment_count = Post.comment_count + 1
     db.session.commit()
     flash('Comment published.', 'success')
     return redirect_back()
@@ -141,12 +152,52 @@ def approve_comment(comment_id):
 @login_required
 def delete_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
-    db.session.delete(comment)
+    comment.delete()
     db.session.commit()
     flash('Comment deleted.', 'success')
     return redirect_back()
 
 
+def select_comments(form):
+    """Return the query of the comments picked in the bulk moderation form, None if nothing was picked.
+
+    Checked comments win over the filter, which is the current tab narrowed by
+    the age, email and site fields; the "All" tab needs at least one field.
+    """
+    ids = form.getlist('ids', type=int)
+    if ids:
+        return Comment.query.filter(Comment.id.in_(ids))
+    criteria = {'unread': Comment.reviewed == db.false(), 'admin': Comment.from_admin == db.true()}
+    criteria = [criteria[form['filter']]] if form.get('filter') in criteria else []
+    days = form.get('older_than', type=int)
+    if days:
+        criteria.append(Comment.timestamp < datetime.utcnow() - timedelta(days=days))
+    criteria.extend(getattr(Comment, field) == form[field].strip() for field in ('email', 'site')
+                    if form.get(field, '').strip())
+    return Comment.query.filter(*criteria) if criteria else None
+
+
+@admin_bp.route('/comment/bulk', methods=['POST'])
+@login_required
+def bulk_comment():
+    action = request.form.get('action')
+    if action not in ('approve', 'delete'):
+        abort(400)
+    query = select_comments(request.form)
+    if query is None:
+        flash('Check some comments or fill in the filter first.', 'warning')
+        return redirect_back()
+    if action == 'approve':
+        count, post_ids = Comment.approve_all(query)
+    else:
+        count, post_ids = Comment.delete_all(query)
+    db.session.commit()
+    # the bulk statements bypass the session events that bump the cache
+    cache.bump('comment-counts', 'posts', *['post-%s' % post_id for post_id in post_ids])
+    flash('%d comment(s) %s.' % (count, 'published' if action == 'approve' else 'deleted'), 'success')
+    return redirect_back()
+
+
 @admin_bp.route('/category/manage')
 @login_required
 def manage_category():
@@ -246,7 +297,7 @@ def delete_link(link_id):
 
 @admin_bp.route('/uploads/<path:filename>')
 def get_image(filename):
-    return send_from_directory(current_app.config['BLUELOG_UPLOAD_PATH'], filename)
+    return uploads.send(filename)
 
 
 @admin_bp.route('/upload', methods=['POST'])
@@ -255,5 +306,6 @@ def upload_image():
     if not allowed_file(f.filename):
         return upload_fail('Image only!')
     f.save(os.path.join(current_app.config['BLUELOG_UPLOAD_PATH'], f.filename))
+    images.generate(f.filename)
     url = url_for('.get_image', filename=f.filename)
     return upload_success(url, f.filename)
@@ -8,6 +8,7 @@
 from flask import render_template, flash, redirect, url_for, Blueprint
 from flask_login import login_user, logout_user, login_required, current_user
 
+from bluelog.extensions import throttle
 from bluelog.forms import LoginForm
 from bluelog.models import Admin
 from bluelog.utils import redirect_back
@@ -25,12 +26,19 @@ def login():
         username = form.username.data
         password = form.password.data
         remember = form.remember.data
-        admin = Admin.query.first()
+        # checking a password hash is slow on purpose, turn away the floods of guesses before it
+        wait = throttle.check(username)
+        if wait:
+            flash('Too many failed attempts, please try again in %d seconds.' % wait, 'warning')
+            return render_template('auth/login.html', form=form), 429, {'Retry-After': str(wait)}
+        admin = Admin.get_current()
         if admin:
             if username == admin.username and admin.validate_password(password):
+                throttle.succeed(username)
                 login_user(admin, remember)
                 flash('Welcome back.', 'info')
                 return redirect_back()
+            throttle.fail(username)
             flash('Invalid username or password.', 'warning')
         else:
             flash('No account.', 'warning')
@@ -9,46 +9,83 @@ from flask import render_template, flash, redirect, url_for, request, current_ap
 from flask_login import current_user
 
 from bluelog.emails import send_new_comment_email, send_new_reply_email
-from bluelog.extensions import db
+from bluelog.extensions import db, search as search_index
+from bluelog.feeds import feed_response
 from bluelog.forms import CommentForm, AdminCommentForm
 from bluelog.models import Post, Category, Comment
+from bluelog.pagecache import cached_page
+from bluelog.pagination import paginate
 from bluelog.utils import redirect_back
 
 blog_bp = Blueprint('blog', __name__)
 
 
 @blog_bp.route('/')
+@cached_page('posts')
 def index():
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config['BLUELOG_POST_PER_PAGE']
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(page, per_page=per_page)
+    query = Post.query.options(db.joinedload(Post.category), db.defer(Post.body), db.defer(Post.body_html))
+    pagination = paginate(query, Post, per_page, count_key=('all', None))
     posts = pagination.items
     return render_template('blog/index.html', pagination=pagination, posts=posts)
 
 
 @blog_bp.route('/about')
+@cached_page()
 def about():
     return render_template('blog/about.html')
 
 
 @blog_bp.route('/category/<int:category_id>')
+@cached_page('posts')
 def show_category(category_id):
     category = Category.query.get_or_404(category_id)
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config['BLUELOG_POST_PER_PAGE']
-    pagination = Post.query.with_parent(category).order_by(Post.timestamp.desc()).paginate(page, per_page)
+    # post.category is resolved from the identity map, the category is already loaded
+    query = Post.query.with_parent(category).options(db.defer(Post.body), db.defer(Post.body_html))
+    pagination = paginate(query, Post, per_page, count_key=('category', category.id))
     posts = pagination.items
     return render_template('blog/category.html', category=category, pagination=pagination, posts=posts)
 
 
+@blog_bp.route('/feed.atom')
+@blog_bp.route('/category/<int:category_id>/feed.atom')
+def feed(category_id=None):
+    return feed_response(category_id)
+
+
+@blog_bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        abort(404)
+    pagination = search_index.search(q, page, current_app.config['BLUELOG_POST_PER_PAGE'])
+    if not pagination.items and page != 1:
+        abort(404)
+    return render_template('blog/search.html', q=q, pagination=pagination, hits=pagination.items)
+
+
+def get_replied_comment(post):
+    """Return the comment of ``post`` given in the ``reply`` argument, None without one."""
+    replied_id = request.args.get('reply')
+    if not replied_id:
+        return None
+    replied_comment = Comment.query.get_or_404(replied_id)
+    if replied_comment.post_id != post.id:
+        abort(404)
+    return replied_comment
+
+
 @blog_bp.route('/post/<int:post_id>', methods=['GET', 'POST'])
+@cached_page('post-{post_id}', 'images')
 def show_post(post_id):
     post = Post.query.get_or_404(post_id)
-    page = request.args.get('page', 1, type=int)
     per_page = current_app.config['BLUELOG_COMMENT_PER_PAGE']
-    pagination = Comment.query.with_parent(post).filter_by(reviewed=True).order_by(Comment.timestamp.asc()).paginate(
-        page, per_page)
-    comments = pagination.items
+    # a page holds threads, the top level comments and all their replies
+    pagination = paginate(Comment.query.with_parent(post).filter_by(reviewed=True, depth=0), Comment, per_page,
+                          ascending=True, count_key=('threads', post.id))
+    threads = Comment.load_threads(pagination.items)
 
     if current_user.is_authenticated:
         form = AdminCommentForm()
@@ -67,23 +104,25 @@ def show_post(post_id):
         email = form.email.data
         site = form.site.data
         body = form.body.data
+        # looked up first, the query would flush the new comment before its thread is known
+        replied_comment = get_replied_comment(post)
         comment = Comment(
             author=author, email=email, site=site, body=body,
-            from_admin=from_admin, post=post, reviewed=reviewed)
-        replied_id = request.args.get('reply')
-        if replied_id:
-            replied_comment = Comment.query.get_or_404(replied_id)
-            comment.replied = replied_comment
+            from_admin=from_admin, post=post, reviewed=reviewed, replied=replied_comment)
+        if replied_comment is not None:
             send_new_reply_email(replied_comment)
+        if reviewed:
+            post.comment_count = Post.comment_count + 1
+        else:
+            send_new_comment_email(post)  # send notification email to admin
         db.session.add(comment)
         db.session.commit()
         if current_user.is_authenticated:  # send message based on authentication status
             flash('Comment published.', 'success')
         else:
             flash('Thanks, your comment will be published after reviewed.', 'info')
-            send_new_comment_email(post)  # send notification email to admin
         return redirect(url_for('.show_post', post_id=post_id))
-    return render_template('blog/post.html', post=post, pagination=pagination, form=form, comments=comments)
+    return render_template('blog/post.html', post=post, pagination=pagination, form=form, threads=threads)
 
 
 @blog_bp.route('/reply/comment/<int:comment_id>')
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app, g
+from sqlalchemy import event
+
+
+class _CacheState(object):
+
+    def __init__(self, max_entries, version_path, limits=None):
+        self.max_entries = max_entries
+        self.version_path = version_path
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.versions = {}
+        # namespaces bounded on their own, their entries never evict the shared ones
+        self.limits = limits or {}
+        self.stores = dict((namespace, OrderedDict()) for namespace in self.limits)
+
+    def store(self, namespace):
+        """Return the entries holding ``namespace`` and how many they may hold."""
+        if namespace in self.stores:
+            return self.stores[namespace], self.limits[namespace]
+        return self.entries, self.max_entries
+
+
+class Cache(object):
+    """A per-process cache for data that is read far more often than it changes.
+
+    Every entry belongs to a namespace and remembers the namespace version it
+    was created with; bumping the version invalidates all entries of the
+    namespace at once. Whole pages are kept apart from the other entries, at
+    most ``BLUELOG_PAGE_CACHE_MAX_ENTRIES`` of them, so a crawler walking the
+    listings cannot push out the data every request needs. When ``BLUELOG_CACHE_VERSION_PATH`` is set, versions
+    are stored as small files in that directory so a bump in one worker
+    process is seen by all the others.
+
+    When a database is given, every committed ORM write bumps the namespaces
+    returned by the ``cache_namespaces()`` method of the changed instances;
+    instances only dirty because of a collection are left out.
+    Bulk ``Query.update()``/``Query.delete()`` calls bypass this and have to
+    call :meth:`bump` themselves.
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        app.config.setdefault('BLUELOG_CACHE_MAX_ENTRIES', 1024)
+        app.config.setdefault('BLUELOG_PAGE_CACHE_MAX_ENTRIES', 256)
+        app.config.setdefault('BLUELOG_CACHE_VERSION_PATH', None)
+        version_path = app.config['BLUELOG_CACHE_VERSION_PATH']
+        if version_path is not None and not os.path.isdir(version_path):
+            os.makedirs(version_path)
+        app.extensions['bluelog_cache'] = _CacheState(app.config['BLUELOG_CACHE_MAX_ENTRIES'], version_path,
+                                                      {'pages': app.config['BLUELOG_PAGE_CACHE_MAX_ENTRIES']})
+        if db is not None and not event.contains(db.session, 'after_flush', self._collect_namespaces):
+            event.listen(db.session, 'after_flush', self._collect_namespaces)
+            event.listen(db.session, 'after_commit', self._bump_collected)
+            event.listen(db.session, 'after_rollback', self._discard_collected)
+
+    def _collect_namespaces(self, session, flush_context):
+        pending = session.info.setdefault('cache_namespaces', set())
+        # adding a comment makes its post dirty through the backref, without changing anything the post shows
+        dirty = [instance for instance in session.dirty if session.is_modified(instance, include_collections=False)]
+        for instance in list(session.new) + dirty + list(session.deleted):
+            get_namespaces = getattr(instance, 'cache_namespaces', None)
+            if get_namespaces is not None:
+                pending.update(get_namespaces())
+
+    def _bump_collected(self, session):
+        pending = session.info.pop('cache_namespaces', None)
+        if pending and current_app:
+            self.bump(*pending)
+
+    def _discard_collected(self, session):
+        session.info.pop('cache_namespaces', None)
+
+    @property
+    def _state(self):
+        return current_app.extensions['bluelog_cache']
+
+    def _read_version(self, state, namespace):
+        if state.version_path is None:
+            return state.versions.get(namespace, 0)
+        try:
+            with open(os.path.join(state.version_path, namespace)) as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def version(self, namespace):
+        """Return the current version of a namespace, read at most once per request."""
+        versions = g.setdefault('_cache_versions', {})
+        if namespace not in versions:
+            versions[namespace] = self._read_version(self._state, namespace)
+        return versions[namespace]
+
+    def bump(self, *namespaces):
+        """Invalidate every entry of the given namespaces."""
+        state = self._state
+        versions = g.setdefault('_cache_versions', {})
+        with state.lock:
+            for namespace in namespaces:
+                if state.version_path is None:
+                    state.versions[namespace] = state.versions.get(namespace, 0) + 1
+                else:
+                    filename = os.path.join(state.version_path, namespace)
+                    temp_filename = '%s.%d.tmp' % (filename, os.getpid())
+                    with open(temp_filename, 'w') as f:
+                        f.write(uuid.uuid4().hex)
+                    os.replace(temp_filename, filename)
+                versions.pop(namespace, None)
+
+    def get(self, namespace, key, creator, tolerance=None):
+        """Return the cached value for ``key``, calling ``creator`` to build it when it is missing or stale.
+
+        With ``tolerance`` (in seconds), an entry younger than that is served
+        even if its namespace has been bumped since it was created.
+        """
+        state = self._state
+        version = self.version(namespace)
+        entries = state.store(namespace)[0]
+        with state.lock:
+            entry = entries.get((namespace, key))
+            if entry is not None and (entry[0] == version or
+                                      tolerance is not None and time.time() - entry[2] < tolerance):
+                entries.move_to_end((namespace, key))
+                return entry[1]
+        value = creator()
+        self.set(namespace, key, value, version)
+        return value
+
+    def lookup(self, namespace, key):
+        """Return the cached value for ``key`` if it is still current, otherwise None."""
+        state = self._state
+        version = self.version(namespace)
+        entries = state.store(namespace)[0]
+        with state.lock:
+            entry = entries.get((namespace, key))
+            if entry is None or entry[0] != version:
+                return None
+            entries.move_to_end((namespace, key))
+            return entry[1]
+
+    def set(self, namespace, key, value, version=None):
+        state = self._state
+        if version is None:
+            version = self.version(namespace)
+        entries, max_entries = state.store(namespace)
+        with state.lock:
+            entries[(namespace, key)] = (version, value, time.time())
+            entries.move_to_end((namespace, key))
+            while len(entries) > max_entries:
+                entries.popitem(last=False)
+
+    def clear(self):
+        state = self._state
+        with state.lock:
+            state.entries.clear()
+            for entries in state.stores.values():
+                entries.clear()
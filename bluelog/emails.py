@@ -5,25 +5,14 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from threading import Thread
-
 from flask import url_for, current_app
-from flask_mail import Message
-
-from bluelog.extensions import mail
-
 
-def _send_async_mail(app, message):
-    with app.app_context():
-        mail.send(message)
+from bluelog.extensions import outbox
 
 
 def send_mail(subject, to, html):
-    app = current_app._get_current_object()
-    message = Message(subject, recipients=[to], html=html)
-    thr = Thread(target=_send_async_mail, args=[app, message])
-    thr.start()
-    return thr
+    """Queue a mail in the outbox, it is delivered in the background once the transaction is committed."""
+    return outbox.enqueue(subject, to, html)
 
 
 def send_new_comment_email(post):
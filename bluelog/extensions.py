@@ -15,6 +15,16 @@ from flask_wtf import CSRFProtect
 from flask_debugtoolbar import DebugToolbarExtension
 from flask_migrate import Migrate
 
+from bluelog.assets import Assets
+from bluelog.caching import Cache
+from bluelog.images import Images
+from bluelog.metrics import Metrics
+from bluelog.outbox import Outbox
+from bluelog.search import Search
+from bluelog.slowlog import SlowLog
+from bluelog.throttle import Throttle
+from bluelog.uploads import Uploads
+
 bootstrap = Bootstrap()
 db = SQLAlchemy()
 login_manager = LoginManager()
@@ -24,12 +34,24 @@ mail = Mail()
 moment = Moment()
 toolbar = DebugToolbarExtension()
 migrate = Migrate()
+cache = Cache()
+outbox = Outbox()
+metrics = Metrics()
+slowlog = SlowLog()
+search = Search()
+assets = Assets()
+images = Images()
+uploads = Uploads()
+throttle = Throttle()
 
 
 @login_manager.user_loader
 def load_user(user_id):
     from bluelog.models import Admin
-    user = Admin.query.get(int(user_id))
+    # the only user is the administrator, shared with the views of the request
+    user = Admin.get_current()
+    if user is None or user.id != int(user_id):
+        return None
     return user
 
 
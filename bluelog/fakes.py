@@ -6,14 +6,98 @@
     :license: MIT, see LICENSE for more details.
 """
 import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
 
 from faker import Faker
-from sqlalchemy.exc import IntegrityError
 
 from bluelog.extensions import db
-from bluelog.models import Admin, Category, Post, Comment, Link
+from bluelog.models import Admin, Category, Post, Comment, Link, make_excerpt
+from bluelog.pipeline import render_body
+
+# name: (categories, posts, comments)
+SCALES = {
+    '1k': (10, 1000, 10000),
+    '10k': (20, 10000, 100000),
+    '100k': (50, 100000, 1000000),
+}
+CHUNK_SIZE = 1000
+# Faker is slow, every chunk draws its values from this many pregenerated ones
+POOL_SIZE = 50
+YEAR = 365 * 24 * 60 * 60
+
+
+def chunk_faker(seed, kind, start):
+    """Return a Faker seeded for one chunk, so a chunk is the same wherever and in whatever order it is built."""
+    generator = Faker()
+    generator.seed_instance('%s-%s-%d' % (seed, kind, start))
+    return generator
+
+
+def timestamp(generator, end):
+    return end - timedelta(seconds=generator.random.randint(0, YEAR))
+
+
+def pool(method):
+    return [method() for i in range(POOL_SIZE)]
+
+
+def post_rows(chunk, seed, end, categories):
+    start, count = chunk
+    generator = chunk_faker(seed, 'post', start)
+    titles = pool(generator.sentence)
+    paragraphs = pool(partial(generator.paragraph, nb_sentences=10))
+    rows = []
+    for post_id in range(start + 1, start + count + 1):
+        body = '\n'.join(generator.random.sample(paragraphs, 5))
+        rows.append(dict(id=post_id, title=generator.random.choice(titles), body=body, excerpt=make_excerpt(body),
+                         body_html=render_body(body), timestamp=timestamp(generator, end), can_comment=True,
+                         comment_count=0, category_id=generator.random.randint(1, categories)))
+    return rows
+
+
+def comment_rows(chunk, seed, end, posts, kinds):
+    """Build the comments of a chunk; ``kinds`` maps the first id of each kind of comment to its kind."""
+    start, count = chunk
+    generator = chunk_faker(seed, 'comment', start)
+    choice = generator.random.choice
+    names, emails, urls = pool(generator.name), pool(generator.email), pool(generator.url)
+    sentences = pool(generator.sentence)
+    rows = []
+    for comment_id in range(start + 1, start + count + 1):
+        kind = [kind for first_id, kind in kinds if comment_id >= first_id][-1]
+        row = dict(id=comment_id, author=choice(names), email=choice(emails), site=choice(urls),
+                   body=choice(sentences), timestamp=timestamp(generator, end), from_admin=False,
+                   reviewed=kind != 'unreviewed', replied_id=None, post_id=generator.random.randint(1, posts))
+        if kind == 'admin':
+            row.update(author='Mima Kirigoe', email='mima@example.com', site='example.com', from_admin=True)
+        elif kind == 'reply':
+            row['replied_id'] = generator.random.randint(1, kinds[-1][0] - 1)
+        rows.append(row)
+    return rows
+
+
+def bulk_insert(model, generate, total, workers=0):
+    """Insert ``total`` rows built by ``generate(chunk)`` in chunks, building the chunks in ``workers`` processes."""
+    chunks = [(start, min(CHUNK_SIZE, total - start)) for start in range(0, total, CHUNK_SIZE)]
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            for rows in pool.map(generate, chunks):
+                db.session.execute(model.__table__.insert(), rows)
+    else:
+        for rows in map(generate, chunks):
+            db.session.execute(model.__table__.insert(), rows)
+    db.session.commit()
+
+
+def make_seed(seed):
+    return random.randrange(2 ** 32) if seed is None else seed
 
-fake = Faker()
+
+def end_of_timeline():
+    # timestamps are relative to the start of the day, the same seed gives the same rows all day long
+    return datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
 
 
 def fake_admin():
@@ -29,86 +113,41 @@ def fake_admin():
     db.session.commit()
 
 
-def fake_categories(count=10):
-    category = Category(name='Default')
-    db.session.add(category)
-
-    for i in range(count):
-        category = Category(name=fake.word())
-        db.session.add(category)
-        try:
-            db.session.commit()
-        except IntegrityError:
-            db.session.rollback()
-
+def fake_categories(count=10, seed=None):
+    generator = chunk_faker(make_seed(seed), 'category', 0)
+    names = ['Default']
+    while len(names) < count + 1:
+        name = generator.word()
+        if name in names:
+            name = '%s %d' % (name, len(names))
+        names.append(name)
+    db.session.add_all([Category(name=name) for name in names])
+    db.session.commit()
 
-def fake_posts(count=50):
-    for i in range(count):
-        post = Post(
-            title=fake.sentence(),
-            body=fake.text(2000),
-            category=Category.query.get(random.randint(1, Category.query.count())),
-            timestamp=fake.date_time_this_year()
-        )
 
-        db.session.add(post)
+def fake_posts(count=50, seed=None, workers=0):
+    generate = partial(post_rows, seed=make_seed(seed), end=end_of_timeline(), categories=Category.query.count())
+    bulk_insert(Post, generate, count, workers)
+    Category.recount()
     db.session.commit()
 
 
-def fake_comments(count=500):
-    for i in range(count):
-        comment = Comment(
-            author=fake.name(),
-            email=fake.email(),
-            site=fake.url(),
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            reviewed=True,
-            post=Post.query.get(random.randint(1, Post.query.count()))
-        )
-        db.session.add(comment)
-
+def fake_comments(count=500, seed=None, workers=0):
+    # reviewed comments, then 10% unreviewed ones, 10% from admin and 10% replies
     salt = int(count * 0.1)
-    for i in range(salt):
-        # unreviewed comments
-        comment = Comment(
-            author=fake.name(),
-            email=fake.email(),
-            site=fake.url(),
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            reviewed=False,
-            post=Post.query.get(random.randint(1, Post.query.count()))
-        )
-        db.session.add(comment)
-
-        # from admin
-        comment = Comment(
-            author='Mima Kirigoe',
-            email='mima@example.com',
-            site='example.com',
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            from_admin=True,
-            reviewed=True,
-            post=Post.query.get(random.randint(1, Post.query.count()))
-        )
-        db.session.add(comment)
-    db.session.commit()
-
-    # replies
-    for i in range(salt):
-        comment = Comment(
-            author=fake.name(),
-            email=fake.email(),
-            site=fake.url(),
-            body=fake.sentence(),
-            timestamp=fake.date_time_this_year(),
-            reviewed=True,
-            replied=Comment.query.get(random.randint(1, Comment.query.count())),
-            post=Post.query.get(random.randint(1, Post.query.count()))
-        )
-        db.session.add(comment)
+    kinds = [(1, 'reviewed'), (count + 1, 'unreviewed'), (count + salt + 1, 'admin'), (count + 2 * salt + 1, 'reply')]
+    generate = partial(comment_rows, seed=make_seed(seed), end=end_of_timeline(), posts=Post.query.count(),
+                       kinds=kinds)
+    bulk_insert(Comment, generate, count + 3 * salt, workers)
+
+    # a reply belongs to the post of the comment it replies to
+    replied = db.aliased(Comment)
+    post_id = db.select([replied.post_id]).where(replied.id == Comment.replied_id).as_scalar()
+    Comment.query.filter(Comment.replied_id.isnot(None)).update(
+        {Comment.post_id: post_id}, synchronize_session=False)
+    # the rows went in without the ORM, which sets the thread paths on insert
+    Comment.rebuild_paths()
+    Post.recount()
     db.session.commit()
 
 
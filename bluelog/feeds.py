@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+from datetime import datetime
+
+from flask import current_app, request, render_template
+
+from bluelog.extensions import db, cache
+from bluelog.models import Post, Category
+
+
+def build_feed(category_id=None):
+    """Render the Atom feed of the latest posts, return ``(body, etag, last_modified)``."""
+    query = Post.query.options(db.joinedload(Post.category), db.defer(Post.body))
+    category = None
+    if category_id is not None:
+        category = Category.query.get_or_404(category_id)
+        query = query.with_parent(category)
+    posts = query.order_by(Post.timestamp.desc(), Post.id.desc()).limit(current_app.config['BLUELOG_FEED_SIZE']).all()
+    now = datetime.utcnow().replace(microsecond=0)
+    body = render_template('blog/feed.xml', posts=posts, category=category,
+                           updated=posts[0].timestamp if posts else now).encode('utf-8')
+    # the posts have no update time, the feed changed when it was built
+    return body, hashlib.sha1(body).hexdigest(), now
+
+
+def feed_response(category_id=None):
+    """Serve a feed from the cache until the next post write, answering conditional requests with 304.
+
+    Neither a cached nor a not modified feed touches the database.
+    """
+    # the feed also shows the blog title and the category names
+    key = ('feed', category_id, cache.version('settings'), cache.version('categories'))
+    body, etag, last_modified = cache.get('posts', key, lambda: build_feed(category_id))
+    response = current_app.response_class(body, mimetype='application/atom+xml')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['BLUELOG_FEED_MAX_AGE']
+    return response.make_conditional(request)
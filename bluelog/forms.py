@@ -37,8 +37,7 @@ class PostForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(PostForm, self).__init__(*args, **kwargs)
-        self.category.choices = [(category.id, category.name)
-                                 for category in Category.query.order_by(Category.name).all()]
+        self.category.choices = [(category.id, category.name) for category in Category.get_all()]
 
 
 class CategoryForm(FlaskForm):
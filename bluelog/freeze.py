@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+import json
+import os
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, url_for
+
+from bluelog.assets import write_file
+from bluelog.extensions import db
+from bluelog.models import Admin, Category, Post, Comment, Link, PATH_SEGMENT
+
+MANIFEST = 'freeze-manifest.json'
+# pages rendered by a worker process per task
+CHUNK_SIZE = 50
+
+_worker_app = None
+
+
+def digest(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def page_filename(path, page=1):
+    """Return the file of page ``page`` of ``path``, ``post/1/index.html`` or ``post/1/page-2.html``."""
+    name = 'index.html' if page == 1 else 'page-%d.html' % page
+    return posixpath.join(path.strip('/'), name)
+
+
+def chrome_digest():
+    """The digest of what every page shows around its content: the blog settings and the sidebar."""
+    admin = db.session.query(Admin.blog_title, Admin.blog_sub_title, Admin.name, Admin.about).first()
+    categories = db.session.query(Category.id, Category.name, Category.post_count).order_by(Category.id)
+    links = db.session.query(Link.id, Link.name, Link.url).order_by(Link.id)
+    return digest(tuple(admin or ()), [tuple(row) for row in categories], [tuple(row) for row in links])
+
+
+def images_digest():
+    """The digest of the image variants, which post bodies link to."""
+    upload_path = current_app.config['BLUELOG_UPLOAD_PATH']
+    if not os.path.isdir(upload_path):
+        return None
+    return digest(sorted((filename, os.path.getmtime(os.path.join(upload_path, filename)))
+                         for filename in os.listdir(upload_path) if filename.endswith('.json')))
+
+
+def paged(path, rows, per_page, *parts):
+    """Yield ``(url, filename, digest)`` for each page of ``rows`` shown at ``path``."""
+    pages = max((len(rows) + per_page - 1) // per_page, 1)
+    for page in range(1, pages + 1):
+        # ?page= gives the offset pagination, whose links are the page numbers the files are named after
+        yield ('%s?page=%d' % (path, page), page_filename(path, page),
+               digest(parts, page, pages, rows[(page - 1) * per_page:page * per_page]))
+
+
+def listing_pages(chrome):
+    per_page = current_app.config['BLUELOG_POST_PER_PAGE']
+    listing = [tuple(row) for row in db.session.query(
+        Post.id, Post.title, Post.excerpt, Post.timestamp, Post.category_id, Post.comment_count).order_by(
+        Post.timestamp.desc(), Post.id.desc())]
+    for page in paged(url_for('blog.index'), listing, per_page, chrome):
+        yield page
+    by_category = {}
+    for row in listing:
+        by_category.setdefault(row[4], []).append(row)
+    for category_id, in db.session.query(Category.id).order_by(Category.id):
+        for page in paged(url_for('blog.show_category', category_id=category_id),
+                          by_category.get(category_id, []), per_page, chrome):
+            yield page
+
+
+def post_threads():
+    """Return the reviewed comments of each post, by thread, the threads in the order of the post pages."""
+    threads, roots = {}, {}
+    for row in db.session.query(Comment.post_id, Comment.path, Comment.depth, Comment.id, Comment.author, Comment.site,
+                                Comment.body, Comment.timestamp, Comment.from_admin, Comment.replied_id).filter(
+            Comment.reviewed == db.true()).order_by(Comment.path):
+        # the first segment of a path is the id of the top level comment
+        threads.setdefault(row.path[:len(PATH_SEGMENT % 0)], []).append(tuple(row))
+        if row.depth == 0:
+            roots.setdefault(row.post_id, []).append((row.timestamp, row.id, row.path))
+    return dict((post_id, [tuple(threads[path]) for timestamp, comment_id, path in sorted(post_roots)])
+                for post_id, post_roots in roots.items())
+
+
+def post_pages(chrome):
+    comments = post_threads()
+    images = images_digest()
+    # every page of a post shows its comment count
+    for post in db.session.query(Post.id, Post.title, Post.body_html, Post.timestamp, Post.category_id,
+                                 Post.can_comment, Post.comment_count).order_by(Post.id):
+        for page in paged(url_for('blog.show_post', post_id=post.id), comments.get(post.id, []),
+                          current_app.config['BLUELOG_COMMENT_PER_PAGE'], chrome, tuple(post), images):
+            yield page
+
+
+def site_pages():
+    """Yield ``(url, filename, digest)`` for every public page, the digest covering what the page shows."""
+    chrome = chrome_digest()
+    yield url_for('blog.about'), page_filename(url_for('blog.about')), chrome
+    for page in listing_pages(chrome):
+        yield page
+    for page in post_pages(chrome):
+        yield page
+
+
+def render_pages(app, pages, output_path, base_url):
+    """Render ``(url, filename)`` pairs to files, return ``(url, status)`` for the pages that failed."""
+    client = app.test_client()
+    failed = []
+    for url, filename in pages:
+        response = client.get(url, base_url=base_url)
+        if response.status_code != 200:
+            failed.append((url, response.status))
+        else:
+            write_file(os.path.join(output_path, filename), response.get_data())
+    return failed
+
+
+def _init_worker():
+    from bluelog import create_app
+
+    global _worker_app
+    _worker_app = create_app()
+
+
+def _render_chunk(args):
+    return render_pages(_worker_app, *args)
+
+
+def render(pages, output_path, base_url, workers=0):
+    if workers < 2:
+        return render_pages(current_app._get_current_object(), pages, output_path, base_url)
+    chunks = [(pages[start:start + CHUNK_SIZE], output_path, base_url) for start in range(0, len(pages), CHUNK_SIZE)]
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+        return [page for failed in pool.map(_render_chunk, chunks) for page in failed]
+
+
+def load_manifest(output_path):
+    try:
+        with open(os.path.join(output_path, MANIFEST)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def freeze(output_path, base_url, workers=0, force=False):
+    """Render the public pages of the blog to ``output_path``.
+
+    The digest of the data behind every page is kept in a manifest; later
+    runs only render the pages whose digest changed (or whose file is gone)
+    and remove the files of the pages that no longer exist. Return the
+    numbers of pages rendered, kept and removed, and ``(url, status)`` for
+    the pages that failed, which are tried again on the next run.
+    """
+    with current_app.test_request_context(base_url=base_url):
+        pages = list(site_pages())
+    old = load_manifest(output_path)
+    stale = [(url, filename) for url, filename, page_digest in pages if force or old.get(filename) != page_digest or
+             not os.path.exists(os.path.join(output_path, filename))]
+    failed = render(stale, output_path, base_url, workers)
+
+    failed_urls = set(url for url, status in failed)
+    manifest = dict((filename, page_digest) for url, filename, page_digest in pages if url not in failed_urls)
+    filenames = set(filename for url, filename, page_digest in pages)
+    removed = [filename for filename in old if filename not in filenames]
+    for filename in removed:
+        if os.path.exists(os.path.join(output_path, filename)):
+            os.remove(os.path.join(output_path, filename))
+    write_file(os.path.join(output_path, MANIFEST), json.dumps(manifest, indent=0, sort_keys=True).encode('utf-8'))
+    return len(stale) - len(failed), len(pages) - len(stale), len(removed), failed
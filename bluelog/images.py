@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+from flask import current_app, url_for, has_request_context
+from markupsafe import Markup, escape
+from werkzeug.security import safe_join
+from werkzeug.urls import url_unquote
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # without Pillow, uploads are only served as they are
+    Image = ImageOps = None
+
+# a broken or oversized upload fails on its own, the others are still processed
+IMAGE_ERRORS = (IOError, OSError, ValueError, Image.DecompressionBombError) if Image else (IOError, OSError)
+RESIZABLE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MIMETYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.webp': 'image/webp'}
+# photo-480w.jpg, photo-480w.webp
+VARIANT = re.compile(r'-\d+w\.(png|jpe?g|webp)$', re.IGNORECASE)
+IMG_TAG = re.compile(r'<img\b[^>]*>', re.IGNORECASE)
+SRC = re.compile(r'\ssrc="([^"]+)"', re.IGNORECASE)
+
+
+def variant_name(filename, width, ext=None):
+    root, original_ext = os.path.splitext(filename)
+    return '%s-%dw%s' % (root, width, ext or original_ext)
+
+
+def description_path(path):
+    """The file describing the variants of an image, next to it."""
+    return path + '.json'
+
+
+def is_original(filename):
+    return filename.lower().endswith(RESIZABLE_EXTENSIONS) and not VARIANT.search(filename)
+
+
+def _save(image, path, ext, quality):
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    if ext == '.webp':
+        image.save(temp_path, 'WEBP', quality=quality, method=6)
+    elif ext == '.png':
+        image.save(temp_path, 'PNG', optimize=True)
+    else:
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(temp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+    os.replace(temp_path, path)
+
+
+def make_variants(path, widths, quality=80):
+    """Write resized and WebP copies of the image at ``path`` next to it.
+
+    Every width narrower than the image gets a copy in the original format
+    and one in WebP; the full width only gets the WebP one. The variants are
+    described in a JSON file, written last, which is also returned.
+    """
+    directory, filename = os.path.split(path)
+    ext = os.path.splitext(filename)[1].lower()
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+        width, height = image.size
+        variants = [dict(name=filename, width=width, type=MIMETYPES[ext])]
+        for target in sorted(set(w for w in widths if w < width)) + [width]:
+            resized = image if target == width else image.resize(
+                (target, max(int(round(height * target / float(width))), 1)), Image.LANCZOS)
+            if target != width:
+                variants.append(dict(name=variant_name(filename, target), width=target, type=MIMETYPES[ext]))
+                _save(resized, os.path.join(directory, variants[-1]['name']), ext, quality)
+            variants.append(dict(name=variant_name(filename, target, '.webp'), width=target, type='image/webp'))
+            _save(resized, os.path.join(directory, variants[-1]['name']), '.webp', quality)
+    description = dict(width=width, height=height, variants=variants)
+    temp_path = '%s.%d.tmp' % (description_path(path), os.getpid())
+    with open(temp_path, 'w') as f:
+        json.dump(description, f)
+    os.replace(temp_path, description_path(path))
+    return description
+
+
+def _backfill_one(path, widths, quality):
+    try:
+        make_variants(path, widths, quality)
+    except IMAGE_ERRORS as e:
+        return '%s: %s' % (os.path.basename(path), e)
+    return None
+
+
+class _ImagesState(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+
+
+class Images(object):
+    """Generate resized and WebP variants of the uploaded images.
+
+    Each upload is handed to a pool of ``BLUELOG_IMAGE_WORKERS`` threads
+    (Pillow releases the GIL while it resizes and encodes), which writes a
+    copy of the image for each of ``BLUELOG_IMAGE_WIDTHS`` next to it. With
+    no workers, the variants are made before the upload returns. The
+    ``srcset`` template filter turns the ``<img>`` tags of a post body into
+    ``<picture>`` elements offering the variants that exist. Without Pillow,
+    nothing is generated and the images are left as they are.
+    """
+
+    def __init__(self, app=None, cache=None):
+        if app is not None:
+            self.init_app(app, cache)
+
+    def init_app(self, app, cache):
+        self.cache = cache
+        app.config.setdefault('BLUELOG_IMAGE_WIDTHS', [480, 960, 1600])
+        app.config.setdefault('BLUELOG_IMAGE_QUALITY', 80)
+        app.config.setdefault('BLUELOG_IMAGE_WORKERS', 2)
+        app.config.setdefault('BLUELOG_IMAGE_SIZES', '(min-width: 1200px) 730px, 100vw')
+        app.extensions['bluelog_images'] = _ImagesState()
+        app.add_template_filter(self.srcset, 'srcset')
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def _executor(self, app):
+        state = app.extensions['bluelog_images']
+        with state.lock:
+            if state.executor is None:
+                state.executor = ThreadPoolExecutor(app.config['BLUELOG_IMAGE_WORKERS'])
+            return state.executor
+
+    def generate(self, filename):
+        """Make the variants of an uploaded image, in the background if there are workers."""
+        if not self.available or not is_original(filename):
+            return None
+        app = current_app._get_current_object()
+        if not app.config['BLUELOG_IMAGE_WORKERS']:
+            return self._generate(app, filename)
+        return self._executor(app).submit(self._generate, app, filename)
+
+    def _generate(self, app, filename):
+        path = os.path.join(app.config['BLUELOG_UPLOAD_PATH'], filename)
+        with app.app_context():
+            try:
+                description = make_variants(path, app.config['BLUELOG_IMAGE_WIDTHS'],
+                                            app.config['BLUELOG_IMAGE_QUALITY'])
+            except IMAGE_ERRORS:
+                app.logger.exception('Failed to make the variants of %s.', filename)
+                return None
+            self.cache.bump('images')
+            return description
+
+    def backfill(self, force=False, workers=0):
+        """Make the variants of every image in the upload folder that has none yet.
+
+        Return the number of images processed and the error messages of those that failed.
+        """
+        upload_path = current_app.config['BLUELOG_UPLOAD_PATH']
+        paths = [os.path.join(upload_path, filename) for filename in sorted(os.listdir(upload_path))
+                 if is_original(filename)]
+        if not force:
+            paths = [path for path in paths if not os.path.exists(description_path(path))]
+        backfill_one = partial(_backfill_one, widths=current_app.config['BLUELOG_IMAGE_WIDTHS'],
+                               quality=current_app.config['BLUELOG_IMAGE_QUALITY'])
+        if workers:
+            with ProcessPoolExecutor(workers) as executor:
+                errors = list(executor.map(backfill_one, paths))
+        else:
+            errors = [backfill_one(path) for path in paths]
+        self.cache.bump('images')
+        return len(paths), [error for error in errors if error is not None]
+
+    def variants(self, filename):
+        """Return the description of the variants of an uploaded image, None if there is none."""
+        def load():
+            path = safe_join(current_app.config['BLUELOG_UPLOAD_PATH'], filename)
+            try:
+                with open(description_path(path)) as f:
+                    return json.load(f)
+            except (IOError, OSError, TypeError, ValueError):
+                return None
+        return self.cache.get('images', filename, load)
+
+    def upload_filename(self, src):
+        """Return the filename in the URL of an uploaded image, None if ``src`` is another URL."""
+        if has_request_context():
+            prefix = url_for('admin.get_image', filename='_')[:-1]
+        else:  # post bodies are also rendered by commands, which have no request
+            adapter = current_app.url_map.bind('localhost', script_name=current_app.config['APPLICATION_ROOT'])
+            prefix = adapter.build('admin.get_image', {'filename': '_'})[:-1]
+        return src[len(prefix):] if src.startswith(prefix) and len(src) > len(prefix) else None
+
+    def srcset(self, html):
+        """Wrap the uploaded images of ``html`` in ``<picture>`` elements listing their variants."""
+        def replace(match):
+            tag = match.group(0)
+            src = SRC.search(tag)
+            filename = self.upload_filename(src.group(1)) if src is not None else None
+            if filename is None or ' srcset=' in tag:
+                return tag
+            description = self.variants(url_unquote(filename))
+            if description is None:
+                return tag
+            return self._picture(tag, description)
+        return Markup(IMG_TAG.sub(replace, html or ''))
+
+    def _picture(self, tag, description):
+        sources = {}
+        for variant in description['variants']:
+            sources.setdefault(variant['type'], []).append('%s %dw' % (
+                url_for('admin.get_image', filename=variant['name']), variant['width']))
+        sizes = escape(current_app.config['BLUELOG_IMAGE_SIZES'])
+        webp = sources.pop('image/webp', [])
+        original = ', '.join(sources.popitem()[1]) if sources else None
+        if original is not None:
+            tag = re.sub(r'^<img\b', '<img srcset="%s" sizes="%s"' % (escape(original), sizes), tag)
+        if not webp:
+            return tag
+        return '<picture><source type="image/webp" srcset="%s" sizes="%s">%s</picture>' % (
+            escape(', '.join(webp)), sizes, tag)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import atexit
+import queue
+import threading
+import time
+import traceback
+from logging.handlers import QueueHandler, QueueListener, SMTPHandler
+
+from flask import request, has_request_context
+
+
+def fingerprint(record):
+    """Identify the error a record reports: the exception type and where it was raised, or the logging call."""
+    if record.exc_info and record.exc_info[0] is not None:
+        frames = traceback.extract_tb(record.exc_info[2])
+        if frames:
+            return '%s at %s:%d' % (record.exc_info[0].__name__, frames[-1].filename, frames[-1].lineno)
+        return record.exc_info[0].__name__
+    return '%s:%d' % (record.pathname, record.lineno)
+
+
+class RequestQueueHandler(QueueHandler):
+    """Put records on a bounded queue without ever blocking the caller.
+
+    The request details and the fingerprint are attached to the record here,
+    while the request is still around; records that do not fit in the queue
+    are counted and dropped.
+    """
+
+    def __init__(self, queue):
+        super(RequestQueueHandler, self).__init__(queue)
+        self.dropped = 0
+        # the LogQueue serving this handler, if any
+        self.log_queue = None
+
+    def prepare(self, record):
+        if has_request_context():
+            record.url = request.url
+            record.remote_addr = request.remote_addr
+        else:
+            record.url = record.remote_addr = '-'
+        record.fingerprint = fingerprint(record)
+        return super(RequestQueueHandler, self).prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DigestMailHandler(SMTPHandler):
+    """Mail the first occurrence of an error, and a single digest for its repeats.
+
+    Records with the same fingerprint arriving within ``window`` seconds of
+    the first one are only counted; when the window closes, the last of them
+    is mailed with the number of repeats in the subject.
+    """
+
+    def __init__(self, mailhost, fromaddr, toaddrs, subject, credentials=None, secure=None, window=300):
+        super(DigestMailHandler, self).__init__(mailhost, fromaddr, toaddrs, subject, credentials, secure)
+        self.window = window
+        self.windows = {}
+        self.suppressed = 0
+        self.timer = None
+
+    def emit(self, record):
+        key = getattr(record, 'fingerprint', None) or fingerprint(record)
+        now = time.time()
+        opened = self.windows.get(key)
+        if opened is not None and now - opened[0] < self.window:
+            opened[1] += 1
+            opened[2] = record
+            self.suppressed += 1
+            self._schedule()
+            return
+        self.windows[key] = [now, 0, record]
+        super(DigestMailHandler, self).emit(record)
+
+    def _schedule(self):
+        if self.timer is None:
+            pending = [opened for opened, repeats, record in self.windows.values() if repeats]
+            if pending:
+                self.timer = threading.Timer(max(min(pending) + self.window - time.time(), 0), self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def getSubject(self, record):
+        repeats = getattr(record, 'repeats', 0)
+        if repeats:
+            return '%s (repeated %d times)' % (self.subject, repeats)
+        return self.subject
+
+    def flush(self, force=False):
+        """Send the digests of the closed windows, or of all windows with ``force``."""
+        self.acquire()
+        try:
+            self.timer = None
+            now = time.time()
+            for key, (opened, repeats, record) in list(self.windows.items()):
+                if force or now - opened >= self.window:
+                    del self.windows[key]
+                    if repeats:
+                        record.repeats = repeats
+                        super(DigestMailHandler, self).emit(record)
+            self._schedule()
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush(force=True)
+        if self.timer is not None:
+            self.timer.cancel()
+        super(DigestMailHandler, self).close()
+
+
+class LogQueue(object):
+    """The handlers of an application logger, served by a background thread.
+
+    Every app of the process logs to the same ``bluelog`` logger, so the
+    queue of an app created earlier is stopped and replaced rather than
+    joined by another one.
+    """
+
+    def __init__(self, app, *handlers):
+        for handler in list(app.logger.handlers):
+            if isinstance(handler, RequestQueueHandler):
+                if handler.log_queue is not None:
+                    handler.log_queue.stop()
+                app.logger.removeHandler(handler)
+        self.handler = RequestQueueHandler(queue.Queue(app.config['BLUELOG_LOG_QUEUE_SIZE']))
+        self.handler.log_queue = self
+        self.listener = QueueListener(self.handler.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop)
+        app.logger.addHandler(self.handler)
+        app.extensions['bluelog_logging'] = self
+
+    def stop(self):
+        """Handle the records still in the queue, stop the thread and close the handlers."""
+        atexit.unregister(self.stop)
+        if self.listener._thread is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+
+    def stats(self):
+        """Return the number of queued, dropped and coalesced records."""
+        suppressed = sum(getattr(handler, 'suppressed', 0) for handler in self.listener.handlers)
+        return dict(queued=self.handler.queue.qsize(), dropped=self.handler.dropped, suppressed=suppressed)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import bisect
+import hmac
+import random
+import threading
+import time
+
+from flask import request, g, current_app, abort, has_app_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# name, help text, buckets, index in the per request sample
+HISTOGRAMS = (
+    ('bluelog_request_duration_seconds', 'Time spent handling the request.', TIME_BUCKETS, 0),
+    ('bluelog_request_db_seconds', 'Time spent executing queries.', TIME_BUCKETS, 1),
+    ('bluelog_request_queries', 'Number of queries executed.', COUNT_BUCKETS, 2),
+    ('bluelog_request_template_seconds', 'Time spent rendering templates.', TIME_BUCKETS, 3),
+)
+
+LOG_METRICS = (
+    ('bluelog_log_queue_depth', 'gauge', 'queued'),
+    ('bluelog_log_records_dropped_total', 'counter', 'dropped'),
+    ('bluelog_log_mails_coalesced_total', 'counter', 'suppressed'),
+)
+
+
+class Histogram(object):
+    """Fixed buckets, so the memory used never grows with the number of observations."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def expose(self, name, labels):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, total))
+        lines.append('%s_sum{%s} %s' % (name, labels, self.sum))
+        lines.append('%s_count{%s} %d' % (name, labels, total))
+        return lines
+
+
+class _MetricsState(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.histograms = {}
+
+
+class Metrics(object):
+    """Per endpoint request metrics, published in the Prometheus text format at ``/metrics``.
+
+    Every request is counted, but only a ``BLUELOG_METRICS_SAMPLE_RATE``
+    share of them is timed: total latency, time spent in queries, number of
+    queries and template rendering time go to fixed-size histograms. Queries
+    are timed through cursor events, which also feed the slow query log, so
+    query recording can stay off in production. The numbers are kept per
+    process.
+
+    Scrapers send ``Authorization: Bearer <BLUELOG_METRICS_TOKEN>``, or
+    connect from one of ``BLUELOG_METRICS_ALLOWED_ADDRS``. Behind a reverse
+    proxy every client seems to come from the proxy's address, so production
+    allows no address and only takes the token.
+    """
+
+    def __init__(self, app=None, slowlog=None):
+        self.slowlog = slowlog
+        if app is not None:
+            self.init_app(app, slowlog)
+
+    def init_app(self, app, slowlog=None):
+        self.slowlog = slowlog
+        app.config.setdefault('BLUELOG_METRICS_SAMPLE_RATE', 0.1)
+        app.config.setdefault('BLUELOG_METRICS_ALLOWED_ADDRS', ['127.0.0.1', '::1'])
+        app.config.setdefault('BLUELOG_METRICS_TOKEN', None)
+        app.extensions['bluelog_metrics'] = _MetricsState()
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+        before_render_template.connect(self._start_template, app)
+        template_rendered.connect(self._finish_template, app)
+        if not event.contains(Engine, 'before_cursor_execute', self._start_query):
+            event.listen(Engine, 'before_cursor_execute', self._start_query)
+            event.listen(Engine, 'after_cursor_execute', self._finish_query)
+
+    def _start(self):
+        if random.random() < current_app.config['BLUELOG_METRICS_SAMPLE_RATE']:
+            # latency, db time, queries, template time
+            g._metrics_sample = [time.perf_counter(), 0, 0, 0]
+
+    def _finish(self, response):
+        endpoint = request.endpoint or 'none'
+        sample = g.pop('_metrics_sample', None)
+        state = current_app.extensions['bluelog_metrics']
+        with state.lock:
+            state.requests[endpoint] = state.requests.get(endpoint, 0) + 1
+            if sample is not None:
+                sample[0] = time.perf_counter() - sample[0]
+                histograms = state.histograms.get(endpoint)
+                if histograms is None:
+                    histograms = state.histograms[endpoint] = [Histogram(buckets) for _, _, buckets, _ in HISTOGRAMS]
+                for histogram, (_, _, _, index) in zip(histograms, HISTOGRAMS):
+                    histogram.observe(sample[index])
+        return response
+
+    def _start_template(self, app, template, context):
+        if '_metrics_sample' in g:
+            g.setdefault('_metrics_templates', []).append(time.perf_counter())
+
+    def _finish_template(self, app, template, context):
+        started = g.get('_metrics_templates')
+        if started:
+            duration = time.perf_counter() - started.pop()
+            # nested renders are already part of the outer one
+            if not started:
+                g._metrics_sample[3] += duration
+
+    def _start_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _finish_query(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_start_time'].pop()
+        if not has_app_context():
+            return
+        sample = g.get('_metrics_sample')
+        if sample is not None:
+            sample[1] += duration
+            sample[2] += 1
+        if self.slowlog is not None and not executemany:
+            self.slowlog.record(conn, statement, parameters, duration)
+
+    def collect(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        state = current_app.extensions['bluelog_metrics']
+        lines = ['# HELP bluelog_requests_total Requests handled.', '# TYPE bluelog_requests_total counter']
+        with state.lock:
+            for endpoint, count in sorted(state.requests.items()):
+                lines.append('bluelog_requests_total{endpoint="%s"} %d' % (endpoint, count))
+            for index, (name, description, _, _) in enumerate(HISTOGRAMS):
+                lines.extend(['# HELP %s %s' % (name, description), '# TYPE %s histogram' % name])
+                for endpoint, histograms in sorted(state.histograms.items()):
+                    lines.extend(histograms[index].expose(name, 'endpoint="%s"' % endpoint))
+        lines.extend(self._collect_extensions())
+        return '\n'.join(lines) + '\n'
+
+    def _collect_extensions(self):
+        lines = []
+        log_queue = current_app.extensions.get('bluelog_logging')
+        if log_queue is not None:
+            stats = log_queue.stats()
+            for name, kind, key in LOG_METRICS:
+                lines.extend(['# TYPE %s %s' % (name, kind), '%s %d' % (name, stats[key])])
+        throttle = current_app.extensions.get('bluelog_throttle')
+        if throttle is not None:
+            lines.extend(['# HELP bluelog_login_throttled_total Login attempts rejected before checking the password.',
+                          '# TYPE bluelog_login_throttled_total counter'])
+            for key, count in sorted(throttle.stats().items()):
+                lines.append('bluelog_login_throttled_total{key="%s"} %d' % (key, count))
+        return lines
+
+    def _allowed(self):
+        token = current_app.config['BLUELOG_METRICS_TOKEN']
+        if token and hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                         ('Bearer %s' % token).encode('utf-8')):
+            return True
+        return request.remote_addr in current_app.config['BLUELOG_METRICS_ALLOWED_ADDRS']
+
+    def expose(self):
+        if not self._allowed():
+            abort(404)
+        return current_app.response_class(self.collect(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -5,12 +5,30 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+from collections import namedtuple
 from datetime import datetime
 
+from flask import g
 from flask_login import UserMixin
+from markupsafe import Markup
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from bluelog.extensions import db
+from bluelog.extensions import db, cache, search
+from bluelog.pipeline import render_body
+
+# Read-only copies of reference data, safe to share between requests through the cache.
+BlogSettings = namedtuple('BlogSettings', ['blog_title', 'blog_sub_title', 'name', 'about'])
+CategoryInfo = namedtuple('CategoryInfo', ['id', 'name', 'post_count'])
+LinkInfo = namedtuple('LinkInfo', ['id', 'name', 'url'])
+# a comment with the nodes of its replies
+CommentNode = namedtuple('CommentNode', ['comment', 'replies'])
+
+# Comment.path is the zero-padded ids of a comment and its ancestors, '0000000012/0000000045/'
+PATH_SEGMENT = '%010d/'
+PATH_LENGTH = 255
+# deeper replies are threaded as siblings of the comment they reply to
+MAX_DEPTH = PATH_LENGTH // len(PATH_SEGMENT % 0) - 1
 
 
 class Admin(db.Model, UserMixin):
@@ -28,36 +46,167 @@ class Admin(db.Model, UserMixin):
     def validate_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def cache_namespaces(self):
+        return ['settings']
+
+    @staticmethod
+    def get_current():
+        """Return the administrator, loaded at most once per request, or None if there is none yet."""
+        admin = g.get('_admin')
+        # g outlives the request when the app context is shared (shell, tests), and the session may not
+        if admin is None or admin not in db.session:
+            admin = g._admin = Admin.query.first()
+        return admin
+
+    @staticmethod
+    def get_settings():
+        """Return the public blog settings, or None if there is no administrator yet."""
+        def load():
+            admin = Admin.get_current()
+            if admin is None:
+                return None
+            return BlogSettings(admin.blog_title, admin.blog_sub_title, admin.name, admin.about)
+        return cache.get('settings', 'admin', load)
+
 
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), unique=True)
+    post_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     posts = db.relationship('Post', back_populates='category')
 
+    def cache_namespaces(self):
+        return ['categories']
+
+    @staticmethod
+    def get_all():
+        """Return all categories ordered by name, served from the cache."""
+        return cache.get('categories', 'all', lambda: [
+            CategoryInfo(category.id, category.name, category.post_count)
+            for category in Category.query.order_by(Category.name)])
+
     def delete(self):
         default_category = Category.query.get(1)
         posts = self.posts[:]
         for post in posts:
             post.category = default_category
+        default_category.post_count = Category.post_count + len(posts)
         db.session.delete(self)
         db.session.commit()
 
+    @staticmethod
+    def recount():
+        """Recalculate the denormalized post counter of every category."""
+        total = db.select([db.func.count(Post.id)]).where(Post.category_id == Category.id).as_scalar()
+        Category.query.update({Category.post_count: total}, synchronize_session=False)
+
 
 class Post(db.Model):
+    __table_args__ = (
+        # category page: WHERE category_id = ? ORDER BY timestamp, id
+        db.Index('ix_post_category_id_timestamp', 'category_id', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(60))
     body = db.Column(db.Text)
+    # plain text summary shown on the listing pages and the HTML shown on the post page, see on_changed_body()
+    excerpt = db.Column(db.Text)
+    body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     can_comment = db.Column(db.Boolean, default=True)
+    # number of reviewed comments, kept in sync by the views that write comments
+    comment_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
 
     category = db.relationship('Category', back_populates='posts')
     comments = db.relationship('Comment', back_populates='post', cascade='all, delete-orphan')
 
+    def cache_namespaces(self):
+        namespaces = ['post-counts', 'posts', 'post-%s' % self.id]
+        session, state = db.object_session(self), db.inspect(self)
+        # the sidebar shows the number of posts in each category, which only changes when a post is added,
+        # deleted or moved
+        if self in session.new or self in session.deleted or state.attrs.category_id.history.has_changes() or \
+                state.attrs.category.history.has_changes():
+            namespaces.append('categories')
+        return namespaces
+
+    @staticmethod
+    def recount(post_ids=None):
+        """Recalculate the denormalized reviewed comment counter of every post, or of the given posts."""
+        total = db.select([db.func.count(Comment.id)]).where(
+            db.and_(Comment.post_id == Post.id, Comment.reviewed == db.true())).as_scalar()
+        query = Post.query if post_ids is None else Post.query.filter(Post.id.in_(post_ids))
+        query.update({Post.comment_count: total}, synchronize_session=False)
+
+    @staticmethod
+    def rebuild_excerpts(batch=500):
+        """Recalculate the excerpt of every post, committing every ``batch`` posts; return the number of posts."""
+        last_id = 0
+        total = 0
+        while True:
+            posts = Post.query.filter(Post.id > last_id).order_by(Post.id).limit(batch).all()
+            if not posts:
+                break
+            for post in posts:
+                post.excerpt = make_excerpt(post.body)
+            db.session.commit()
+            last_id = posts[-1].id
+            total += len(posts)
+        return total
+
+    @staticmethod
+    def rerender(batch=500):
+        """Run every post body through the pipeline again, committing every ``batch`` posts.
+
+        Return the number of posts and the number of those whose HTML changed.
+        """
+        last_id = total = changed = 0
+        while True:
+            posts = Post.query.filter(Post.id > last_id).order_by(Post.id).limit(batch).all()
+            if not posts:
+                break
+            for post in posts:
+                body_html = render_body(post.body)
+                # unchanged posts stay clean, their cached pages and index rows are kept
+                if body_html != post.body_html:
+                    post.body_html = body_html
+                    changed += 1
+            db.session.commit()
+            last_id = posts[-1].id
+            total += len(posts)
+        return total, changed
+
+
+def make_excerpt(html, length=255, leeway=5, end='...'):
+    """Strip the tags of a post body and truncate it, like the ``striptags|truncate`` filters do."""
+    text = Markup(html or '').striptags()
+    if len(text) <= length + leeway:
+        return text
+    return text[:length - len(end)].rsplit(' ', 1)[0] + end
+
+
+@db.event.listens_for(Post.body, 'set')
+def on_changed_body(target, value, oldvalue, initiator):
+    target.excerpt = make_excerpt(value)
+    target.body_html = render_body(value)
+
 
 class Comment(db.Model):
+    __table_args__ = (
+        # post page: WHERE post_id = ? AND reviewed = 1 ORDER BY timestamp, id
+        db.Index('ix_comment_post_id_reviewed_timestamp', 'post_id', 'reviewed', 'timestamp'),
+        # unread badge and filter: WHERE reviewed = 0 [ORDER BY timestamp, id]
+        db.Index('ix_comment_reviewed_timestamp', 'reviewed', 'timestamp'),
+        # admin filter: WHERE from_admin = 1 ORDER BY timestamp, id
+        db.Index('ix_comment_from_admin_timestamp', 'from_admin', 'timestamp'),
+        # post page threads: WHERE post_id = ? AND path >= ? AND path < ? ORDER BY path
+        db.Index('ix_comment_post_id_path', 'post_id', 'path'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     author = db.Column(db.String(30))
     email = db.Column(db.String(254))
@@ -66,6 +215,9 @@ class Comment(db.Model):
     from_admin = db.Column(db.Boolean, default=False)
     reviewed = db.Column(db.Boolean, default=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # set when the comment is inserted, see on_comment_inserted()
+    path = db.Column(db.String(PATH_LENGTH))
+    depth = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     replied_id = db.Column(db.Integer, db.ForeignKey('comment.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
@@ -77,8 +229,173 @@ class Comment(db.Model):
     # replies = db.relationship('Comment', backref=db.backref('replied', remote_side=[id]),
     # cascade='all,delete-orphan')
 
+    def cache_namespaces(self):
+        return ['comment-counts', 'post-%s' % self.post_id]
+
+    def walk(self):
+        """Yield this comment and all of its replies, depth first."""
+        yield self
+        for reply in self.replies:
+            for comment in reply.walk():
+                yield comment
+
+    def delete(self):
+        """Delete the comment with its replies and update the reviewed comment counters."""
+        removed = {}
+        for comment in self.walk():
+            if comment.reviewed and comment.post is not None:
+                removed[comment.post] = removed.get(comment.post, 0) + 1
+        for post, count in removed.items():
+            post.comment_count = Post.comment_count - count
+        db.session.delete(self)
+
+    @staticmethod
+    def approve_all(query, batch=500):
+        """Approve the comments selected by ``query`` with one ``UPDATE``.
+
+        Return the number of comments approved and the ids of their posts, whose
+        counters and index rows are updated. The caller bumps the cache after the commit.
+        """
+        query = query.filter(Comment.reviewed == db.false()).order_by(None)
+        post_ids = [post_id for post_id, in query.with_entities(Comment.post_id).distinct()]
+        selected = query.with_entities(Comment.id).subquery()
+        count = Comment.query.filter(Comment.id.in_(db.select([selected.c.id]))).update(
+            {Comment.reviewed: True}, synchronize_session=False)
+        Comment._update_posts(post_ids, batch)
+        return count, post_ids
+
+    @staticmethod
+    def delete_all(query, batch=500):
+        """Delete the comments selected by ``query`` and all their replies with one ``DELETE``.
+
+        Return the number of comments deleted and the ids of their posts, whose
+        counters and index rows are updated. The caller bumps the cache after the commit.
+        """
+        selected = query.with_entities(Comment.post_id, Comment.path).order_by(None).subquery()
+        # the replies of a comment are the comments whose path starts with its path, and
+        # paths only hold digits and slashes, which all sort before ':'
+        reply = db.aliased(Comment)
+        thread = db.select([reply.id]).where(db.and_(
+            reply.post_id == selected.c.post_id, reply.path >= selected.c.path,
+            reply.path < selected.c.path.concat(':')))
+        doomed = Comment.query.filter(Comment.id.in_(thread))
+        post_ids = [post_id for post_id, in doomed.with_entities(Comment.post_id).distinct()]
+        count = doomed.delete(synchronize_session=False)
+        db.session.expire_all()
+        Comment._update_posts(post_ids, batch)
+        return count, post_ids
+
+    @staticmethod
+    def _update_posts(post_ids, batch):
+        # bulk statements skip the session events that keep the counters and the search index up to date
+        for start in range(0, len(post_ids), batch):
+            Post.recount(post_ids[start:start + batch])
+            search.refresh(post_ids[start:start + batch])
+
+    @staticmethod
+    def load_threads(roots):
+        """Load the reviewed replies of root comments in one query, return the threads as :class:`CommentNode` trees.
+
+        A reply whose parent is not reviewed hangs from its closest reviewed ancestor.
+        """
+        if not roots:
+            return []
+        # every path of a thread starts with the path of its root, '0000000045/' < ... < '00000000450'
+        threads = [db.and_(Comment.path >= root.path, Comment.path < root.path[:-1] + '0') for root in roots]
+        comments = Comment.query.filter(Comment.post_id == roots[0].post_id, Comment.reviewed == db.true(),
+                                        db.or_(*threads)).order_by(Comment.path).all()
+        nodes = dict((node.comment.id, node) for node in thread_tree(comments))
+        return [nodes[root.id] for root in roots if root.id in nodes]
+
+    @staticmethod
+    def rebuild_paths(batch=1000):
+        """Recalculate the thread path of every comment from the replied ids."""
+        rows = db.session.query(Comment.id, Comment.replied_id).all()
+        paths = thread_paths(rows)
+        values = [dict(comment_id=comment_id, path=path, depth=depth) for comment_id, (path, depth) in paths.items()]
+        update = Comment.__table__.update().where(Comment.id == db.bindparam('comment_id')).values(
+            path=db.bindparam('path'), depth=db.bindparam('depth'))
+        for start in range(0, len(values), batch):
+            db.session.execute(update, values[start:start + batch])
+        return len(values)
+
+
+def thread_path(comment_id, parent=None):
+    """Return ``(path, depth)`` of a comment replying to a comment with ``parent`` as ``(path, depth)``."""
+    if parent is None:
+        return PATH_SEGMENT % comment_id, 0
+    path, depth = parent
+    if depth >= MAX_DEPTH:
+        path, depth = path[:-len(PATH_SEGMENT % 0)], depth - 1
+    return path + PATH_SEGMENT % comment_id, depth + 1
+
+
+def thread_paths(rows):
+    """Return ``{id: (path, depth)}`` for ``(id, replied_id)`` rows."""
+    replied = dict(rows)
+    paths = {}
+    for comment_id in replied:
+        # walk up to the closest comment with a known path, then back down
+        chain = [comment_id]
+        while replied.get(chain[-1]) is not None and chain[-1] not in paths:
+            chain.append(replied[chain[-1]])
+        parent = paths.get(chain[-1])
+        for ancestor_id in reversed(chain):
+            if ancestor_id not in paths:
+                paths[ancestor_id] = parent = thread_path(ancestor_id, parent)
+            parent = paths[ancestor_id]
+    return paths
+
+
+def thread_tree(comments):
+    """Nest comments ordered by path into :class:`CommentNode` trees, return the top level nodes."""
+    top, stack = [], []
+    for comment in comments:
+        node = CommentNode(comment, [])
+        while stack and not comment.path.startswith(stack[-1].comment.path):
+            stack.pop()
+        (stack[-1].replies if stack else top).append(node)
+        stack.append(node)
+    return top
+
+
+@db.event.listens_for(Comment, 'after_insert')
+def on_comment_inserted(mapper, connection, target):
+    # the path ends with the id of the comment, which is only known now
+    parent = None
+    if target.replied_id is not None:
+        parent = tuple(connection.execute(db.select([Comment.path, Comment.depth]).where(
+            Comment.id == target.replied_id)).first())
+    path, depth = thread_path(target.id, parent)
+    connection.execute(Comment.__table__.update().where(Comment.id == target.id).values(path=path, depth=depth))
+    set_committed_value(target, 'path', path)
+    set_committed_value(target, 'depth', depth)
+
 
 class Link(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30))
     url = db.Column(db.String(255))
+
+    def cache_namespaces(self):
+        return ['links']
+
+    @staticmethod
+    def get_all():
+        """Return all links ordered by name, served from the cache."""
+        return cache.get('links', 'all', lambda: [
+            LinkInfo(link.id, link.name, link.url) for link in Link.query.order_by(Link.name)])
+
+
+class OutboxMessage(db.Model):
+    __tablename__ = 'outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255))
+    recipient = db.Column(db.String(254))
+    html = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    # None once the message has run out of attempts
+    next_attempt = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    last_error = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
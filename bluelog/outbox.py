@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import smtplib
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import Message, BadHeaderError
+from sqlalchemy import event
+
+# errors that concern a single message, the connection can still be used for the next one
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError,
+                  BadHeaderError, AssertionError)
+
+
+class _OutboxState(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.workers = []
+
+
+class Outbox(object):
+    """Deliver the mails queued in the ``outbox`` table.
+
+    Queued messages are committed together with the rest of the request, so
+    nothing is lost when a process restarts. A fixed pool of
+    ``BLUELOG_MAIL_WORKERS`` threads wakes up after every commit that queued a
+    message (and every ``BLUELOG_MAIL_POLL_INTERVAL`` seconds), claims due
+    messages in batches and sends each batch over a single SMTP connection.
+    Failed messages are retried with an exponential backoff until
+    ``BLUELOG_MAIL_MAX_ATTEMPTS`` is reached. With no workers, the queue is
+    only delivered by :meth:`flush`, e.g. from the ``flask outbox`` command.
+    """
+
+    def __init__(self, app=None, db=None, mail=None):
+        if app is not None:
+            self.init_app(app, db, mail)
+
+    def init_app(self, app, db, mail):
+        self.db = db
+        self.mail = mail
+        app.config.setdefault('BLUELOG_MAIL_WORKERS', 1)
+        app.config.setdefault('BLUELOG_MAIL_BATCH_SIZE', 20)
+        app.config.setdefault('BLUELOG_MAIL_MAX_ATTEMPTS', 5)
+        app.config.setdefault('BLUELOG_MAIL_RETRY_DELAY', 30)
+        app.config.setdefault('BLUELOG_MAIL_POLL_INTERVAL', 60)
+        app.extensions['bluelog_outbox'] = _OutboxState()
+        if not event.contains(db.session, 'after_commit', self._wake):
+            event.listen(db.session, 'after_commit', self._wake)
+        if app.config['BLUELOG_MAIL_WORKERS']:
+            # pick up the messages left over by the previous process
+            app.before_first_request(self.start)
+
+    @property
+    def _state(self):
+        return current_app.extensions['bluelog_outbox']
+
+    def enqueue(self, subject, to, html):
+        """Queue a message, it is sent once the current transaction is committed."""
+        from bluelog.models import OutboxMessage
+
+        message = OutboxMessage(subject=subject, recipient=to, html=html)
+        self.db.session.add(message)
+        self.db.session.info['outbox_pending'] = True
+        return message
+
+    def _wake(self, session):
+        if session.info.pop('outbox_pending', False) and current_app and current_app.config['BLUELOG_MAIL_WORKERS']:
+            self.start()
+            self._state.wakeup.set()
+
+    def start(self):
+        """Start the worker threads of the current application, unless they are running already."""
+        app = current_app._get_current_object()
+        state = self._state
+        with state.lock:
+            while len(state.workers) < app.config['BLUELOG_MAIL_WORKERS']:
+                worker = threading.Thread(target=self._work, args=[app, state], name='bluelog-outbox')
+                worker.daemon = True
+                worker.start()
+                state.workers.append(worker)
+
+    def _work(self, app, state):
+        with app.app_context():
+            while True:
+                state.wakeup.wait(app.config['BLUELOG_MAIL_POLL_INTERVAL'])
+                state.wakeup.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception('Failed to deliver the outbox.')
+                finally:
+                    self.db.session.remove()
+
+    def flush(self):
+        """Send all the due messages, return the number of messages sent and failed."""
+        sent = failed = 0
+        # messages that fail now are left for the next flush
+        started = datetime.utcnow()
+        while True:
+            messages = self._claim(current_app.config['BLUELOG_MAIL_BATCH_SIZE'], started)
+            if not messages:
+                return sent, failed
+            delivered = self._deliver(messages)
+            sent += delivered
+            failed += len(messages) - delivered
+
+    def _claim(self, limit, now):
+        """Lease up to ``limit`` messages due at ``now``, so no other worker picks them up meanwhile."""
+        from bluelog.models import OutboxMessage
+
+        lease = datetime.utcnow() + timedelta(seconds=current_app.config['BLUELOG_MAIL_POLL_INTERVAL'])
+        due = OutboxMessage.query.filter(OutboxMessage.next_attempt <= now).order_by(
+            OutboxMessage.next_attempt).limit(limit).all()
+        claimed = [message for message in due if OutboxMessage.query.filter_by(
+            id=message.id, next_attempt=message.next_attempt).update(
+            {'next_attempt': lease}, synchronize_session=False)]
+        self.db.session.commit()
+        return claimed
+
+    def _deliver(self, messages):
+        """Send a batch over one connection, return the number of messages sent."""
+        pending = list(messages)
+        sent = 0
+        try:
+            with self.mail.connect() as connection:
+                while pending:
+                    message = pending[0]
+                    try:
+                        connection.send(Message(message.subject, recipients=[message.recipient], html=message.html))
+                    except MESSAGE_ERRORS as e:
+                        self._retry(message, e)
+                    else:
+                        self.db.session.delete(message)
+                        sent += 1
+                    pending.pop(0)
+        except Exception as e:
+            # the connection is gone, try the rest of the batch later
+            for message in pending:
+                self._retry(message, e)
+        self.db.session.commit()
+        return sent
+
+    def _retry(self, message, error):
+        config = current_app.config
+        message.attempts += 1
+        message.last_error = '%s: %s' % (error.__class__.__name__, error)
+        if message.attempts >= config['BLUELOG_MAIL_MAX_ATTEMPTS']:
+            message.next_attempt = None
+            current_app.logger.error('Giving up on mail %d to %s: %s'
+                                     % (message.id, message.recipient, message.last_error))
+        else:
+            delay = config['BLUELOG_MAIL_RETRY_DELAY'] * 2 ** (message.attempts - 1)
+            message.next_attempt = datetime.utcnow() + timedelta(seconds=delay)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hashlib
+from functools import wraps
+
+from flask import request, session, current_app, g, make_response, get_flashed_messages
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+from bluelog.extensions import cache
+
+# the pages of the blog share the navbar and the sidebar
+CHROME_NAMESPACES = ('settings', 'categories', 'links')
+CSRF_PLACEHOLDER = b'\x00csrf-token\x00'
+
+
+def _cacheable_request():
+    return current_app.config['BLUELOG_PAGE_CACHE'] and request.method in ('GET', 'HEAD') and \
+        '_flashes' not in session and not current_user.is_authenticated
+
+
+def _cached_response(entry):
+    body, mimetype, etag = entry
+    if etag is None:
+        # the page carries a CSRF token, give every visitor their own
+        body = body.replace(CSRF_PLACEHOLDER, generate_csrf().encode('utf-8'))
+    response = current_app.response_class(body, mimetype=mimetype)
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+def _store(response, key, versions):
+    body = response.get_data()
+    token = g.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+    if token is not None and token.encode('utf-8') in body:
+        body = body.replace(token.encode('utf-8'), CSRF_PLACEHOLDER)
+        etag = None
+    else:
+        etag = hashlib.sha1(body).hexdigest()
+        response.set_etag(etag)
+    cache.set('pages', key, (versions, (body, response.mimetype, etag)))
+
+
+def cached_page(*namespaces):
+    """Cache the response of a view for anonymous visitors.
+
+    The page is keyed by path, query string and theme cookie, and is served
+    from the cache until one of the given namespaces (formatted with the view
+    arguments, e.g. ``'post-{post_id}'``) or the navbar/sidebar data changes.
+    Responses with flashed messages are never stored or served from the cache.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(**kwargs):
+            if not _cacheable_request():
+                return f(**kwargs)
+
+            key = (request.path, request.query_string, request.cookies.get('theme'))
+            dependencies = CHROME_NAMESPACES + tuple(namespace.format(**kwargs) for namespace in namespaces)
+            versions = tuple(cache.version(namespace) for namespace in dependencies)
+            cached = cache.lookup('pages', key)
+            if cached is not None and cached[0] == versions:
+                response = _cached_response(cached[1])
+            else:
+                response = make_response(f(**kwargs))
+                if response.status_code == 200 and not get_flashed_messages():
+                    _store(response, key, versions)
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.add('Cookie')
+            return response.make_conditional(request)
+        return decorated_function
+    return decorator
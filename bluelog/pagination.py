@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from flask import request, url_for, abort, current_app
+from flask_sqlalchemy import Pagination
+
+from bluelog.extensions import db, cache
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(kind, item=None, offset=None):
+    """Build an opaque cursor token pointing ``'after'`` or ``'before'`` an item, or to the ``'last'`` page."""
+    if item is None:
+        value = kind
+    else:
+        value = '%s|%s|%d|%d' % (kind, item.timestamp.strftime(TIMESTAMP_FORMAT), item.id, offset)
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Return ``(kind, (timestamp, id), offset)`` for a cursor token, aborting with 404 if it is malformed."""
+    try:
+        value = base64.urlsafe_b64decode(str(token) + '=' * (-len(token) % 4)).decode('utf-8')
+        if value == 'last':
+            return value, None, None
+        kind, timestamp, item_id, offset = value.split('|')
+        if kind not in ('after', 'before'):
+            raise ValueError(kind)
+        return kind, (datetime.strptime(timestamp, TIMESTAMP_FORMAT), int(item_id)), int(offset)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        abort(404)
+
+
+class KeysetPagination(object):
+    """Seek pagination ordered by ``(model.timestamp, model.id)``.
+
+    Instead of skipping rows with ``OFFSET``, every page starts right after
+    (or before) the row the cursor points at, so deep pages cost the same as
+    the first one. The position of the page is carried in the cursor only to
+    number the rows, it is never used in the query.
+    """
+
+    cursor_based = True
+
+    def __init__(self, query, model, per_page, cursor=None, ascending=False, count=None):
+        self.query = query
+        self.model = model
+        self.per_page = per_page
+        self.ascending = ascending
+        self._count = count or query.order_by(None).count
+        self._total = None
+
+        kind, key, self._offset = decode_cursor(cursor) if cursor else (None, None, 0)
+        reverse = kind in ('before', 'last')
+        if key is not None:
+            query = query.filter(self._beyond(key, reverse))
+        items = query.order_by(*self._order(reverse)).limit(per_page + 1).all()
+        more = len(items) > per_page
+        items = items[:per_page]
+        if reverse:
+            items.reverse()
+        self.items = items
+
+        self.has_prev = bool(items) and (more if reverse else kind is not None)
+        self.has_next = bool(items) and (kind == 'before' if reverse else more)
+
+    def _order(self, reverse):
+        descending = self.ascending == reverse
+        return [column.desc() if descending else column.asc() for column in (self.model.timestamp, self.model.id)]
+
+    def _beyond(self, key, reverse):
+        # the redundant range on timestamp alone lets the database seek in the timestamp index
+        timestamp, item_id = key
+        if self.ascending != reverse:
+            return db.and_(self.model.timestamp >= timestamp,
+                           db.or_(self.model.timestamp > timestamp, self.model.id > item_id))
+        return db.and_(self.model.timestamp <= timestamp,
+                       db.or_(self.model.timestamp < timestamp, self.model.id < item_id))
+
+    @property
+    def total(self):
+        if self._total is None:
+            self._total = self._count()
+        return self._total
+
+    @property
+    def offset(self):
+        """The number of rows before the first row of this page."""
+        if self._offset is None:
+            self._offset = max(self.total - len(self.items), 0)
+        return self._offset
+
+    @property
+    def page(self):
+        return self.offset // self.per_page + 1
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev:
+            return None
+        return encode_cursor('before', self.items[0], max(self.offset - self.per_page, 0))
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        return encode_cursor('after', self.items[-1], self.offset + len(self.items))
+
+    def url(self, cursor=None):
+        """Return the URL of the current view for the given cursor, keeping the other query arguments."""
+        args = request.args.to_dict()
+        args.pop('page', None)
+        args.pop('cursor', None)
+        args.update(request.view_args)
+        if cursor is not None:
+            args['cursor'] = cursor
+        return url_for(request.endpoint, **args)
+
+    @property
+    def prev_url(self):
+        return self.url(self.prev_cursor) if self.has_prev else None
+
+    @property
+    def next_url(self):
+        return self.url(self.next_cursor) if self.has_next else None
+
+    @property
+    def first_url(self):
+        return self.url()
+
+    @property
+    def last_url(self):
+        return self.url(encode_cursor('last'))
+
+
+def count(query, model, count_key):
+    """Return the number of rows of a listing from the count store.
+
+    Totals are cached per ``(model, count_key)``, where ``count_key`` names the
+    filter and the parent id of the listing, and are invalidated whenever rows
+    of the model are written. When ``BLUELOG_APPROXIMATE_COUNTS`` is set, a
+    total may lag behind the writes for up to that many seconds instead.
+    """
+    return cache.get('%s-counts' % model.__tablename__, count_key, query.order_by(None).count,
+                     tolerance=current_app.config['BLUELOG_APPROXIMATE_COUNTS'])
+
+
+def paginate(query, model, per_page, ascending=False, count_key=None):
+    """Paginate a query by ``(timestamp, id)``.
+
+    Requests with a ``cursor`` argument (or none at all) get a :class:`KeysetPagination`;
+    old ``?page=`` links still get an offset based pagination. With a ``count_key``,
+    the total comes from the count store instead of a ``COUNT(*)`` per request.
+    """
+    if count_key is None:
+        get_total = query.order_by(None).count
+    else:
+        def get_total():
+            return count(query, model, count_key)
+
+    page = request.args.get('page', type=int)
+    if page is None:
+        return KeysetPagination(query, model, per_page, request.args.get('cursor'), ascending, get_total)
+
+    if page < 1:
+        abort(404)
+    columns = (model.timestamp, model.id)
+    order = [column.asc() if ascending else column.desc() for column in columns]
+    items = query.order_by(*order).limit(per_page).offset((page - 1) * per_page).all()
+    if not items and page != 1:
+        abort(404)
+    return Pagination(query, page, per_page, get_total(), items)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import re
+from html import escape as html_escape
+from html.parser import HTMLParser
+
+from flask import current_app, has_app_context
+from markupsafe import escape
+from werkzeug.urls import url_unquote
+from werkzeug.utils import import_string
+
+from bluelog.extensions import images
+
+DEFAULT_TRANSFORMS = [
+    'bluelog.pipeline.sanitize',
+    'bluelog.pipeline.heading_anchors',
+    'bluelog.pipeline.external_links',
+    'bluelog.pipeline.lazy_images',
+]
+
+# what CKEditor produces, anything else is dropped by sanitize()
+ALLOWED_TAGS = frozenset([
+    'a', 'abbr', 'b', 'blockquote', 'br', 'caption', 'cite', 'code', 'col', 'colgroup', 'dd', 'del', 'div', 'dl',
+    'dt', 'em', 'figcaption', 'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'ins', 'kbd', 'li',
+    'ol', 'p', 'pre', 'q', 's', 'samp', 'small', 'span', 'strike', 'strong', 'sub', 'sup', 'table', 'tbody', 'td',
+    'tfoot', 'th', 'thead', 'tr', 'u', 'ul', 'var',
+])
+ALLOWED_ATTRIBUTES = {
+    '*': frozenset(['class', 'dir', 'id', 'lang', 'style', 'title']),
+    'a': frozenset(['href', 'name', 'rel', 'target']),
+    'blockquote': frozenset(['cite']),
+    'col': frozenset(['span', 'width']),
+    'colgroup': frozenset(['span', 'width']),
+    'del': frozenset(['cite', 'datetime']),
+    'img': frozenset(['alt', 'decoding', 'height', 'loading', 'src', 'width']),
+    'ins': frozenset(['cite', 'datetime']),
+    'ol': frozenset(['reversed', 'start', 'type']),
+    'q': frozenset(['cite']),
+    'table': frozenset(['border', 'cellpadding', 'cellspacing', 'summary', 'width']),
+    'td': frozenset(['colspan', 'headers', 'rowspan', 'scope']),
+    'th': frozenset(['colspan', 'headers', 'rowspan', 'scope']),
+}
+URL_ATTRIBUTES = frozenset(['cite', 'href', 'src'])
+# elements dropped along with everything inside them
+DROPPED_ELEMENTS = frozenset(['script', 'style', 'template', 'iframe', 'object', 'noscript', 'textarea', 'select',
+                              'svg', 'math', 'title'])
+VOID_ELEMENTS = frozenset(['br', 'col', 'hr', 'img'])
+# after removing the characters browsers ignore, "java\tscript:" is still a javascript: URL
+SAFE_URL = re.compile(r'^(https?:|mailto:|tel:|data:image/(png|gif|jpe?g|webp)[;,]|#|/|\?|\.|[^:]*$)', re.IGNORECASE)
+UNSAFE_STYLE = re.compile(r'expression|javascript:|url\s*\(|@import|\\', re.IGNORECASE)
+HEADINGS = ('h2', 'h3', 'h4')
+EXTERNAL = re.compile(r'^(https?:)?//', re.IGNORECASE)
+
+
+def build_tag(name, attributes, closing=''):
+    parts = [name] + [key if value is None else '%s="%s"' % (key, escape(value)) for key, value in attributes]
+    return '<%s%s>' % (' '.join(parts), closing)
+
+
+def get(attributes, key):
+    return next((value for name, value in attributes if name == key), None)
+
+
+def put(attributes, key, value):
+    attributes[:] = [(name, old) for name, old in attributes if name != key] + [(key, value)]
+
+
+class HTMLRewriter(HTMLParser):
+    """Parse HTML and write it out again.
+
+    Tags are written from their parsed name and attributes, values quoted and
+    escaped, and text is escaped, so the output never carries a tag the parser
+    did not see. Subclasses change the output in :meth:`start`, :meth:`end`
+    and :meth:`text`.
+    """
+
+    def __init__(self):
+        super(HTMLRewriter, self).__init__(convert_charrefs=True)
+        self.output = []
+
+    def rewrite(self, html):
+        self.feed(html)
+        self.close()
+        return ''.join(self.output)
+
+    def start(self, name, attributes, closing):
+        self.output.append(build_tag(name, attributes, closing))
+
+    def end(self, name):
+        self.output.append('</%s>' % name)
+
+    def text(self, data):
+        # the content of <script> and <style> is not HTML, it is written as it is
+        self.output.append(data if self.cdata_elem else html_escape(data, quote=False))
+
+    def handle_starttag(self, tag, attrs):
+        self.start(tag, list(attrs), '')
+
+    def handle_startendtag(self, tag, attrs):
+        self.start(tag, list(attrs), '/')
+
+    def handle_endtag(self, tag):
+        self.end(tag)
+
+    def handle_data(self, data):
+        self.text(data)
+
+    def handle_comment(self, data):
+        self.output.append('<!--%s-->' % data)
+
+
+class TagRewriter(HTMLRewriter):
+    """Call ``rewrite(name, attributes)`` on the start tags named in ``names`` (all of them if None).
+
+    ``rewrite`` edits the attributes in place, or returns False to drop the tag.
+    """
+
+    def __init__(self, names, rewrite):
+        super(TagRewriter, self).__init__()
+        self.names = names
+        self.rewrite_tag = rewrite
+
+    def start(self, name, attributes, closing):
+        if (self.names is None or name in self.names) and self.rewrite_tag(name, attributes) is False:
+            return
+        super(TagRewriter, self).start(name, attributes, closing)
+
+
+def rewrite_tags(html, names, rewrite):
+    return TagRewriter(names, rewrite).rewrite(html)
+
+
+def safe_attribute(name, key, value):
+    if key not in ALLOWED_ATTRIBUTES['*'] and key not in ALLOWED_ATTRIBUTES.get(name, ()):
+        return False
+    if key in URL_ATTRIBUTES:
+        return bool(SAFE_URL.match(re.sub(r'[\x00-\x20]', '', value or '')))
+    return key != 'style' or not UNSAFE_STYLE.search(value or '')
+
+
+class Sanitizer(HTMLRewriter):
+    """Keep the allowed tags and attributes, close the elements left open."""
+
+    def __init__(self):
+        super(Sanitizer, self).__init__()
+        self.open = []
+        # depth inside an element dropped with its content
+        self.dropping = 0
+
+    def start(self, name, attributes, closing):
+        if name in DROPPED_ELEMENTS and not closing and name not in VOID_ELEMENTS:
+            self.dropping += 1
+        if self.dropping or name not in ALLOWED_TAGS:
+            return
+        attributes = [(key, value) for key, value in attributes if safe_attribute(name, key, value)]
+        self.output.append(build_tag(name, attributes, '/' if name in VOID_ELEMENTS and closing else ''))
+        if name not in VOID_ELEMENTS:
+            self.open.append(name)
+
+    def end(self, name):
+        if name in DROPPED_ELEMENTS:
+            self.dropping = max(self.dropping - 1, 0)
+        elif not self.dropping and name in self.open:
+            # the elements opened inside it end with it
+            while self.open:
+                opened = self.open.pop()
+                self.output.append('</%s>' % opened)
+                if opened == name:
+                    break
+
+    def text(self, data):
+        if not self.dropping:
+            self.output.append(html_escape(data, quote=False))
+
+    def handle_comment(self, data):
+        pass
+
+    def close(self):
+        super(Sanitizer, self).close()
+        while self.open:
+            self.output.append('</%s>' % self.open.pop())
+
+
+def sanitize(html):
+    """Keep the tags and attributes CKEditor produces, without scripts, event handlers or unsafe URLs."""
+    return Sanitizer().rewrite(html)
+
+
+def slugify(text):
+    return re.sub(r'[^\w]+', '-', text.lower()).strip('-') or 'section'
+
+
+class HeadingAnchors(HTMLRewriter):
+
+    def __init__(self, used):
+        super(HeadingAnchors, self).__init__()
+        self.used = used
+        # the heading being written: its name, attributes, position in the output and text
+        self.heading = None
+
+    def start(self, name, attributes, closing):
+        if name in HEADINGS and self.heading is None and get(attributes, 'id') is None:
+            self.heading = (name, attributes, len(self.output), [])
+        super(HeadingAnchors, self).start(name, attributes, closing)
+
+    def text(self, data):
+        if self.heading is not None:
+            self.heading[3].append(data)
+        super(HeadingAnchors, self).text(data)
+
+    def end(self, name):
+        if self.heading is not None and name == self.heading[0]:
+            name, attributes, index, text = self.heading
+            slug = anchor = slugify(''.join(text))
+            number = 1
+            while anchor in self.used:
+                number += 1
+                anchor = '%s-%d' % (slug, number)
+            self.used.add(anchor)
+            put(attributes, 'id', anchor)
+            self.output[index] = build_tag(name, attributes)
+            self.heading = None
+        super(HeadingAnchors, self).end(name)
+
+
+def heading_anchors(html):
+    """Give the ``<h2>`` to ``<h4>`` headings an ``id``, so they can be linked to."""
+    used = set()
+    rewrite_tags(html, None, lambda name, attributes: used.add(get(attributes, 'id')))
+    return HeadingAnchors(used).rewrite(html)
+
+
+def external_links(html):
+    """Open the links to other sites in a new tab, without giving them a handle on this one."""
+    def rewrite(name, attributes):
+        if not EXTERNAL.match(get(attributes, 'href') or ''):
+            return
+        rel = (get(attributes, 'rel') or '').split()
+        put(attributes, 'rel', ' '.join(rel + [value for value in ('noopener', 'noreferrer') if value not in rel]))
+        if get(attributes, 'target') is None:
+            put(attributes, 'target', '_blank')
+    return rewrite_tags(html, ('a',), rewrite)
+
+
+def lazy_images(html):
+    """Load the images when they come into view, sized up front so the page does not jump."""
+    def rewrite(name, attributes):
+        if get(attributes, 'loading') is None:
+            put(attributes, 'loading', 'lazy')
+        if get(attributes, 'decoding') is None:
+            put(attributes, 'decoding', 'async')
+        if get(attributes, 'width') is None and get(attributes, 'height') is None and has_app_context():
+            filename = images.upload_filename(get(attributes, 'src') or '')
+            description = images.variants(url_unquote(filename)) if filename else None
+            if description is not None:
+                put(attributes, 'width', str(description['width']))
+                put(attributes, 'height', str(description['height']))
+    return rewrite_tags(html, ('img',), rewrite)
+
+
+def get_transforms():
+    names = current_app.config['BLUELOG_BODY_TRANSFORMS'] if has_app_context() else DEFAULT_TRANSFORMS
+    return [import_string(name) if isinstance(name, str) else name for name in names]
+
+
+def render_body(html):
+    """Run a post body through the ``BLUELOG_BODY_TRANSFORMS``, functions taking and returning HTML."""
+    html = html or ''
+    for transform in get_transforms():
+        html = transform(html)
+    return html
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import re
+from collections import namedtuple
+
+from flask import current_app, has_app_context
+from flask_sqlalchemy import Pagination
+from markupsafe import Markup
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+SearchHit = namedtuple('SearchHit', ['post', 'title', 'snippet'])
+
+# one row per post, the rowid is the post id; title, text of the body, text of the reviewed comments
+CREATE_INDEX = "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(" \
+               "title, body, comments, tokenize='porter unicode61')"
+DROP_INDEX = 'DROP TABLE IF EXISTS search_index'
+# the highlight markers are escaped along with the text, then turned into <mark> tags
+OPEN, CLOSE = '\x02', '\x03'
+SEARCH = text(
+    'SELECT rowid, highlight(search_index, 0, :open, :close) AS title, '
+    "snippet(search_index, 1, :open, :close, '...', 32) AS body, "
+    "snippet(search_index, 2, :open, :close, '...', 32) AS comments "
+    'FROM search_index WHERE search_index MATCH :query '
+    # a match in the title counts ten times as much as one in the body, twice as much as one in the comments
+    'ORDER BY bm25(search_index, 10.0, 1.0, 0.5) LIMIT :limit OFFSET :offset')
+COUNT = text('SELECT count(*) FROM search_index WHERE search_index MATCH :query')
+
+
+def terms_of(query, limit=10):
+    return re.findall(r'\w+', query)[:limit]
+
+
+def mark(value):
+    """Escape a highlighted value, turning the markers into ``<mark>`` tags."""
+    return Markup.escape(value or '').replace(OPEN, Markup('<mark>')).replace(CLOSE, Markup('</mark>'))
+
+
+def highlight(value, terms):
+    if not terms:
+        return mark(value)
+    pattern = re.compile('(%s)' % '|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    return mark(pattern.sub(OPEN + r'\1' + CLOSE, value or ''))
+
+
+class Search(object):
+    """Full-text search over the posts, their titles and their reviewed comments.
+
+    On SQLite with FTS5, posts are indexed in the ``search_index`` virtual
+    table, which is created and dropped along with the other tables and kept
+    up to date from the session: every flush that touches a post or a
+    reviewed comment refreshes the index rows of the affected posts. Bulk
+    writes have to call :meth:`refresh` (or :meth:`rebuild`) themselves.
+    Elsewhere, searches fall back to ``LIKE`` matches on title and body.
+    """
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.db = db
+        # whether the index table exists, None until it is known
+        app.extensions['bluelog_search'] = {'available': None}
+        if not event.contains(db.session, 'after_flush', self._collect_posts):
+            event.listen(db.session, 'after_flush', self._collect_posts)
+            event.listen(db.session, 'after_flush_postexec', self._refresh_collected)
+            event.listen(db.metadata, 'after_create', self._create_index)
+            event.listen(db.metadata, 'before_drop', self._drop_index)
+
+    def _set_available(self, available):
+        if has_app_context() and 'bluelog_search' in current_app.extensions:
+            current_app.extensions['bluelog_search']['available'] = available
+
+    def _create_index(self, target, connection, **kwargs):
+        if connection.dialect.name == 'sqlite':
+            try:
+                connection.execute(CREATE_INDEX)
+            except OperationalError:  # SQLite built without FTS5
+                self._set_available(False)
+            else:
+                self._set_available(True)
+
+    def _drop_index(self, target, connection, **kwargs):
+        if connection.dialect.name == 'sqlite':
+            connection.execute(DROP_INDEX)
+            self._set_available(False)
+
+    def available(self, connection=None):
+        """Whether the full-text index exists in the database."""
+        state = current_app.extensions['bluelog_search']
+        if state['available'] is None:
+            connection = connection or self.db.session.connection()
+            state['available'] = connection.dialect.name == 'sqlite' and connection.execute(text(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'search_index'")).scalar() > 0
+        return state['available']
+
+    def _collect_posts(self, session, flush_context):
+        from bluelog.models import Post, Comment
+
+        pending = session.info.setdefault('search_post_ids', set())
+        # a post is dirty when a comment is added to it, whose own row decides whether the index changes
+        dirty = [instance for instance in session.dirty if session.is_modified(instance, include_collections=False)]
+        for instance in list(session.new) + dirty + list(session.deleted):
+            if isinstance(instance, Post):
+                pending.add(instance.id)
+            elif isinstance(instance, Comment) and (instance.reviewed or instance in session.dirty):
+                pending.add(instance.post_id)
+        pending.discard(None)
+
+    def _refresh_collected(self, session, flush_context):
+        pending = session.info.pop('search_post_ids', None)
+        if pending:
+            self.refresh(pending, session.connection())
+
+    def refresh(self, post_ids, connection=None):
+        """Rebuild the index rows of the given posts from the database."""
+        from bluelog.models import Post, Comment
+
+        connection = connection or self.db.session.connection()
+        if not self.available(connection):
+            return
+        post_ids = list(post_ids)
+        index = self.db.table('search_index', self.db.column('rowid'), self.db.column('title'),
+                              self.db.column('body'), self.db.column('comments'))
+        connection.execute(index.delete().where(index.c.rowid.in_(post_ids)))
+        comments = {}
+        for post_id, body in connection.execute(self.db.select([Comment.post_id, Comment.body]).where(
+                self.db.and_(Comment.post_id.in_(post_ids), Comment.reviewed == self.db.true()))):
+            comments.setdefault(post_id, []).append(body or '')
+        rows = [dict(rowid=post_id, title=title or '', body=Markup(body or '').striptags(),
+                     comments='\n'.join(comments.get(post_id, [])))
+                for post_id, title, body in connection.execute(
+                    self.db.select([Post.id, Post.title, Post.body]).where(Post.id.in_(post_ids)))]
+        if rows:
+            connection.execute(index.insert(), rows)
+
+    def rebuild(self, batch=500):
+        """Index all the posts again, return the number of posts indexed."""
+        from bluelog.models import Post
+
+        connection = self.db.session.connection()
+        connection.execute(DROP_INDEX)
+        self._create_index(None, connection)
+        last_id = total = 0
+        while True:
+            post_ids = [post_id for post_id, in connection.execute(self.db.select([Post.id]).where(
+                Post.id > last_id).order_by(Post.id).limit(batch))]
+            if not post_ids:
+                break
+            self.refresh(post_ids, connection)
+            last_id = post_ids[-1]
+            total += len(post_ids)
+        self.db.session.commit()
+        return total
+
+    def search(self, query, page=1, per_page=None):
+        """Return a pagination of :class:`SearchHit`, the best matches first."""
+        per_page = per_page or current_app.config['BLUELOG_POST_PER_PAGE']
+        terms = terms_of(query)
+        if not terms:
+            return Pagination(None, page, per_page, 0, [])
+        if self.available():
+            return self._match(terms, page, per_page)
+        return self._like(terms, page, per_page)
+
+    def _match(self, terms, page, per_page):
+        from bluelog.models import Post
+
+        # every term is quoted so the query syntax of FTS5 never applies, the last one also matches as a prefix
+        query = ' '.join('"%s"' % term for term in terms) + '*'
+        session = self.db.session
+        total = session.execute(COUNT, dict(query=query)).scalar()
+        rows = session.execute(SEARCH, dict(query=query, open=OPEN, close=CLOSE, limit=per_page,
+                                            offset=(page - 1) * per_page)).fetchall()
+        posts = Post.query.options(self.db.joinedload(Post.category), self.db.defer(Post.body),
+                                   self.db.defer(Post.body_html)).filter(
+            Post.id.in_([row.rowid for row in rows])).all()
+        posts = dict((post.id, post) for post in posts)
+        hits = [SearchHit(posts[row.rowid], mark(row.title),
+                          mark(row.body if OPEN in row.body or OPEN not in row.comments else row.comments))
+                for row in rows if row.rowid in posts]
+        return Pagination(None, page, per_page, total, hits)
+
+    def _like(self, terms, page, per_page):
+        from bluelog.models import Post
+
+        query = Post.query.options(self.db.joinedload(Post.category), self.db.defer(Post.body),
+                                   self.db.defer(Post.body_html))
+        for term in terms:
+            pattern = '%%%s%%' % term.replace('_', '\\_')
+            query = query.filter(self.db.or_(Post.title.ilike(pattern, escape='\\'),
+                                             Post.body.ilike(pattern, escape='\\')))
+        pagination = query.order_by(Post.timestamp.desc(), Post.id.desc()).paginate(page, per_page)
+        pagination.items = [SearchHit(post, highlight(post.title, terms), highlight(post.excerpt, terms))
+                            for post in pagination.items]
+        return pagination
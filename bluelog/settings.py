@@ -43,23 +43,96 @@ class BaseConfig(object):
     # ('theme name', 'display name')
     BLUELOG_THEMES = {'perfect_blue': 'Perfect Blue', 'black_swan': 'Black Swan'}
     BLUELOG_SLOW_QUERY_THRESHOLD = 1
+    # each process dumps its query statistics here for `flask slowlog`
+    BLUELOG_SLOWLOG_PATH = os.path.join(basedir, 'logs')
+    # share of the requests timed for the /metrics histograms
+    BLUELOG_METRICS_SAMPLE_RATE = 0.1
+    # /metrics answers requests carrying "Authorization: Bearer <token>", or coming from these addresses;
+    # behind a proxy, set up werkzeug's ProxyFix or every client comes from the proxy's address
+    BLUELOG_METRICS_TOKEN = os.getenv('BLUELOG_METRICS_TOKEN')
+    BLUELOG_METRICS_ALLOWED_ADDRS = ['127.0.0.1', '::1']
+    # log records waiting for the logging thread, more are dropped
+    BLUELOG_LOG_QUEUE_SIZE = 10000
+    # seconds during which repeats of an error are collected into one digest mail
+    BLUELOG_ERROR_MAIL_WINDOW = 300
+    # cache the public pages rendered for anonymous visitors
+    BLUELOG_PAGE_CACHE = True
+    # cached pages per process, kept apart from the sidebar and settings data
+    BLUELOG_PAGE_CACHE_MAX_ENTRIES = 256
+    # seconds a cached listing total may lag behind writes, None keeps totals exact
+    BLUELOG_APPROXIMATE_COUNTS = None
+
+    # directory holding the cache version files shared by all worker processes, None keeps them per process
+    BLUELOG_CACHE_VERSION_PATH = None
+    # threads delivering the mail outbox, 0 leaves it to the `flask outbox` command
+    BLUELOG_MAIL_WORKERS = 1
+    BLUELOG_MAIL_BATCH_SIZE = 20
+    # a failed mail is retried after 30s, 60s, 120s... until it has been tried 5 times
+    BLUELOG_MAIL_MAX_ATTEMPTS = 5
+    BLUELOG_MAIL_RETRY_DELAY = 30
+
+    # link the static files to their hashed copies built by `flask assets build`
+    BLUELOG_ASSETS_MANIFEST = True
+
+    # posts in the Atom feeds, seconds feed readers may keep a copy without asking again
+    BLUELOG_FEED_SIZE = 20
+    BLUELOG_FEED_MAX_AGE = 300
+    # `flask freeze` renders the public pages here, their absolute links start with the base URL
+    BLUELOG_FREEZE_PATH = os.path.join(basedir, 'frozen')
+    BLUELOG_FREEZE_BASE_URL = os.getenv('BLUELOG_FREEZE_BASE_URL', 'http://localhost/')
 
     BLUELOG_UPLOAD_PATH = os.path.join(basedir, 'uploads')
     BLUELOG_ALLOWED_IMAGE_EXTENSIONS = ['png', 'jpg', 'jpeg', 'gif']
+    # uploads get a copy at each of these widths and in WebP, made by background threads
+    BLUELOG_IMAGE_WIDTHS = [480, 960, 1600]
+    BLUELOG_IMAGE_WORKERS = 2
+    # None sends the uploads from the app,
+    # 'sendfile' (X-Sendfile) or 'accel' (nginx X-Accel-Redirect) leaves it to the proxy in front of it
+    BLUELOG_UPLOAD_OFFLOAD = os.getenv('BLUELOG_UPLOAD_OFFLOAD')
+    # bytes of small uploads kept in memory by each process when the app sends them, 0 disables the cache
+    BLUELOG_UPLOAD_CACHE_SIZE = 0
+    # functions taking and returning HTML, applied in order to post bodies when they are saved;
+    # run `flask rerender` after changing them
+    BLUELOG_BODY_TRANSFORMS = [
+        'bluelog.pipeline.sanitize',
+        'bluelog.pipeline.heading_anchors',
+        'bluelog.pipeline.external_links',
+        'bluelog.pipeline.lazy_images',
+    ]
+
+    # logins from an address or for a username are refused for a while after 5 failures within 300s
+    BLUELOG_LOGIN_LIMIT = 5
+    BLUELOG_LOGIN_WINDOW = 300
+    # SQLite database of the failed logins shared by all worker processes, None keeps them per process
+    BLUELOG_LOGIN_THROTTLE_PATH = None
 
 
 class DevelopmentConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = prefix + os.path.join(basedir, 'data-dev.db')
+    # edits of the static files show up without a build
+    BLUELOG_ASSETS_MANIFEST = False
 
 
 class TestingConfig(BaseConfig):
     TESTING = True
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'  # in-memory database
+    BLUELOG_MAIL_WORKERS = 0
+    BLUELOG_METRICS_SAMPLE_RATE = 1
+    BLUELOG_SLOWLOG_PATH = None
+    BLUELOG_ASSETS_MANIFEST = False
+    BLUELOG_IMAGE_WORKERS = 0
 
 
 class ProductionConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', prefix + os.path.join(basedir, 'data.db'))
+    # slow queries are caught by the metrics cursor events, there is no need to keep every statement
+    SQLALCHEMY_RECORD_QUERIES = False
+    BLUELOG_CACHE_VERSION_PATH = os.path.join(basedir, 'cache')
+    BLUELOG_UPLOAD_CACHE_SIZE = 32 * 1024 * 1024
+    BLUELOG_LOGIN_THROTTLE_PATH = os.path.join(basedir, 'cache', 'login-attempts.db')
+    # the app usually runs behind a local proxy, /metrics only takes the token
+    BLUELOG_METRICS_ALLOWED_ADDRS = []
 
 
 config = {
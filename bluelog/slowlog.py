@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+from flask import current_app
+
+# applied in order: literals first, then the lists of placeholders they leave behind
+NORMALIZERS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r'\(\?(?:, ?\?)+\)'), '(?, ...)'),
+)
+
+
+def fingerprint(statement):
+    """Normalize a statement so the queries that only differ by their literals look the same."""
+    for pattern, replacement in NORMALIZERS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def merge(entries, other):
+    """Add the statistics of ``other`` to ``entries``, both mapping fingerprints to dicts."""
+    for key, stats in other.items():
+        entry = entries.get(key)
+        if entry is None:
+            entries[key] = dict(stats)
+            continue
+        entry['count'] += stats['count']
+        entry['slow'] += stats['slow']
+        entry['total'] += stats['total']
+        entry['max'] = max(entry['max'], stats['max'])
+        entry['plan'] = entry['plan'] or stats['plan']
+
+
+class _SlowLogState(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.fingerprints = {}
+        self.dumped = time.time()
+        self.dirty = False
+
+
+class SlowLog(object):
+    """Per fingerprint statistics of the executed queries.
+
+    Every query adds to the count, total and max duration of its fingerprint.
+    The first time a fingerprint takes ``BLUELOG_SLOW_QUERY_THRESHOLD``
+    seconds or more, its query plan is captured and a single warning is
+    logged. Every process dumps its statistics to a ``slowlog-<pid>.json``
+    file in ``BLUELOG_SLOWLOG_PATH`` (at most every
+    ``BLUELOG_SLOWLOG_DUMP_INTERVAL`` seconds), where ``flask slowlog``
+    merges them.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BLUELOG_SLOWLOG_PATH', None)
+        app.config.setdefault('BLUELOG_SLOWLOG_DUMP_INTERVAL', 60)
+        app.config.setdefault('BLUELOG_SLOWLOG_MAX_FINGERPRINTS', 1000)
+        app.extensions['bluelog_slowlog'] = _SlowLogState()
+        app.after_request(self._dump_later)
+
+    @property
+    def _state(self):
+        return current_app.extensions['bluelog_slowlog']
+
+    def _fingerprint(self, state, statement):
+        # statements repeat verbatim, only their parameters change
+        key = state.fingerprints.get(statement)
+        if key is None:
+            if len(state.fingerprints) >= current_app.config['BLUELOG_SLOWLOG_MAX_FINGERPRINTS']:
+                state.fingerprints.clear()
+            key = state.fingerprints[statement] = fingerprint(statement)
+        return key
+
+    def record(self, conn, statement, parameters, duration):
+        """Account a query, capturing its plan the first time it is slow."""
+        state = self._state
+        slow = duration >= current_app.config['BLUELOG_SLOW_QUERY_THRESHOLD']
+        with state.lock:
+            key = self._fingerprint(state, statement)
+            entry = state.entries.get(key)
+            if entry is None:
+                if len(state.entries) >= current_app.config['BLUELOG_SLOWLOG_MAX_FINGERPRINTS']:
+                    return
+                entry = state.entries[key] = dict(count=0, slow=0, total=0, max=0, plan=None)
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            state.dirty = True
+            if not slow:
+                return
+            entry['slow'] += 1
+            first = entry['slow'] == 1
+        if first:
+            entry['plan'] = self.explain(conn, statement, parameters)
+            current_app.logger.warning('Slow query: Duration: %fs\nQuery: %s\nPlan:\n%s'
+                                       % (duration, key, entry['plan'] or '-'))
+
+    def explain(self, conn, statement, parameters):
+        """Return the plan of a SELECT statement as text, or None if it cannot be explained."""
+        if not statement.lstrip().upper().startswith('SELECT'):
+            return None
+        prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+        except Exception:
+            return None
+        finally:
+            cursor.close()
+
+    def entries(self):
+        """Return the statistics of this process merged with the dumps of all the processes."""
+        path = current_app.config['BLUELOG_SLOWLOG_PATH']
+        entries = {}
+        if path is not None:
+            for filename in glob.glob(os.path.join(path, 'slowlog-*.json')):
+                if filename != self._filename(path):
+                    with open(filename) as f:
+                        merge(entries, json.load(f))
+        state = self._state
+        with state.lock:
+            merge(entries, state.entries)
+        return entries
+
+    def _filename(self, path):
+        return os.path.join(path, 'slowlog-%d.json' % os.getpid())
+
+    def _dump_later(self, response):
+        state = self._state
+        if state.dirty and time.time() - state.dumped >= current_app.config['BLUELOG_SLOWLOG_DUMP_INTERVAL']:
+            self.dump()
+        return response
+
+    def dump(self):
+        """Write the statistics of this process to its file."""
+        path = current_app.config['BLUELOG_SLOWLOG_PATH']
+        if path is None:
+            return
+        state = self._state
+        with state.lock:
+            data = json.dumps(state.entries)
+            state.dirty = False
+            state.dumped = time.time()
+        filename = self._filename(path)
+        with open(filename + '.tmp', 'w') as f:
+            f.write(data)
+        os.replace(filename + '.tmp', filename)
+
+    def reset(self):
+        """Forget the statistics of this process and remove all the dumps."""
+        path = current_app.config['BLUELOG_SLOWLOG_PATH']
+        if path is not None:
+            for filename in glob.glob(os.path.join(path, 'slowlog-*.json')):
+                os.remove(filename)
+        state = self._state
+        with state.lock:
+            state.entries.clear()
+            state.dirty = False
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import closing
+
+from flask import current_app, request
+
+
+class MemoryStore(object):
+    """The failed attempts of each key, kept in this process."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.attempts = {}
+
+    def _expire(self, key, since):
+        times = self.attempts.get(key)
+        while times and times[0] <= since:
+            times.popleft()
+        if times is not None and not times:
+            del self.attempts[key]
+
+    def hits(self, key, since):
+        """Return the times of the attempts made after ``since``, oldest first."""
+        with self.lock:
+            self._expire(key, since)
+            return list(self.attempts.get(key, ()))
+
+    def add(self, key, now, since):
+        with self.lock:
+            if key not in self.attempts and len(self.attempts) >= self.max_keys:
+                for old_key in list(self.attempts):
+                    self._expire(old_key, since)
+                # still full, make room by forgetting the key added first
+                if len(self.attempts) >= self.max_keys:
+                    self.attempts.pop(next(iter(self.attempts)))
+            self.attempts.setdefault(key, deque()).append(now)
+
+    def clear(self, key):
+        with self.lock:
+            self.attempts.pop(key, None)
+
+
+class SQLiteStore(object):
+    """The failed attempts of each key, kept in a SQLite database shared by all the worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS login_attempt (key TEXT NOT NULL, time REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_login_attempt_key_time ON login_attempt (key, time)')
+
+    def _connect(self):
+        # autocommit, every statement stands alone
+        return closing(sqlite3.connect(self.path, timeout=5, isolation_level=None))
+
+    def hits(self, key, since):
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute(
+                'SELECT time FROM login_attempt WHERE key = ? AND time > ? ORDER BY time', (key, since))]
+
+    def add(self, key, now, since):
+        with self._connect() as connection:
+            # only the attempts of the current window are kept, the table stays small
+            connection.execute('DELETE FROM login_attempt WHERE time <= ?', (since,))
+            connection.execute('INSERT INTO login_attempt (key, time) VALUES (?, ?)', (key, now))
+
+    def clear(self, key):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM login_attempt WHERE key = ?', (key,))
+
+
+class _ThrottleState(object):
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        # attempts rejected by the key that throttled them
+        self.rejected = {'addr': 0, 'user': 0}
+
+    def stats(self):
+        """Return the numbers of attempts rejected so far by this process, by key."""
+        with self.lock:
+            return dict(self.rejected)
+
+
+class Throttle(object):
+    """Slow down password guessing on the login form.
+
+    Failed logins are counted per remote address and per username over a
+    sliding window of ``BLUELOG_LOGIN_WINDOW`` seconds. Once either has
+    failed ``BLUELOG_LOGIN_LIMIT`` times, further attempts are turned away
+    before the password hash is computed, until the oldest failure leaves
+    the window. A successful login clears the counts of its address and
+    username. The failures are kept per process, or in the SQLite database
+    at ``BLUELOG_LOGIN_THROTTLE_PATH`` so all the worker processes share
+    them. The numbers of rejected attempts are published with the metrics.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BLUELOG_LOGIN_LIMIT', 5)
+        app.config.setdefault('BLUELOG_LOGIN_WINDOW', 300)
+        app.config.setdefault('BLUELOG_LOGIN_THROTTLE_PATH', None)
+        path = app.config['BLUELOG_LOGIN_THROTTLE_PATH']
+        store = MemoryStore() if path is None else SQLiteStore(path)
+        app.extensions['bluelog_throttle'] = _ThrottleState(store)
+
+    @property
+    def _state(self):
+        return current_app.extensions['bluelog_throttle']
+
+    def _keys(self, username):
+        return [('addr', request.remote_addr or ''), ('user', (username or '').strip().lower())]
+
+    def check(self, username):
+        """Return the seconds to wait before logging in as ``username`` from this address, 0 if it may go on."""
+        state = self._state
+        limit = current_app.config['BLUELOG_LOGIN_LIMIT']
+        window = current_app.config['BLUELOG_LOGIN_WINDOW']
+        now = time.time()
+        for kind, value in self._keys(username):
+            hits = state.store.hits('%s:%s' % (kind, value), now - window)
+            if len(hits) >= limit:
+                with state.lock:
+                    state.rejected[kind] += 1
+                # another attempt is allowed once enough failures have left the window
+                return max(int(math.ceil(hits[-limit] + window - now)), 1)
+        return 0
+
+    def fail(self, username):
+        """Count a failed login."""
+        store = self._state.store
+        now = time.time()
+        for kind, value in self._keys(username):
+            store.add('%s:%s' % (kind, value), now, now - current_app.config['BLUELOG_LOGIN_WINDOW'])
+
+    def succeed(self, username):
+        """Forget the failed logins of this address and ``username``."""
+        store = self._state.store
+        for kind, value in self._keys(username):
+            store.clear('%s:%s' % (kind, value))
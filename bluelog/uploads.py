@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from stat import S_ISREG
+
+from flask import current_app, request, abort, send_file
+from werkzeug.security import safe_join
+from werkzeug.urls import url_quote
+
+OFFLOAD_HEADERS = {'sendfile': 'X-Sendfile', 'accel': 'X-Accel-Redirect'}
+
+
+class _UploadCache(object):
+    """The content of small uploads, the least recently used are dropped past ``max_bytes``."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, path, stat):
+        with self.lock:
+            entry = self.entries.get(path)
+            # a file written again since it was cached has another mtime or size
+            if entry is None or entry[0] != (stat.st_mtime, stat.st_size):
+                return None
+            self.entries.move_to_end(path)
+            return entry[1]
+
+    def set(self, path, stat, data):
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[path] = ((stat.st_mtime, stat.st_size), data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self.size -= len(self.entries.popitem(last=False)[1][1])
+
+
+class Uploads(object):
+    """Serve the uploaded images.
+
+    With ``BLUELOG_UPLOAD_OFFLOAD`` set to ``'sendfile'`` (Apache, lighttpd) or
+    ``'accel'`` (nginx), the response only carries an ``X-Sendfile`` or
+    ``X-Accel-Redirect`` header and the proxy in front of the app sends the
+    file, ranges and conditional requests included. Otherwise the app sends
+    the file itself, answering ``Range``, ``If-None-Match`` and
+    ``If-Modified-Since`` requests. Files up to
+    ``BLUELOG_UPLOAD_CACHE_MAX_FILE`` bytes are then kept in memory, in a cache
+    of at most ``BLUELOG_UPLOAD_CACHE_SIZE`` bytes per process.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BLUELOG_UPLOAD_OFFLOAD', None)
+        app.config.setdefault('BLUELOG_UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+        app.config.setdefault('BLUELOG_UPLOAD_CACHE_SIZE', 0)
+        app.config.setdefault('BLUELOG_UPLOAD_CACHE_MAX_FILE', 64 * 1024)
+        if app.config['BLUELOG_UPLOAD_OFFLOAD'] not in (None, 'sendfile', 'accel'):
+            raise ValueError('BLUELOG_UPLOAD_OFFLOAD must be None, "sendfile" or "accel".')
+        app.extensions['bluelog_uploads'] = _UploadCache(app.config['BLUELOG_UPLOAD_CACHE_SIZE'])
+
+    def send(self, filename):
+        """Return the response for an uploaded file, 404 if there is no such file."""
+        path = safe_join(current_app.config['BLUELOG_UPLOAD_PATH'], filename)
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            abort(404)
+        if not S_ISREG(stat.st_mode):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        offload = current_app.config['BLUELOG_UPLOAD_OFFLOAD']
+        if offload is not None:
+            response = current_app.response_class(mimetype=mimetype)
+            response.headers[OFFLOAD_HEADERS[offload]] = path if offload == 'sendfile' else \
+                current_app.config['BLUELOG_UPLOAD_ACCEL_PREFIX'] + url_quote(filename)
+            return response
+        if stat.st_size <= current_app.config['BLUELOG_UPLOAD_CACHE_MAX_FILE'] and \
+                current_app.config['BLUELOG_UPLOAD_CACHE_SIZE']:
+            response = self._send_cached(path, stat, mimetype)
+        else:
+            response = send_file(path, mimetype=mimetype, conditional=True)
+        # werkzeug only advertises ranges on partial responses, let clients know they can resume a download
+        response.headers.setdefault('Accept-Ranges', 'bytes')
+        return response
+
+    def _send_cached(self, path, stat, mimetype):
+        cache = current_app.extensions['bluelog_uploads']
+        data = cache.get(path, stat)
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+            cache.set(path, stat, data)
+        response = current_app.response_class(data, mimetype=mimetype)
+        response.last_modified = datetime.utcfromtimestamp(stat.st_mtime)
+        # the same caching headers as send_file()
+        max_age = current_app.get_send_file_max_age(path)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.expires = int(time.time() + max_age)
+        response.set_etag('%x-%x' % (int(stat.st_mtime * 1000000), stat.st_size))
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
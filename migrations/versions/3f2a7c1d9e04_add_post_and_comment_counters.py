@@ -0,0 +1,37 @@
+"""Add post and comment counters
+
+Revision ID: 3f2a7c1d9e04
+Revises: babdd3ec9106
+Create Date: 2026-10-18 09:12:31.418000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a7c1d9e04'
+down_revision = 'babdd3ec9106'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('category', sa.Column('post_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('post', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill the counters from the existing rows
+    category = sa.table('category', sa.column('id'), sa.column('post_count'))
+    post = sa.table('post', sa.column('id'), sa.column('category_id'), sa.column('comment_count'))
+    comment = sa.table('comment', sa.column('id'), sa.column('post_id'), sa.column('reviewed', sa.Boolean))
+    op.execute(category.update().values(post_count=sa.select([sa.func.count(post.c.id)]).where(
+        post.c.category_id == category.c.id).as_scalar()))
+    op.execute(post.update().values(comment_count=sa.select([sa.func.count(comment.c.id)]).where(
+        sa.and_(comment.c.post_id == post.c.id, comment.c.reviewed == sa.true())).as_scalar()))
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('comment_count')
+    with op.batch_alter_table('category') as batch_op:
+        batch_op.drop_column('post_count')
@@ -0,0 +1,36 @@
+"""Add mail outbox
+
+Revision ID: 5b0e3f8a1c72
+Revises: d4a9e2c7b185
+Create Date: 2026-10-18 14:21:09.530000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b0e3f8a1c72'
+down_revision = 'd4a9e2c7b185'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=True),
+    sa.Column('recipient', sa.String(length=254), nullable=True),
+    sa.Column('html', sa.Text(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_outbox_next_attempt'), 'outbox', ['next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_outbox_next_attempt'), table_name='outbox')
+    op.drop_table('outbox')
@@ -0,0 +1,39 @@
+"""Add post excerpt
+
+Revision ID: 8c1e5b7a2f63
+Revises: 3f2a7c1d9e04
+Create Date: 2026-10-18 11:40:05.271000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from markupsafe import Markup
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1e5b7a2f63'
+down_revision = '3f2a7c1d9e04'
+branch_labels = None
+depends_on = None
+
+
+def make_excerpt(html, length=255, leeway=5, end='...'):
+    # a copy of bluelog.models.make_excerpt as of this revision, the migration must not follow later changes
+    text = Markup(html or '').striptags()
+    if len(text) <= length + leeway:
+        return text
+    return text[:length - len(end)].rsplit(' ', 1)[0] + end
+
+
+def upgrade():
+    op.add_column('post', sa.Column('excerpt', sa.Text(), nullable=True))
+
+    connection = op.get_bind()
+    post = sa.table('post', sa.column('id'), sa.column('body'), sa.column('excerpt'))
+    for post_id, body in connection.execute(sa.select([post.c.id, post.c.body])).fetchall():
+        connection.execute(post.update().where(post.c.id == post_id).values(excerpt=make_excerpt(body)))
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('excerpt')
@@ -0,0 +1,66 @@
+"""Add comment thread paths
+
+Revision ID: a2d6f84c3b17
+Revises: e7c3a91f5d28
+Create Date: 2026-10-18 17:21:05.406000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2d6f84c3b17'
+down_revision = 'e7c3a91f5d28'
+branch_labels = None
+depends_on = None
+
+# the thread paths as bluelog.models builds them at this revision
+PATH_SEGMENT = '%010d/'
+MAX_DEPTH = 255 // len(PATH_SEGMENT % 0) - 1
+
+
+def thread_path(comment_id, parent=None):
+    if parent is None:
+        return PATH_SEGMENT % comment_id, 0
+    path, depth = parent
+    if depth >= MAX_DEPTH:
+        path, depth = path[:-len(PATH_SEGMENT % 0)], depth - 1
+    return path + PATH_SEGMENT % comment_id, depth + 1
+
+
+def thread_paths(rows):
+    replied = dict(rows)
+    paths = {}
+    for comment_id in replied:
+        chain = [comment_id]
+        while replied.get(chain[-1]) is not None and chain[-1] not in paths:
+            chain.append(replied[chain[-1]])
+        parent = paths.get(chain[-1])
+        for ancestor_id in reversed(chain):
+            if ancestor_id not in paths:
+                paths[ancestor_id] = parent = thread_path(ancestor_id, parent)
+            parent = paths[ancestor_id]
+    return paths
+
+
+def upgrade():
+    op.add_column('comment', sa.Column('path', sa.String(length=255), nullable=True))
+    op.add_column('comment', sa.Column('depth', sa.Integer(), server_default='0', nullable=False))
+    op.create_index('ix_comment_post_id_path', 'comment', ['post_id', 'path'], unique=False)
+
+    connection = op.get_bind()
+    comment = sa.table('comment', sa.column('id'), sa.column('replied_id'), sa.column('path'), sa.column('depth'))
+    paths = thread_paths(connection.execute(sa.select([comment.c.id, comment.c.replied_id])).fetchall())
+    update = comment.update().where(comment.c.id == sa.bindparam('comment_id')).values(
+        path=sa.bindparam('path'), depth=sa.bindparam('depth'))
+    values = [dict(comment_id=comment_id, path=path, depth=depth) for comment_id, (path, depth) in paths.items()]
+    if values:
+        connection.execute(update, values)
+
+
+def downgrade():
+    op.drop_index('ix_comment_post_id_path', table_name='comment')
+    with op.batch_alter_table('comment') as batch_op:
+        batch_op.drop_column('depth')
+        batch_op.drop_column('path')
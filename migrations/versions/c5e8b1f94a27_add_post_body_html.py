@@ -0,0 +1,30 @@
+"""Add post body html
+
+Revision ID: c5e8b1f94a27
+Revises: a2d6f84c3b17
+Create Date: 2026-10-18 21:05:42.118000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e8b1f94a27'
+down_revision = 'a2d6f84c3b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('post', sa.Column('body_html', sa.Text(), nullable=True))
+
+    # the pages keep showing the bodies as they were until `flask rerender` runs them through the
+    # transforms configured then, this revision does not depend on the app code
+    post = sa.table('post', sa.column('body'), sa.column('body_html'))
+    op.execute(post.update().values(body_html=post.c.body))
+
+
+def downgrade():
+    with op.batch_alter_table('post') as batch_op:
+        batch_op.drop_column('body_html')
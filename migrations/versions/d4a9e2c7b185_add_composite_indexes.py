@@ -0,0 +1,31 @@
+"""Add composite indexes
+
+Revision ID: d4a9e2c7b185
+Revises: 8c1e5b7a2f63
+Create Date: 2026-10-18 13:02:44.918000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a9e2c7b185'
+down_revision = '8c1e5b7a2f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_post_category_id_timestamp', 'post', ['category_id', 'timestamp'], unique=False)
+    op.create_index('ix_comment_post_id_reviewed_timestamp', 'comment', ['post_id', 'reviewed', 'timestamp'],
+                    unique=False)
+    op.create_index('ix_comment_reviewed_timestamp', 'comment', ['reviewed', 'timestamp'], unique=False)
+    op.create_index('ix_comment_from_admin_timestamp', 'comment', ['from_admin', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comment_from_admin_timestamp', table_name='comment')
+    op.drop_index('ix_comment_reviewed_timestamp', table_name='comment')
+    op.drop_index('ix_comment_post_id_reviewed_timestamp', table_name='comment')
+    op.drop_index('ix_post_category_id_timestamp', table_name='post')
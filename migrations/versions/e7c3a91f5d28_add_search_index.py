@@ -0,0 +1,52 @@
+"""Add search index
+
+Revision ID: e7c3a91f5d28
+Revises: 5b0e3f8a1c72
+Create Date: 2026-10-18 16:02:47.113000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from markupsafe import Markup
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7c3a91f5d28'
+down_revision = '5b0e3f8a1c72'
+branch_labels = None
+depends_on = None
+
+# the index as bluelog.search defines it at this revision
+CREATE_INDEX = "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(" \
+               "title, body, comments, tokenize='porter unicode61')"
+DROP_INDEX = 'DROP TABLE IF EXISTS search_index'
+
+
+def upgrade():
+    connection = op.get_bind()
+    # the index is a SQLite FTS5 table, other databases search with LIKE
+    if connection.dialect.name != 'sqlite':
+        return
+    try:
+        connection.execute(CREATE_INDEX)
+    except sa.exc.OperationalError:
+        return
+
+    post = sa.table('post', sa.column('id'), sa.column('title'), sa.column('body'))
+    comment = sa.table('comment', sa.column('post_id'), sa.column('body'), sa.column('reviewed', sa.Boolean))
+    index = sa.table('search_index', sa.column('rowid'), sa.column('title'), sa.column('body'),
+                     sa.column('comments'))
+    comments = {}
+    for post_id, body in connection.execute(sa.select([comment.c.post_id, comment.c.body]).where(
+            comment.c.reviewed == sa.true())):
+        comments.setdefault(post_id, []).append(body or '')
+    rows = [dict(rowid=post_id, title=title or '', body=Markup(body or '').striptags(),
+                 comments='\n'.join(comments.get(post_id, [])))
+            for post_id, title, body in connection.execute(sa.select([post.c.id, post.c.title, post.c.body]))]
+    if rows:
+        op.bulk_insert(index, rows)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute(DROP_INDEX)
@@ -5,7 +5,10 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+from datetime import datetime, timedelta
+
 from flask import url_for
+from flask_sqlalchemy import get_debug_queries
 
 from bluelog.models import Post, Category, Link, Comment
 from bluelog.extensions import db
@@ -40,6 +43,7 @@ class AdminTestCase(BaseTestCase):
         self.assertIn('Post created.', data)
         self.assertIn('Something', data)
         self.assertIn('Hello, world.', data)
+        self.assertEqual(Post.query.filter_by(title='Something').first().excerpt, 'Hello, world.')
 
     def test_edit_post(self):
         response = self.client.get(url_for('admin.edit_post', post_id=1))
@@ -122,6 +126,74 @@ class AdminTestCase(BaseTestCase):
         response = self.client.post(url_for('blog.show_post', post_id=1))
         data = response.get_data(as_text=True)
         self.assertIn('I am a guest comment.', data)
+        self.assertEqual(Post.query.get(1).comment_count, 1)
+
+        self.client.post(url_for('admin.approve_comment', comment_id=2), follow_redirects=True)
+        self.assertEqual(Post.query.get(1).comment_count, 1)
+
+    def test_delete_comment_counter(self):
+        post = Post.query.get(1)
+        comment = Comment(body='Reviewed', post=post, reviewed=True)
+        reply = Comment(body='Reviewed reply', post=post, reviewed=True, replied=comment)
+        post.comment_count = 2
+        db.session.add_all([comment, reply])
+        db.session.commit()
+
+        self.client.post(url_for('admin.delete_comment', comment_id=comment.id), follow_redirects=True)
+        self.assertEqual(Post.query.get(1).comment_count, 0)
+        self.assertEqual(Comment.query.count(), 1)
+
+    def add_spam(self):
+        post = Post.query.get(1)
+        spam = [Comment(body='Cheap pills %d' % i, email='spam@example.com', post=post) for i in range(3)]
+        old = Comment(body='Old question', email='guest@example.com', post=post,
+                      timestamp=datetime.utcnow() - timedelta(days=30))
+        for comment in spam + [old]:
+            db.session.add(comment)
+            db.session.flush()
+        reply = Comment(body='Reviewed reply', post=post, reviewed=True, replied=spam[0])
+        db.session.add(reply)
+        post.comment_count = Post.comment_count + 1
+        db.session.commit()
+        return spam, old
+
+    def test_bulk_approve_comments(self):
+        spam, old = self.add_spam()
+        self.client.get(url_for('blog.show_post', post_id=1))  # cache the page
+        response = self.client.post(url_for('admin.bulk_comment'), data=dict(
+            action='approve', ids=[spam[1].id, spam[2].id, 1]), follow_redirects=True)
+        self.assertIn('3 comment(s) published.', response.get_data(as_text=True))
+        self.assertEqual(Post.query.get(1).comment_count, 4)
+        self.assertIn('Cheap pills 2', self.client.get(url_for('blog.show_post', post_id=1)).get_data(as_text=True))
+        self.assertIn('Cheap <mark>pills</mark> 2', self.client.get(url_for('blog.search', q='pills')).get_data(
+            as_text=True))
+
+        response = self.client.post(url_for('admin.bulk_comment'), data=dict(
+            action='approve', filter='unread', older_than=7), follow_redirects=True)
+        self.assertIn('1 comment(s) published.', response.get_data(as_text=True))
+        self.assertTrue(Comment.query.get(old.id).reviewed)
+        self.assertFalse(Comment.query.get(spam[0].id).reviewed)
+
+    def test_bulk_delete_comments(self):
+        spam, old = self.add_spam()
+        self.client.get(url_for('blog.show_post', post_id=1))
+        response = self.client.post(url_for('admin.bulk_comment'), data=dict(
+            action='delete', filter='all', email='spam@example.com'), follow_redirects=True)
+        # the reply of a deleted comment goes with it
+        self.assertIn('4 comment(s) deleted.', response.get_data(as_text=True))
+        self.assertEqual(sorted(comment.body for comment in Comment.query), ['A comment', 'Old question'])
+        self.assertEqual(Post.query.get(1).comment_count, 0)
+        self.assertNotIn('Reviewed reply', self.client.get(url_for('blog.show_post', post_id=1)).get_data(
+            as_text=True))
+
+    def test_bulk_comment_needs_selection(self):
+        self.add_spam()
+        response = self.client.post(url_for('admin.bulk_comment'), data=dict(action='delete', filter='all'),
+                                    follow_redirects=True)
+        self.assertIn('Check some comments or fill in the filter first.', response.get_data(as_text=True))
+        self.assertEqual(Comment.query.count(), 6)
+        response = self.client.post(url_for('admin.bulk_comment'), data=dict(action='drop', ids=[1]))
+        self.assertEqual(response.status_code, 400)
 
     def test_new_category(self):
         response = self.client.get(url_for('admin.new_category'))
@@ -194,6 +266,21 @@ class AdminTestCase(BaseTestCase):
         self.assertIn('Category deleted.', data)
         self.assertIn('Default', data)
         self.assertNotIn('Tech', data)
+        self.assertEqual(Category.query.get(1).post_count, 1)
+
+    def test_post_counter(self):
+        self.client.post(url_for('admin.new_category'), data=dict(name='Tech'))
+        self.client.post(url_for('admin.new_post'), data=dict(title='Counted', category=2, body='Hello'))
+        post = Post.query.filter_by(title='Counted').first()
+        self.assertEqual(Category.query.get(2).post_count, 1)
+
+        self.client.post(url_for('admin.edit_post', post_id=post.id), data=dict(
+            title='Counted', category=1, body='Hello'))
+        self.assertEqual(Category.query.get(1).post_count, 1)
+        self.assertEqual(Category.query.get(2).post_count, 0)
+
+        self.client.post(url_for('admin.delete_post', post_id=post.id))
+        self.assertEqual(Category.query.get(1).post_count, 0)
 
     def test_new_link(self):
         response = self.client.get(url_for('admin.new_link'))
@@ -273,3 +360,17 @@ class AdminTestCase(BaseTestCase):
         response = self.client.get(url_for('blog.about'), follow_redirects=True)
         data = response.get_data(as_text=True)
         self.assertIn('Example about page', data)
+
+    def test_cached_totals(self):
+        self.client.get(url_for('admin.manage_comment', page=1))
+        queries = len(get_debug_queries())
+        response = self.client.get(url_for('admin.manage_comment', page=1))
+        data = response.get_data(as_text=True)
+        self.assertIn('<small class="text-muted">1</small>', data)
+        statements = [query.statement.lower() for query in get_debug_queries()[queries:]]
+        self.assertFalse([statement for statement in statements if 'count(' in statement])
+
+        self.client.post(url_for('blog.show_post', post_id=1), data=dict(body='Another comment.'))
+        response = self.client.get(url_for('admin.manage_comment', page=1))
+        data = response.get_data(as_text=True)
+        self.assertIn('<small class="text-muted">2</small>', data)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from flask import current_app, url_for
+
+from tests.base import BaseTestCase
+
+
+class AssetsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(AssetsTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        current_app.config['BLUELOG_ASSETS_PATH'] = self.path
+        current_app.config['BLUELOG_ASSETS_MANIFEST'] = True
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(AssetsTestCase, self).tearDown()
+
+    def build(self):
+        result = self.runner.invoke(args=['assets', 'build'])
+        with open(os.path.join(self.path, 'manifest.json')) as f:
+            return result.output, json.load(f)
+
+    def read_static(self, filename):
+        with open(os.path.join(current_app.static_folder, filename), 'rb') as f:
+            return f.read()
+
+    def test_build_command(self):
+        output, manifest = self.build()
+        self.assertIn('Built %d assets' % len(manifest), output)
+        self.assertRegex(manifest['css/style.css'], r'^css/style\.[0-9a-f]{12}\.css$')
+        self.assertRegex(manifest['js/moment-with-locales.min.js'], r'^js/moment-with-locales\.min\.[0-9a-f]{12}\.js$')
+        self.assertIn('favicon.ico', manifest)
+        self.assertNotIn('css/bootstrap.css.map', manifest)
+        self.assertFalse(any(name.startswith('ckeditor/') for name in manifest))
+
+        path = os.path.join(self.path, manifest['css/perfect_blue.min.css'])
+        with open(path + '.gz', 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), self.read_static('css/perfect_blue.min.css'))
+        # a build of the same files gives the same names
+        self.assertEqual(self.build()[1], manifest)
+
+    def test_urls_resolved_through_manifest(self):
+        self.assertEqual(url_for('static', filename='css/style.css'), '/static/css/style.css')
+
+        manifest = self.build()[1]
+        data = self.client.get(url_for('blog.index')).get_data(as_text=True)
+        self.assertIn('/static/dist/%s' % manifest['css/style.css'], data)
+        self.assertIn('/static/dist/%s' % manifest['js/moment-with-locales.min.js'], data)
+        self.assertNotIn('/static/css/style.css', data)
+        # files left out of the build keep their URL
+        self.assertEqual(url_for('static', filename='ckeditor/ckeditor.js'), '/static/ckeditor/ckeditor.js')
+
+    def test_serve_precompressed(self):
+        self.build()
+        url = url_for('static', filename='css/perfect_blue.min.css')
+        original = self.read_static('css/perfect_blue.min.css')
+
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.content_encoding, 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertEqual(gzip.decompress(response.get_data()), original)
+        self.assertIn('Accept-Encoding', response.vary)
+        self.assertTrue(response.cache_control.immutable)
+        self.assertEqual(response.cache_control.max_age, 365 * 24 * 60 * 60)
+
+        response = self.client.get(url)
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(response.get_data(), original)
+
+    def test_serve_missing(self):
+        self.assertEqual(self.client.get('/static/dist/css/style.000000000000.css').status_code, 404)
+        self.assertEqual(self.client.get('/static/dist/../../settings.py').status_code, 404)
+        self.assertEqual(self.client.get(url_for('static', filename='css/style.css')).status_code, 200)
@@ -6,7 +6,9 @@
     :license: MIT, see LICENSE for more details.
 """
 from flask import url_for
+from flask_sqlalchemy import get_debug_queries
 
+from bluelog.extensions import db, cache
 from tests.base import BaseTestCase
 
 
@@ -32,3 +34,24 @@ class AuthTestCase(BaseTestCase):
         response = self.client.get(url_for('admin.settings'), follow_redirects=True)
         data = response.get_data(as_text=True)
         self.assertIn('Please log in to access this page.', data)
+
+    def test_admin_loaded_once(self):
+        self.login()
+        self.client.get(url_for('blog.index'))
+        for url in url_for('blog.index'), url_for('admin.settings'), url_for('auth.login'):
+            db.session.remove()
+            cache.bump('settings')
+            queries = len(get_debug_queries())
+            self.client.get(url)
+            statements = [query.statement for query in get_debug_queries()[queries:]]
+            # the user loader, the views and the templates share one administrator per request
+            self.assertEqual(len([statement for statement in statements if 'FROM admin' in statement]), 1, url)
+
+    def test_settings_invalidate_cache(self):
+        self.login()
+        self.assertIn('Testlog', self.client.get(url_for('blog.about')).get_data(as_text=True))
+        self.client.post(url_for('admin.settings'), data=dict(
+            name='Grey Li', blog_title='Renamed', blog_sub_title='a test', about='I am test'))
+        data = self.client.get(url_for('blog.about')).get_data(as_text=True)
+        self.assertIn('Renamed', data)
+        self.assertNotIn('Testlog', data)
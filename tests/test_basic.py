@@ -5,8 +5,11 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from flask import current_app
+from flask import current_app, url_for
+from flask_sqlalchemy import get_debug_queries
 
+from bluelog.extensions import db
+from bluelog.models import Category, Link
 from tests.base import BaseTestCase
 
 
@@ -23,3 +26,24 @@ class BasicTestCase(BaseTestCase):
         data = response.get_data(as_text=True)
         self.assertEqual(response.status_code, 404)
         self.assertIn('404 Error', data)
+
+    def test_template_context_cached(self):
+        # without the page cache, the second page is rendered again from the cached sidebar data
+        current_app.config['BLUELOG_PAGE_CACHE'] = False
+        db.session.add_all([Category(name='Default'), Link(name='GitHub', url='https://github.com/greyli')])
+        db.session.commit()
+        self.client.get(url_for('blog.about'))
+
+        queries = len(get_debug_queries())
+        response = self.client.get(url_for('blog.about'))
+        data = response.get_data(as_text=True)
+        self.assertEqual(len(get_debug_queries()), queries)
+        self.assertIn('Default', data)
+        self.assertIn('GitHub', data)
+
+        link = Link.query.get(1)
+        link.name = 'HelloFlask'
+        db.session.commit()
+        response = self.client.get(url_for('blog.about'))
+        data = response.get_data(as_text=True)
+        self.assertIn('HelloFlask', data)
@@ -5,9 +5,13 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from flask import url_for
+import re
+from datetime import datetime, timedelta
 
-from bluelog.models import Post, Category, Link, Comment
+from flask import current_app, url_for, g
+from flask_sqlalchemy import get_debug_queries
+
+from bluelog.models import Post, Category, Link, Comment, MAX_DEPTH, thread_paths
 from bluelog.extensions import db
 
 from tests.base import BaseTestCase
@@ -73,6 +77,7 @@ class BlogTestCase(BaseTestCase):
         data = response.get_data(as_text=True)
         self.assertIn('Comment published.', data)
         self.assertIn('I am an admin comment.', data)
+        self.assertEqual(Post.query.get(1).comment_count, 1)
 
     def test_new_guest_comment(self):
         self.logout()
@@ -86,6 +91,7 @@ class BlogTestCase(BaseTestCase):
         data = response.get_data(as_text=True)
         self.assertIn('Thanks, your comment will be published after reviewed.', data)
         self.assertNotIn('I am a guest comment.', data)
+        self.assertEqual(Post.query.get(1).comment_count, 0)
 
     def test_reply_status(self):
         response = self.client.get(url_for('blog.reply_comment', comment_id=1), follow_redirects=True)
@@ -113,6 +119,26 @@ class BlogTestCase(BaseTestCase):
         self.assertIn('I am an admin reply comment.', data)
         self.assertIn('Reply', data)
 
+    def test_reply_threaded(self):
+        self.client.post(url_for('blog.show_post', post_id=1, reply=1), data=dict(body='Admin reply'))
+        self.logout()
+        self.client.post(url_for('blog.show_post', post_id=1, reply=2), data=dict(
+            author='Guest', email='a@b.com', body='Guest reply'))
+        admin_reply = Comment.query.filter_by(body='Admin reply').one()
+        guest_reply = Comment.query.filter_by(body='Guest reply').one()
+        self.assertEqual((admin_reply.replied_id, admin_reply.path, admin_reply.depth),
+                         (1, '0000000001/0000000002/', 1))
+        self.assertEqual((guest_reply.replied_id, guest_reply.path, guest_reply.depth),
+                         (2, '0000000001/0000000002/0000000003/', 2))
+
+    def test_reply_to_other_post(self):
+        other = Post(title='Other Post', category_id=1, body='Blah...')
+        db.session.add(other)
+        db.session.commit()
+        response = self.client.post(url_for('blog.show_post', post_id=other.id, reply=1), data=dict(body='Misplaced'))
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(Comment.query.filter_by(body='Misplaced').first())
+
     def test_new_guest_reply(self):
         self.logout()
         response = self.client.post(url_for('blog.show_post', post_id=1) + '?reply=1', data=dict(
@@ -125,3 +151,215 @@ class BlogTestCase(BaseTestCase):
         data = response.get_data(as_text=True)
         self.assertIn('Thanks, your comment will be published after reviewed.', data)
         self.assertNotIn('I am a guest comment.', data)
+
+    def count_queries(self, url):
+        # the test client shares the session of the test, start from an empty identity map
+        db.session.remove()
+        queries = len(get_debug_queries())
+        self.client.get(url)
+        return len(get_debug_queries()) - queries
+
+    def assert_constant_queries(self, url, add_items):
+        self.client.get(url)
+        few = self.count_queries(url)
+        add_items()
+        self.client.get(url)  # refill the sidebar cache
+        self.assertEqual(self.count_queries(url), few)
+
+    def test_index_page_queries(self):
+        def add_posts():
+            for i in range(5):
+                category = Category(name='Category %d' % i)
+                db.session.add(Post(title='Post %d' % i, body='Blah...', category=category))
+            db.session.commit()
+
+        self.assert_constant_queries(url_for('blog.index'), add_posts)
+
+    def test_category_page_queries(self):
+        def add_posts():
+            category = Category.query.get(1)
+            db.session.add_all([Post(title='Post %d' % i, category=category) for i in range(5)])
+            db.session.commit()
+
+        self.assert_constant_queries(url_for('blog.show_category', category_id=1), add_posts)
+
+    def test_post_page_queries(self):
+        def add_replies():
+            post = Post.query.get(1)
+            for i in range(5):
+                # threads of every depth, some with a reply to a comment that is not shown
+                comment = Comment(body='Comment %d' % i, post=post, reviewed=True)
+                reply = Comment(body='Reply %d' % i, post=post, reviewed=i % 2 == 0, replied=comment)
+                db.session.add_all([comment, reply])
+                db.session.flush()
+                db.session.add(Comment(body='Reply to reply %d' % i, post=post, reviewed=True, replied=reply))
+            db.session.commit()
+
+        self.assert_constant_queries(url_for('blog.show_post', post_id=1), add_replies)
+
+    def test_comment_threads(self):
+        post = Post.query.get(1)
+        first = Comment.query.get(1)
+        second = Comment(body='Second comment', post=post, reviewed=True)
+        hidden = Comment(body='Hidden reply', post=post, reviewed=False, replied=first)
+        for comment in second, hidden:
+            db.session.add(comment)
+            db.session.flush()
+        reply = Comment(body='Reply to hidden', post=post, reviewed=True, replied=hidden)
+        db.session.add(reply)
+        db.session.commit()
+        self.assertEqual((hidden.path, hidden.depth), ('0000000001/0000000003/', 1))
+        self.assertEqual((reply.path, reply.depth), ('0000000001/0000000003/0000000004/', 2))
+
+        roots = Comment.query.filter_by(depth=0).order_by(Comment.id).all()
+        queries = len(get_debug_queries())
+        threads = Comment.load_threads(roots)
+        self.assertEqual(len(get_debug_queries()) - queries, 1)
+        # the reply of a comment that is not shown hangs from the closest comment that is
+        self.assertEqual([(node.comment.body, [child.comment.body for child in node.replies]) for node in threads],
+                         [('A comment', ['Reply to hidden']), ('Second comment', [])])
+
+        data = self.client.get(url_for('blog.show_post', post_id=1)).get_data(as_text=True)
+        self.assertEqual(re.findall(r'A comment|Second comment|Reply to hidden|Hidden reply', data),
+                         ['A comment', 'Reply to hidden', 'Second comment'])
+        self.assertIn('comment-replies', data)
+
+    def test_thread_paths(self):
+        rows = [(1, None), (2, 1), (3, 2), (4, None)] + [(i, i - 1) for i in range(5, 5 + MAX_DEPTH + 2)]
+        paths = thread_paths(reversed(rows))
+        self.assertEqual(paths[3], ('0000000001/0000000002/0000000003/', 2))
+        self.assertEqual(paths[4], ('0000000004/', 0))
+        # past the deepest level, replies are threaded as siblings of their parent
+        deepest = 5 + MAX_DEPTH
+        self.assertEqual(paths[deepest - 1][1], MAX_DEPTH)
+        self.assertEqual(paths[deepest][1], MAX_DEPTH)
+        self.assertEqual(paths[deepest][0][:-11], paths[deepest - 1][0][:-11])
+        self.assertLessEqual(len(paths[deepest + 1][0]), 255)
+
+        comment = Comment(body='Reply', post=Post.query.get(1), reviewed=True, replied_id=1)
+        db.session.add(comment)
+        db.session.commit()
+        inserted = (comment.path, comment.depth)
+        Comment.query.update({Comment.path: None, Comment.depth: 0})
+        self.assertEqual(Comment.rebuild_paths(), 2)
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEqual((comment.path, comment.depth), inserted)
+
+    def add_posts(self, count):
+        category = Category.query.get(1)
+        start = datetime(2018, 1, 1)
+        for i in range(count):
+            # every second post shares the timestamp of the previous one to exercise the id tiebreaker
+            db.session.add(Post(title='Paged %02d' % i, body='Blah...', category=category,
+                                timestamp=start + timedelta(days=i // 2)))
+        db.session.commit()
+
+    def test_keyset_pagination(self):
+        self.add_posts(25)
+        titles = []
+        url = url_for('blog.index')
+        while url:
+            data = self.client.get(url).get_data(as_text=True)
+            titles.extend(re.findall(r'Paged \d\d', data))
+            match = re.search(r'href="([^"]*cursor=[^"]*)">\s*Next', data)
+            url = match.group(1).replace('&amp;', '&') if match else None
+        self.assertEqual(titles, ['Paged %02d' % i for i in reversed(range(25))])
+
+        data = self.client.get(url_for('blog.index', page=2)).get_data(as_text=True)
+        self.assertEqual(re.findall(r'Paged \d\d', data), ['Paged %02d' % i for i in range(15, 5, -1)])
+
+        response = self.client.get(url_for('blog.index', cursor='not-a-cursor'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_keyset_pagination_previous_page(self):
+        self.add_posts(25)
+        data = self.client.get(url_for('blog.index')).get_data(as_text=True)
+        next_url = re.search(r'href="([^"]*cursor=[^"]*)">\s*Next', data).group(1)
+        data = self.client.get(next_url).get_data(as_text=True)
+        self.assertIn('Paged 14', data)
+        prev_url = re.search(r'href="([^"]*cursor=[^"]*)">\s*<span aria-hidden="true">&larr;', data).group(1)
+        data = self.client.get(prev_url).get_data(as_text=True)
+        self.assertEqual(re.findall(r'Paged \d\d', data), ['Paged %02d' % i for i in range(24, 15, -1)])
+
+    def test_page_cache(self):
+        self.logout()
+        response = self.client.get(url_for('blog.index'))
+        etag = response.headers['ETag']
+
+        queries = len(get_debug_queries())
+        response = self.client.get(url_for('blog.index'))
+        self.assertEqual(len(get_debug_queries()), queries)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertIn('Hello Post', response.get_data(as_text=True))
+
+        response = self.client.get(url_for('blog.index'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        post = Post.query.get(1)
+        post.title = 'Changed Post'
+        db.session.commit()
+        response = self.client.get(url_for('blog.index'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Changed Post', response.get_data(as_text=True))
+
+    def test_page_cache_bounded_apart(self):
+        self.logout()
+        current_app.extensions['bluelog_cache'].limits['pages'] = 3
+        for i in range(10):
+            # every query string is a page of its own
+            self.client.get(url_for('blog.index', ref=i))
+        state = current_app.extensions['bluelog_cache']
+        self.assertEqual(len(state.stores['pages']), 3)
+        # the crawl did not push out the sidebar data
+        self.assertIn(('categories', 'all'), state.entries)
+        self.assertIn(('links', 'all'), state.entries)
+
+    def test_cache_bumps(self):
+        versions = current_app.extensions['bluelog_cache'].versions
+
+        def bumped(action):
+            before = dict(versions)
+            action()
+            db.session.commit()
+            return set(namespace for namespace in versions if versions[namespace] != before.get(namespace))
+
+        post = Post.query.get(1)
+        # a comment waiting for review changes no public page
+        self.assertEqual(bumped(lambda: db.session.add(Comment(body='Spam', post=post))),
+                         {'comment-counts', 'post-1'})
+        self.assertNotIn('categories', bumped(lambda: setattr(post, 'title', 'Changed')))
+        self.assertIn('categories', bumped(lambda: setattr(post, 'category', Category(name='Other'))))
+        self.assertIn('categories', bumped(lambda: db.session.add(Post(title='New', body='New', category_id=1))))
+        self.assertIn('categories', bumped(lambda: db.session.delete(Post.query.get(2))))
+
+    def test_page_cache_skips_flashed_messages(self):
+        self.logout()
+        self.client.get(url_for('blog.show_post', post_id=1))
+        response = self.client.post(url_for('blog.show_post', post_id=1), data=dict(
+            author='Guest',
+            email='a@b.com',
+            body='I am a guest comment.',
+        ), follow_redirects=True)
+        self.assertIn('Thanks, your comment will be published after reviewed.', response.get_data(as_text=True))
+
+        response = self.client.get(url_for('blog.show_post', post_id=1))
+        self.assertNotIn('Thanks, your comment will be published after reviewed.', response.get_data(as_text=True))
+
+    def test_page_cache_csrf_token(self):
+        self.logout()
+        self.client.application.config['WTF_CSRF_ENABLED'] = True
+        other_client = self.client.application.test_client()
+        tokens = []
+        for client in self.client, other_client:
+            g.pop('csrf_token', None)  # the test client shares g with the test
+            data = client.get(url_for('blog.show_post', post_id=1)).get_data(as_text=True)
+            tokens.append(re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', data).group(1))
+        self.assertNotEqual(tokens[0], tokens[1])
+
+    def test_listing_defers_body(self):
+        queries = len(get_debug_queries())
+        data = self.client.get(url_for('blog.index')).get_data(as_text=True)
+        self.assertIn('Blah...', data)
+        statements = [query.statement for query in get_debug_queries()[queries:]]
+        self.assertFalse([statement for statement in statements if 'post.body' in statement])
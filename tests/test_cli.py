@@ -77,3 +77,66 @@ class CLITestCase(BaseTestCase):
 
         self.assertIn('Generating links...', result.output)
         self.assertIn('Done.', result.output)
+
+    def test_recount_command(self):
+        self.runner.invoke(args=['forge', '--category', '2', '--post', '5', '--comment', '20'])
+        Post.query.update({Post.comment_count: 0})
+        Category.query.update({Category.post_count: 0})
+        db.session.commit()
+
+        result = self.runner.invoke(args=['recount'])
+        self.assertIn('Done.', result.output)
+        for post in Post.query.all():
+            self.assertEqual(post.comment_count, Comment.query.with_parent(post).filter_by(reviewed=True).count())
+        for category in Category.query.all():
+            self.assertEqual(category.post_count, Post.query.with_parent(category).count())
+
+    def test_excerpts_command(self):
+        db.create_all()
+        db.session.add(Post(title='Hello', body='<p>Hello, <b>world</b>.</p>' + '<p>word </p>' * 100))
+        db.session.commit()
+        Post.query.update({Post.excerpt: None})
+        db.session.commit()
+
+        result = self.runner.invoke(args=['excerpts', '--batch', '1'])
+        self.assertIn('Updated 1 excerpts.', result.output)
+        excerpt = Post.query.first().excerpt
+        self.assertTrue(excerpt.startswith('Hello, world.'))
+        self.assertTrue(excerpt.endswith('word...'))
+        self.assertLessEqual(len(excerpt), 255)
+
+    def test_outbox_command(self):
+        from bluelog.emails import send_mail
+        from bluelog.extensions import mail
+
+        db.create_all()
+        send_mail('Hello', 'a@example.com', '<p>Hello</p>')
+        db.session.commit()
+        with mail.record_messages() as outbox:
+            result = self.runner.invoke(args=['outbox'])
+            self.assertEqual(len(outbox), 1)
+        self.assertIn('Sent 1 mails, 0 failed.', result.output)
+
+    def forged_rows(self, *args):
+        self.runner.invoke(args=['forge', '--category', '3', '--post', '30', '--comment', '50'] + list(args))
+        posts = [(post.title, post.category_id, post.comment_count) for post in Post.query.order_by(Post.id)]
+        comments = [(comment.author, comment.post_id, comment.replied_id, comment.reviewed)
+                    for comment in Comment.query.order_by(Comment.id)]
+        return posts, comments
+
+    def test_forge_command_with_seed(self):
+        rows = self.forged_rows('--seed', '42')
+        self.assertEqual(self.forged_rows('--seed', '42'), rows)
+        self.assertEqual(self.forged_rows('--seed', '42', '--workers', '2'), rows)
+        self.assertNotEqual(self.forged_rows('--seed', '7'), rows)
+
+    def test_forge_command_consistency(self):
+        self.runner.invoke(args=['forge', '--category', '3', '--post', '30', '--comment', '50'])
+        self.assertEqual(Category.query.count(), 3 + 1)
+        for post in Post.query.all():
+            self.assertEqual(post.comment_count, Comment.query.with_parent(post).filter_by(reviewed=True).count())
+            self.assertTrue(post.excerpt)
+        for category in Category.query.all():
+            self.assertEqual(category.post_count, Post.query.with_parent(category).count())
+        for comment in Comment.query.filter(Comment.replied_id.isnot(None)):
+            self.assertEqual(comment.post_id, comment.replied.post_id)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+from xml.etree import ElementTree
+
+from flask import url_for
+from flask_sqlalchemy import get_debug_queries
+
+from bluelog.extensions import db
+from bluelog.models import Post, Category
+from tests.base import BaseTestCase
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+
+class FeedTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(FeedTestCase, self).setUp()
+        self.default = Category(name='Default')
+        self.other = Category(name='Other')
+        db.session.add_all([
+            Post(title='First', body='<p>One & only</p>', category=self.default),
+            Post(title='Second', body='<p>Two</p>', category=self.other),
+        ])
+        db.session.commit()
+
+    def get(self, url=None, **headers):
+        queries = len(get_debug_queries())
+        response = self.client.get(url or url_for('blog.feed'), headers=headers)
+        return response, len(get_debug_queries()) - queries
+
+    def test_feed(self):
+        response, queries = self.get()
+        self.assertEqual(response.mimetype, 'application/atom+xml')
+        self.assertTrue(response.get_data().startswith(b'<?xml'))
+        feed = ElementTree.fromstring(response.get_data())
+        self.assertEqual(feed.find(ATOM + 'title').text, 'Testlog')
+        entries = feed.findall(ATOM + 'entry')
+        self.assertEqual([entry.find(ATOM + 'title').text for entry in entries], ['Second', 'First'])
+        # the body as the pipeline wrote it out again
+        self.assertEqual(entries[1].find(ATOM + 'content').text, '<p>One &amp; only</p>')
+        self.assertEqual(entries[1].find(ATOM + 'link').get('href'), 'http://localhost/post/1')
+
+        data = self.client.get(url_for('blog.index')).get_data(as_text=True)
+        self.assertIn('href="/feed.atom"', data)
+
+    def test_category_feed(self):
+        response, queries = self.get(url_for('blog.feed', category_id=self.other.id))
+        feed = ElementTree.fromstring(response.get_data())
+        self.assertEqual(feed.find(ATOM + 'title').text, 'Testlog - Other')
+        self.assertEqual([entry.find(ATOM + 'title').text for entry in feed.findall(ATOM + 'entry')], ['Second'])
+        self.assertEqual(self.get(url_for('blog.feed', category_id=42))[0].status_code, 404)
+
+        data = self.client.get(url_for('blog.show_category', category_id=self.other.id)).get_data(as_text=True)
+        self.assertIn('href="/category/%d/feed.atom"' % self.other.id, data)
+
+    def test_cached_until_post_write(self):
+        response, queries = self.get()
+        self.assertGreater(queries, 0)
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+
+        response, queries = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(queries, 0)
+        response, queries = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, 0)
+        response, queries = self.get(**{'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, 0)
+
+        post = Post.query.filter_by(title='First').first()
+        post.body = '<p>Edited</p>'
+        db.session.commit()
+        response, queries = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Edited', response.get_data())
+        self.assertNotEqual(response.headers['ETag'], etag)
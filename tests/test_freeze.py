@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+
+from flask import current_app
+
+from bluelog.extensions import db
+from bluelog.freeze import freeze, page_filename
+from bluelog.models import Post, Category, Comment
+from tests.base import BaseTestCase
+
+
+class FreezeTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(FreezeTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        current_app.config['BLUELOG_POST_PER_PAGE'] = 2
+        current_app.config['BLUELOG_COMMENT_PER_PAGE'] = 2
+        category = Category(name='Default')
+        self.posts = [Post(title='Post %d' % i, body='Blah...', category=category) for i in range(3)]
+        db.session.add_all(self.posts)
+        db.session.commit()
+        for i in range(3):
+            db.session.add(Comment(author='Reader', body='Comment %d' % i, post=self.posts[0], reviewed=True))
+        self.unread = Comment(author='Reader', body='Unread comment', post=self.posts[0], reviewed=False)
+        db.session.add(self.unread)
+        db.session.commit()
+        Post.recount()
+        Category.recount()
+        db.session.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(FreezeTestCase, self).tearDown()
+
+    def read(self, filename):
+        with open(os.path.join(self.path, filename)) as f:
+            return f.read()
+
+    def test_page_filename(self):
+        self.assertEqual(page_filename('/'), 'index.html')
+        self.assertEqual(page_filename('/', 3), 'page-3.html')
+        self.assertEqual(page_filename('/post/1', 2), 'post/1/page-2.html')
+
+    def test_freeze_command(self):
+        result = self.runner.invoke(args=['freeze', '--output', self.path, '--base-url', 'https://example.com/'])
+        # about, 2 index pages, 2 category pages, 2 + 1 + 1 post pages
+        self.assertIn('Rendered 9 pages, 0 unchanged, 0 removed, 0 failed.', result.output)
+
+        index = self.read('index.html')
+        self.assertIn('Post 2', index)
+        self.assertIn('href="/?page=2"', index)
+        self.assertIn('Post 0', self.read('page-2.html'))
+        self.assertIn('Post 0', self.read('category/1/page-2.html'))
+        self.assertIn('Testlog', self.read('about/index.html'))
+        post = self.read('post/%d/index.html' % self.posts[0].id)
+        self.assertIn('Comment 1', post)
+        self.assertIn('https://example.com/post/%d' % self.posts[0].id, post)
+        self.assertNotIn('Unread comment', post)
+        self.assertIn('Comment 2', self.read('post/%d/page-2.html' % self.posts[0].id))
+
+    def test_incremental(self):
+        freeze(self.path, 'http://localhost/')
+        self.assertEqual(freeze(self.path, 'http://localhost/'), (0, 9, 0, []))
+
+        # the post pages showing the new comment or its comment count, the listings showing the count
+        self.unread.reviewed = True
+        self.posts[0].comment_count += 1
+        db.session.commit()
+        self.assertEqual(freeze(self.path, 'http://localhost/'), (4, 5, 0, []))
+        self.assertIn('Unread comment', self.read('post/%d/page-2.html' % self.posts[0].id))
+        self.assertIn('%d Comments' % self.posts[0].comment_count, self.read('post/%d/index.html' % self.posts[0].id))
+
+        os.remove(os.path.join(self.path, 'about/index.html'))
+        self.assertEqual(freeze(self.path, 'http://localhost/'), (1, 8, 0, []))
+
+        # the sidebar shows the post counts, every page changes
+        db.session.delete(self.posts[0])
+        db.session.commit()
+        Category.recount()
+        db.session.commit()
+        self.assertEqual(freeze(self.path, 'http://localhost/'), (5, 0, 4, []))
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'post/%d' % self.posts[0].id, 'index.html')))
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'page-2.html')))
+
+        self.assertEqual(freeze(self.path, 'http://localhost/', force=True), (5, 0, 0, []))
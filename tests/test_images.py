@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import current_app, url_for
+
+from bluelog.extensions import db, images
+from bluelog.images import Image
+from bluelog.models import Post, Category
+from tests.base import BaseTestCase
+
+
+@unittest.skipIf(Image is None, 'Pillow is not installed')
+class ImagesTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ImagesTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        current_app.config['BLUELOG_UPLOAD_PATH'] = self.path
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(ImagesTestCase, self).tearDown()
+
+    def make_image(self, filename, size, format='JPEG'):
+        data = io.BytesIO()
+        Image.new('RGB', size, (30, 120, 200)).save(data, format)
+        with open(os.path.join(self.path, filename), 'wb') as f:
+            f.write(data.getvalue())
+        return data.getvalue()
+
+    def image_size(self, filename):
+        with Image.open(os.path.join(self.path, filename)) as image:
+            return image.size
+
+    def test_upload_generates_variants(self):
+        data = self.make_image('source.jpg', (2000, 1000))
+        self.login()
+        response = self.client.post(url_for('admin.upload_image'), data=dict(upload=(io.BytesIO(data), 'photo.jpg')))
+        self.assertIn('/admin/uploads/photo.jpg', response.get_data(as_text=True))
+
+        self.assertEqual(self.image_size('photo-480w.jpg'), (480, 240))
+        self.assertEqual(self.image_size('photo-1600w.webp'), (1600, 800))
+        self.assertEqual(self.image_size('photo-2000w.webp'), (2000, 1000))
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'photo-2000w.jpg')))
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'photo.jpg.json')))
+
+    def test_background_workers(self):
+        self.make_image('photo.jpg', (800, 600))
+        current_app.config['BLUELOG_IMAGE_WORKERS'] = 1
+        description = images.generate('photo.jpg').result()
+        self.assertEqual([variant['name'] for variant in description['variants']],
+                         ['photo.jpg', 'photo-480w.jpg', 'photo-480w.webp', 'photo-800w.webp'])
+        self.assertIsNone(images.generate('photo-480w.jpg'))
+
+    def test_post_body_srcset(self):
+        self.make_image('photo.jpg', (1000, 500))
+        self.make_image('small.png', (300, 200), 'PNG')
+        post = Post(title='Photos', category=Category(name='Default'), body=(
+            '<p><img alt="A photo" src="/admin/uploads/photo.jpg" style="width:100%" /></p>'
+            '<p><img src="/admin/uploads/small.png"><img src="http://example.com/photo.jpg"></p>'))
+        db.session.add(post)
+        db.session.commit()
+        url = url_for('blog.show_post', post_id=post.id)
+        self.assertNotIn('<picture>', self.client.get(url).get_data(as_text=True))
+
+        images.backfill()
+        data = self.client.get(url).get_data(as_text=True)
+        self.assertIn('<picture><source type="image/webp" srcset="/admin/uploads/photo-480w.webp 480w, '
+                      '/admin/uploads/photo-960w.webp 960w, /admin/uploads/photo-1000w.webp 1000w"', data)
+        self.assertIn('<img srcset="/admin/uploads/photo.jpg 1000w, /admin/uploads/photo-480w.jpg 480w, '
+                      '/admin/uploads/photo-960w.jpg 960w" sizes=', data)
+        # the body was saved before the variants existed, so the images have no dimensions
+        self.assertIn('src="/admin/uploads/photo.jpg" style="width:100%" loading="lazy" decoding="async"/></picture>',
+                      data)
+        self.assertIn('<picture><source type="image/webp" srcset="/admin/uploads/small-300w.webp 300w"', data)
+        self.assertIn('<img src="http://example.com/photo.jpg" loading="lazy" decoding="async">', data)
+
+    def test_backfill_command(self):
+        self.make_image('one.jpg', (600, 400))
+        self.make_image('two.png', (600, 400), 'PNG')
+        with open(os.path.join(self.path, 'broken.jpg'), 'wb') as f:
+            f.write(b'not an image')
+
+        result = self.runner.invoke(args=['images', 'backfill'])
+        self.assertIn('Processed 3 images, 1 failed.', result.output)
+        self.assertIn('Failed: broken.jpg', result.output)
+        self.assertEqual(self.image_size('two-480w.png'), (480, 320))
+
+        result = self.runner.invoke(args=['images', 'backfill'])
+        self.assertIn('Processed 1 images, 1 failed.', result.output)
+        result = self.runner.invoke(args=['images', 'backfill', '--force'])
+        self.assertIn('Processed 3 images, 1 failed.', result.output)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import logging
+import queue
+import time
+from unittest import mock
+
+from flask import current_app
+
+from bluelog import create_app
+from bluelog.logqueue import RequestQueueHandler, DigestMailHandler, LogQueue
+from tests.base import BaseTestCase
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def raise_error(message):
+    try:
+        raise ValueError(message)
+    except ValueError:
+        current_app.logger.exception('Something went wrong.')
+
+
+class LoggingTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(LoggingTestCase, self).setUp()
+        self.app = self.context.app
+        self.app.logger.handlers = []
+
+    def tearDown(self):
+        # the logger is shared by every app, leave no handler behind for the next tests
+        if 'bluelog_logging' in self.app.extensions:
+            self.app.extensions['bluelog_logging'].stop()
+        self.app.logger.handlers = []
+        super(LoggingTestCase, self).tearDown()
+
+    def test_records_handled_in_background(self):
+        handler = ListHandler()
+        LogQueue(self.app, handler)
+        raise_error('boom')
+        self.app.extensions['bluelog_logging'].stop()
+
+        record = handler.records[0]
+        self.assertEqual(record.url, 'http://localhost/')
+        self.assertIn('Something went wrong.', record.getMessage())
+        self.assertIn('ValueError: boom', record.getMessage())
+        self.assertTrue(record.fingerprint.startswith('ValueError at '))
+
+    def test_queue_replaced_by_next_app(self):
+        # a testing app logs through the handlers set up by the test, if any
+        self.assertNotIn('bluelog_logging', create_app('testing').extensions)
+
+        first, second = ListHandler(), ListHandler()
+        LogQueue(self.app, first)
+        LogQueue(self.app, second)
+        self.assertEqual(len(self.app.logger.handlers), 1)
+        self.app.logger.warning('Once.')
+        self.app.extensions['bluelog_logging'].stop()
+        self.assertEqual(first.records, [])
+        self.assertEqual([record.getMessage() for record in second.records], ['Once.'])
+
+    def test_full_queue_drops_records(self):
+        handler = RequestQueueHandler(queue.Queue(2))
+        self.app.logger.addHandler(handler)
+        for i in range(5):
+            self.app.logger.warning('Warning %d', i)
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 3)
+
+    def test_stats(self):
+        LogQueue(self.app, DigestMailHandler('localhost', 'a@example.com', ['b@example.com'], 'Error'))
+        stats = self.app.extensions['bluelog_logging'].stats()
+        self.assertEqual(stats, dict(queued=0, dropped=0, suppressed=0))
+
+    def test_error_mail_digest(self):
+        mail_handler = DigestMailHandler('localhost', 'a@example.com', ['b@example.com'], 'Error', window=0.2)
+        handler = RequestQueueHandler(queue.Queue())
+        self.app.logger.addHandler(handler)
+        with mock.patch('smtplib.SMTP') as smtp:
+            for message in ('one', 'two', 'three'):
+                raise_error(message)
+                mail_handler.handle(handler.queue.get_nowait())
+            self.assertEqual(smtp.return_value.send_message.call_count, 1)
+            self.assertEqual(mail_handler.suppressed, 2)
+
+            time.sleep(0.3)
+            mail_handler.flush()
+            self.assertEqual(smtp.return_value.send_message.call_count, 2)
+            digest = smtp.return_value.send_message.call_args[0][0]
+            self.assertEqual(digest['Subject'], 'Error (repeated 2 times)')
+            self.assertIn('ValueError: three', digest.get_content())
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import re
+
+from flask import current_app, url_for
+
+from bluelog.extensions import db
+from bluelog.models import Post, Category
+from tests.base import BaseTestCase
+
+
+class MetricsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        db.session.add(Post(title='Hello Post', category=Category(name='Default'), body='Blah...'))
+        db.session.commit()
+
+    def get_metrics(self):
+        response = self.client.get(url_for('metrics'))
+        self.assertEqual(response.content_type, 'text/plain; version=0.0.4; charset=utf-8')
+        return response.get_data(as_text=True)
+
+    def get_value(self, data, name):
+        return float(re.search(r'^%s (\S+)$' % re.escape(name), data, re.M).group(1))
+
+    def test_request_histograms(self):
+        for i in range(3):
+            self.client.get(url_for('blog.index'))
+        data = self.get_metrics()
+        self.assertIn('bluelog_requests_total{endpoint="blog.index"} 3', data)
+        self.assertIn('# TYPE bluelog_request_duration_seconds histogram', data)
+        self.assertIn('bluelog_request_duration_seconds_bucket{endpoint="blog.index",le="+Inf"} 3', data)
+        self.assertEqual(self.get_value(data, 'bluelog_request_queries_count{endpoint="blog.index"}'), 3)
+        self.assertGreater(self.get_value(data, 'bluelog_request_queries_sum{endpoint="blog.index"}'), 0)
+        self.assertGreater(self.get_value(data, 'bluelog_request_db_seconds_sum{endpoint="blog.index"}'), 0)
+        self.assertGreater(self.get_value(data, 'bluelog_request_template_seconds_sum{endpoint="blog.index"}'), 0)
+
+    def test_sampling(self):
+        current_app.config['BLUELOG_METRICS_SAMPLE_RATE'] = 0
+        self.client.get(url_for('blog.index'))
+        data = self.get_metrics()
+        self.assertIn('bluelog_requests_total{endpoint="blog.index"} 1', data)
+        self.assertNotIn('bluelog_request_duration_seconds_count{endpoint="blog.index"}', data)
+
+    def test_metrics_forbidden_for_remote_addresses(self):
+        response = self.client.get(url_for('metrics'), environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_metrics_token(self):
+        current_app.config['BLUELOG_METRICS_ALLOWED_ADDRS'] = []
+        self.assertEqual(self.client.get(url_for('metrics')).status_code, 404)
+        # no token configured, no header is accepted
+        response = self.client.get(url_for('metrics'), headers={'Authorization': 'Bearer '})
+        self.assertEqual(response.status_code, 404)
+
+        current_app.config['BLUELOG_METRICS_TOKEN'] = 's3cret'
+        response = self.client.get(url_for('metrics'), headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(url_for('metrics'), headers={'Authorization': 'Bearer s3cret'},
+                                   environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import smtplib
+import socket
+import socketserver
+import threading
+from datetime import datetime
+from unittest import mock
+
+from flask import url_for
+
+from bluelog.emails import send_mail
+from bluelog.extensions import db, mail, outbox
+from bluelog.models import Post, Category, OutboxMessage
+from tests.base import BaseTestCase
+
+
+class FakeSMTP(object):
+    """Stands in for a Flask-Mail connection, refusing the recipients in ``refuse``."""
+
+    def __init__(self, refuse=()):
+        self.refuse = refuse
+        self.connections = 0
+        self.sent = []
+
+    def __call__(self):
+        self.connections += 1
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+    def send(self, message):
+        if message.recipients[0] in self.refuse:
+            raise smtplib.SMTPRecipientsRefused({message.recipients[0]: (550, b'No such user')})
+        self.sent.append(message)
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough of the SMTP conversation for smtplib, the messages end up in ``server.messages``."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost ready')
+        envelope = dict(sender=None, recipients=[])
+        while True:
+            line = self.rfile.readline().decode('ascii').rstrip('\r\n')
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            if command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                self.server.messages.append((envelope['sender'], envelope['recipients'], data))
+                envelope = dict(sender=None, recipients=[])
+            elif command == 'MAIL':
+                envelope['sender'] = line.split(':', 1)[1].strip()
+            elif command == 'RCPT':
+                envelope['recipients'].append(line.split(':', 1)[1].strip())
+            self.reply('250 OK')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), SMTPHandler)
+        self.messages = []
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class OutboxTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(OutboxTestCase, self).setUp()
+        self.app = self.context.app
+        self.app.config['BLUELOG_EMAIL'] = 'admin@example.com'
+
+    def use_smtp_server(self, port):
+        self.app.extensions['mail'] = mail.init_mail(dict(
+            MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_DEFAULT_SENDER='blog@example.com', MAIL_SUPPRESS_SEND=False))
+
+    def queue(self, *recipients):
+        for recipient in recipients:
+            send_mail('Hello', recipient, '<p>Hello</p>')
+        db.session.commit()
+
+    def test_comment_queues_mail(self):
+        post = Post(title='Hello Post', category=Category(name='Default'), body='Blah...')
+        db.session.add(post)
+        db.session.commit()
+
+        with mail.record_messages() as outbox:
+            self.client.post(url_for('blog.show_post', post_id=post.id), data=dict(
+                author='Guest', email='a@b.com', site='http://greyli.com', body='Hello.'))
+            self.assertEqual(outbox, [])
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.subject, 'New comment')
+        self.assertEqual(message.recipient, 'admin@example.com')
+
+    def test_flush_reuses_connection(self):
+        self.queue('a@example.com', 'b@example.com', 'c@example.com')
+        smtp = FakeSMTP()
+        with mock.patch.object(mail, 'connect', smtp):
+            self.assertEqual(outbox.flush(), (3, 0))
+        self.assertEqual(smtp.connections, 1)
+        self.assertEqual([message.recipients for message in smtp.sent],
+                         [['a@example.com'], ['b@example.com'], ['c@example.com']])
+        self.assertEqual(OutboxMessage.query.count(), 0)
+
+    def test_flush_in_batches(self):
+        self.app.config['BLUELOG_MAIL_BATCH_SIZE'] = 2
+        self.queue('a@example.com', 'b@example.com', 'c@example.com')
+        smtp = FakeSMTP()
+        with mock.patch.object(mail, 'connect', smtp):
+            self.assertEqual(outbox.flush(), (3, 0))
+        self.assertEqual(smtp.connections, 2)
+
+    def test_refused_mail_retried_later(self):
+        self.queue('a@example.com', 'nobody@example.com', 'c@example.com')
+        smtp = FakeSMTP(refuse=['nobody@example.com'])
+        with mock.patch.object(mail, 'connect', smtp):
+            self.assertEqual(outbox.flush(), (2, 1))
+            # not due again before the retry delay
+            self.assertEqual(outbox.flush(), (0, 0))
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.recipient, 'nobody@example.com')
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('SMTPRecipientsRefused', message.last_error)
+        self.assertGreater(message.next_attempt, datetime.utcnow())
+
+    def test_give_up_after_max_attempts(self):
+        self.app.config['BLUELOG_MAIL_MAX_ATTEMPTS'] = 2
+        self.app.config['BLUELOG_MAIL_RETRY_DELAY'] = 0
+        self.queue('a@example.com', 'b@example.com')
+        with mock.patch.object(mail, 'connect', side_effect=smtplib.SMTPConnectError(421, 'Try again later')):
+            self.assertEqual(outbox.flush(), (0, 2))
+            self.assertEqual(outbox.flush(), (0, 2))
+            self.assertEqual(outbox.flush(), (0, 0))
+        for message in OutboxMessage.query:
+            self.assertEqual(message.attempts, 2)
+            self.assertIsNone(message.next_attempt)
+
+    def test_deliver_over_smtp(self):
+        server = SMTPServer()
+        self.addCleanup(server.stop)
+        self.use_smtp_server(server.server_address[1])
+        self.queue('a@example.com')
+        self.assertEqual(outbox.flush(), (1, 0))
+        self.assertEqual(outbox.flush(), (0, 0))
+
+        self.assertEqual(len(server.messages), 1)
+        sender, recipients, data = server.messages[0]
+        self.assertEqual((sender, recipients), ('<blog@example.com>', ['<a@example.com>']))
+        self.assertIn(b'Subject: Hello', data)
+        self.assertEqual(OutboxMessage.query.count(), 0)
+
+    def test_connection_refused(self):
+        # a port nobody listens on
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.use_smtp_server(port)
+        self.queue('a@example.com')
+        self.assertEqual(outbox.flush(), (0, 1))
+
+        message = OutboxMessage.query.one()
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('ConnectionRefusedError', message.last_error)
+        self.assertGreater(message.next_attempt, datetime.utcnow())
+        # left queued until the retry delay has passed
+        self.assertEqual(outbox.flush(), (0, 0))
+        self.assertEqual(OutboxMessage.query.one().attempts, 1)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+from flask import current_app, url_for
+
+from bluelog.extensions import db
+from bluelog.models import Post, Category
+from bluelog.pipeline import sanitize, heading_anchors, external_links, lazy_images, render_body
+from tests.base import BaseTestCase
+
+
+def shout(html):
+    return html.upper()
+
+
+class PipelineTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(PipelineTestCase, self).setUp()
+        self.login()
+        db.session.add(Category(name='Default'))
+        db.session.commit()
+
+    def test_sanitize(self):
+        html = sanitize('<p onclick="steal()">Hi<script>alert(1)</script><style>p {}</style></p>'
+                        '<a href="java\tscript:alert(1)">x</a><a href="/post/1" title="a &amp; b">y</a>'
+                        '<iframe srcdoc="&lt;script&gt;"></iframe><object data="x.swf"></object>')
+        self.assertEqual(html, '<p>Hi</p><a>x</a><a href="/post/1" title="a &amp; b">y</a>')
+        # only the allowed tags and attributes are kept, the elements left open are closed
+        self.assertEqual(sanitize('<p style="width:100%" data-x="1">a<b>b</p><font color="red">f</font>'
+                                  '<img src="/a.png" alt="A" /><div style="background:url(javascript:x)">s'),
+                         '<p style="width:100%">a<b>b</b></p>f<img src="/a.png" alt="A"/><div>s</div>')
+        # the browser would end an unterminated tag with the next ">" of the template
+        self.assertEqual(sanitize('<p>ok</p><img src=x onerror=alert(1)'), '<p>ok</p>&lt;img src=x onerror=alert(1)')
+        self.assertEqual(sanitize('<a href="javascript:alert(1)" title="x\'>z</a>'),
+                         '&lt;a href="javascript:alert(1)" title="x\'&gt;z')
+        self.assertEqual(sanitize('<svg><animate attributeName=href values=javascript:alert(1)/></svg>after'),
+                         'after')
+
+    def test_heading_anchors(self):
+        html = heading_anchors('<h2>Intro</h2><h3 id="intro-2">Kept</h3><h2>Intro</h2><h4><b>Last</b> one</h4>')
+        self.assertEqual(html, '<h2 id="intro">Intro</h2><h3 id="intro-2">Kept</h3><h2 id="intro-3">Intro</h2>'
+                               '<h4 id="last-one"><b>Last</b> one</h4>')
+
+    def test_external_links(self):
+        html = external_links('<a href="https://example.com" rel="nofollow">a</a><a href="/about">b</a>')
+        self.assertEqual(html, '<a href="https://example.com" rel="nofollow noopener noreferrer" target="_blank">a</a>'
+                               '<a href="/about">b</a>')
+
+    def test_lazy_images(self):
+        html = lazy_images('<img src="/photo.jpg" loading="eager"><img src="/other.jpg" />')
+        self.assertEqual(html, '<img src="/photo.jpg" loading="eager" decoding="async">'
+                               '<img src="/other.jpg" loading="lazy" decoding="async"/>')
+
+    def test_configured_transforms(self):
+        current_app.config['BLUELOG_BODY_TRANSFORMS'] = ['bluelog.pipeline.sanitize', shout]
+        self.assertEqual(render_body('<p>Hi<script>x</script></p>'), '<P>HI</P>')
+        self.assertEqual(render_body(None), '')
+
+    def test_body_rendered_on_save(self):
+        self.client.post(url_for('admin.new_post'), data=dict(
+            title='Something', category=1, body='<h2>Hello</h2><script>alert(1)</script>'), follow_redirects=True)
+        post = Post.query.filter_by(title='Something').first()
+        self.assertEqual(post.body_html, '<h2 id="hello">Hello</h2>')
+        data = self.client.get(url_for('blog.show_post', post_id=post.id)).get_data(as_text=True)
+        self.assertIn('<h2 id="hello">Hello</h2>', data)
+        self.assertNotIn('alert(1)', data)
+
+        self.client.post(url_for('admin.edit_post', post_id=post.id), data=dict(
+            title='Something', category=1, body='<a href="http://example.com">Bye</a>'), follow_redirects=True)
+        data = self.client.get(url_for('blog.show_post', post_id=post.id)).get_data(as_text=True)
+        self.assertIn('<a href="http://example.com" rel="noopener noreferrer" target="_blank">Bye</a>', data)
+        self.assertNotIn('id="hello"', data)
+
+    def test_rerender_command(self):
+        for i in range(3):
+            db.session.add(Post(title='Post %d' % i, body='<h2>Post %d</h2>' % i, category_id=1))
+        db.session.commit()
+        result = self.runner.invoke(args=['rerender'])
+        self.assertIn('Rendered 3 posts, 0 changed.', result.output)
+
+        current_app.config['BLUELOG_BODY_TRANSFORMS'] = ['bluelog.pipeline.sanitize']
+        result = self.runner.invoke(args=['rerender', '--batch', '2'])
+        self.assertIn('Rendered 3 posts, 3 changed.', result.output)
+        self.assertEqual(Post.query.get(1).body_html, '<h2>Post 0</h2>')
+        data = self.client.get(url_for('blog.show_post', post_id=1)).get_data(as_text=True)
+        self.assertIn('<h2>Post 0</h2>', data)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import re
+
+from flask import url_for
+from flask_sqlalchemy import get_debug_queries
+
+from bluelog.extensions import db
+from bluelog.models import Post, Category, Comment
+from tests.base import BaseTestCase
+
+# "SCAN post" (or "SCAN TABLE post" before SQLite 3.36) walks the whole table or a whole index
+SCAN = re.compile(r'^SCAN (TABLE )?(post|comment)\b')
+WHERE = re.compile(r'\bWHERE\b')
+
+
+class QueryPlanTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(QueryPlanTestCase, self).setUp()
+        self.runner.invoke(args=['forge', '--category', '5', '--post', '60', '--comment', '300'])
+        self.login(username='admin', password='helloflask')
+
+    def get_hot_queries(self):
+        post = Post.query.order_by(Post.comment_count.desc()).first()
+        category = Category.query.order_by(Category.post_count.desc()).first()
+        comment = Comment.query.filter_by(reviewed=True).first()
+        urls = [
+            url_for('blog.index'),
+            url_for('blog.index', page=3),
+            url_for('blog.show_category', category_id=category.id),
+            url_for('blog.show_category', category_id=category.id, page=2),
+            url_for('blog.show_post', post_id=post.id),
+            url_for('blog.reply_comment', comment_id=comment.id),
+            url_for('admin.manage_post'),
+            url_for('admin.manage_post', page=2),
+            url_for('admin.manage_comment', filter='all'),
+            url_for('admin.manage_comment', filter='unread'),
+            url_for('admin.manage_comment', filter='admin'),
+        ]
+        # follow a cursor link of every paginated listing, too
+        for url in list(urls):
+            data = self.client.get(url).get_data(as_text=True)
+            urls.extend(link.replace('&amp;', '&') for link in re.findall(r'href="([^"]*cursor=[^"]*)"', data))
+
+        queries = len(get_debug_queries())
+        for url in urls:
+            self.assertLess(self.client.get(url).status_code, 400, url)
+        return [query for query in get_debug_queries()[queries:] if query.statement.lstrip().startswith('SELECT')]
+
+    def test_hot_queries_use_indexes(self):
+        cursor = db.session.connection().connection.cursor()
+        for query in self.get_hot_queries():
+            cursor.execute('EXPLAIN QUERY PLAN ' + query.statement, query.parameters)
+            for row in cursor.fetchall():
+                detail = row[-1]
+                # unfiltered listings may walk the timestamp index, they stop after one page
+                if SCAN.match(detail) and WHERE.search(query.statement):
+                    self.fail('%s\n%s\n%s' % (detail, query.statement, query.parameters))
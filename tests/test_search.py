@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+from unittest import mock
+
+from flask import current_app, url_for
+
+from bluelog.extensions import db, search
+from bluelog.models import Post, Category, Comment
+from tests.base import BaseTestCase
+
+
+class SearchTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(SearchTestCase, self).setUp()
+        category = Category(name='Default')
+        self.tips = Post(title='Flask tips', body='<p>Some tips.</p>', category=category)
+        self.mention = Post(title='Hello', body='<p>I like <b>Flask</b> &amp; Jinja.</p>', category=category)
+        comment = Comment(body='A unicorn appears.', post=self.tips, reviewed=True)
+        self.unread = Comment(body='A dragon appears.', post=self.tips, reviewed=False)
+        db.session.add_all([category, self.tips, self.mention, comment, self.unread])
+        db.session.commit()
+
+    def search(self, q):
+        return self.client.get(url_for('blog.search', q=q)).get_data(as_text=True)
+
+    def test_search_ranked_and_highlighted(self):
+        self.assertTrue(search.available())
+        data = self.search('flask')
+        self.assertIn('2 results', data)
+        self.assertIn('<mark>Flask</mark> tips', data)
+        self.assertIn('I like <mark>Flask</mark> &amp; Jinja.', data)
+        self.assertLess(data.index('<mark>Flask</mark> tips'), data.index('I like'))
+
+    def test_search_reviewed_comments(self):
+        self.assertIn('A <mark>unicorn</mark> appears.', self.search('unicorn'))
+        self.assertIn('0 results', self.search('dragon'))
+
+        self.login()
+        self.client.post(url_for('admin.approve_comment', comment_id=self.unread.id))
+        self.assertIn('A <mark>dragon</mark> appears.', self.search('dragon'))
+
+    def test_index_follows_writes(self):
+        self.tips.title = 'Django tips'
+        db.session.commit()
+        self.assertIn('1 results', self.search('flask'))
+        self.assertIn('<mark>Django</mark> tips', self.search('django'))
+
+        db.session.delete(self.tips)
+        db.session.commit()
+        self.assertIn('0 results', self.search('django'))
+
+    def test_unreviewed_comment_not_indexed(self):
+        with mock.patch.object(search, 'refresh') as refresh:
+            db.session.add(Comment(body='Spam', post=self.tips, reviewed=False))
+            db.session.commit()
+        self.assertFalse(refresh.called)
+
+    def test_query_syntax_ignored(self):
+        self.assertIn('<mark>Flask</mark> <mark>tips</mark>', self.search('"flask" (tip'))
+        self.assertIn('0 results', self.search('"'))
+
+    def test_escaped(self):
+        post = Post(title='<script>', body='<p>&lt;script&gt;alert(1)&lt;/script&gt;</p>', category=self.tips.category)
+        db.session.add(post)
+        db.session.commit()
+        data = self.search('alert')
+        self.assertIn('&lt;script&gt;<mark>alert</mark>(1)', data)
+        self.assertNotIn('<script>alert', data)
+
+    def test_like_fallback(self):
+        current_app.extensions['bluelog_search']['available'] = False
+        data = self.search('flask')
+        self.assertIn('2 results', data)
+        self.assertIn('<mark>Flask</mark> tips', data)
+        self.assertIn('I like <mark>Flask</mark> &amp; Jinja.', data)
+        self.assertIn('0 results', self.search('unicorn'))
+
+    def test_reindex_command(self):
+        db.session.execute('DELETE FROM search_index')
+        db.session.commit()
+        self.assertIn('0 results', self.search('flask'))
+
+        result = self.runner.invoke(args=['reindex'])
+        self.assertIn('Indexed 2 posts.', result.output)
+        self.assertIn('2 results', self.search('flask'))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from flask import current_app, url_for
+
+from bluelog.extensions import db, slowlog
+from bluelog.models import Post, Category
+from bluelog.slowlog import fingerprint
+from tests.base import BaseTestCase
+
+
+class SlowLogTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(SlowLogTestCase, self).setUp()
+        db.session.add(Post(title='Hello Post', category=Category(name='Default'), body='Blah...'))
+        db.session.commit()
+        self.path = tempfile.mkdtemp()
+        current_app.config['BLUELOG_SLOWLOG_PATH'] = self.path
+        # logged in, so the pages are not served from the page cache
+        self.login()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(SlowLogTestCase, self).tearDown()
+
+    def find(self, text):
+        return [stats for key, stats in slowlog.entries().items() if text in key]
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint("SELECT * FROM post WHERE id = 42 AND title = 'It''s'"),
+                         'SELECT * FROM post WHERE id = ? AND title = ?')
+        self.assertEqual(fingerprint('SELECT comment_1.id FROM comment AS comment_1\n WHERE id IN (1, 2, 3)'),
+                         'SELECT comment_1.id FROM comment AS comment_1 WHERE id IN (?, ...)')
+        self.assertEqual(fingerprint('SELECT * FROM post WHERE id IN (?, ?) LIMIT ? OFFSET ?'),
+                         'SELECT * FROM post WHERE id IN (?, ...) LIMIT ? OFFSET ?')
+
+    def test_queries_aggregated(self):
+        slowlog.reset()
+        for i in range(3):
+            self.client.get(url_for('blog.show_post', post_id=1))
+        stats = self.find('FROM post WHERE post.id = ?')
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['count'], 3)
+        self.assertGreater(stats[0]['total'], 0)
+        self.assertGreaterEqual(stats[0]['total'], stats[0]['max'])
+
+    def test_slow_query_plan_captured_once(self):
+        slowlog.reset()
+        current_app.config['BLUELOG_SLOW_QUERY_THRESHOLD'] = 0
+        with mock.patch.object(current_app.logger, 'warning') as warning:
+            self.client.get(url_for('blog.index'))
+            logged = warning.call_count
+            self.client.get(url_for('blog.index'))
+        self.assertGreater(logged, 0)
+        self.assertEqual(warning.call_count, logged)
+        stats = self.find('ORDER BY post.timestamp DESC')[0]
+        self.assertEqual(stats['slow'], 2)
+        self.assertIn('post', stats['plan'])
+
+    def test_slowlog_command_merges_processes(self):
+        slowlog.reset()
+        self.client.get(url_for('blog.show_post', post_id=1))
+        slowlog.dump()
+        with open(os.path.join(self.path, 'slowlog-%d.json' % os.getpid())) as f:
+            dumped = json.load(f)
+        self.assertTrue(dumped)
+        other = dict(count=1000, slow=10, total=50.0, max=2.0, plan='SCAN post')
+        with open(os.path.join(self.path, 'slowlog-1.json'), 'w') as f:
+            json.dump({'SELECT * FROM post WHERE title LIKE ?': other}, f)
+
+        result = self.runner.invoke(args=['slowlog', '--limit', '1'])
+        self.assertIn('1000 queries, 10 slow, 50.000s total, 2.000s max', result.output)
+        self.assertIn('  SELECT * FROM post WHERE title LIKE ?', result.output)
+        self.assertIn('  SCAN post', result.output)
+
+        result = self.runner.invoke(args=['slowlog', '--reset'])
+        self.assertIn('Cleared the slow query log.', result.output)
+        self.assertEqual(os.listdir(self.path), [])
+        result = self.runner.invoke(args=['slowlog'])
+        self.assertIn('No queries recorded.', result.output)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from flask import current_app, url_for
+
+from bluelog.extensions import throttle
+from bluelog.models import Admin
+from bluelog.throttle import SQLiteStore, _ThrottleState
+from tests.base import BaseTestCase
+
+
+class ThrottleTestCase(BaseTestCase):
+
+    def fail_logins(self, count, username='grey'):
+        for i in range(count):
+            data = self.login(username=username, password='wrong').get_data(as_text=True)
+            self.assertIn('Invalid username or password.', data)
+
+    def test_login_throttled(self):
+        self.fail_logins(5)
+        with mock.patch.object(Admin, 'validate_password') as validate_password:
+            response = self.login()
+        # the password was not even checked
+        self.assertFalse(validate_password.called)
+        self.assertEqual(response.status_code, 429)
+        self.assertLessEqual(int(response.headers['Retry-After']), 300)
+        self.assertIn('Too many failed attempts', response.get_data(as_text=True))
+
+        data = self.client.get(url_for('metrics')).get_data(as_text=True)
+        self.assertIn('bluelog_login_throttled_total{key="addr"} 1', data)
+
+    def test_username_throttled_from_any_address(self):
+        for i in range(5):
+            self.client.post(url_for('auth.login'), data=dict(username='Grey', password='wrong'),
+                             environ_base={'REMOTE_ADDR': '10.0.0.%d' % i})
+        response = self.client.post(url_for('auth.login'), data=dict(username='grey', password='123'),
+                                    environ_base={'REMOTE_ADDR': '10.0.0.9'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(current_app.extensions['bluelog_throttle'].stats(), {'addr': 0, 'user': 1})
+
+    def test_success_clears_failures(self):
+        self.fail_logins(4)
+        self.assertIn('Welcome back.', self.login().get_data(as_text=True))
+        self.logout()
+        self.fail_logins(4)
+        self.assertIn('Welcome back.', self.login().get_data(as_text=True))
+
+    def test_sliding_window(self):
+        now = time.time()
+        with mock.patch('bluelog.throttle.time.time', return_value=now - 200):
+            throttle.fail('grey')
+        with mock.patch('bluelog.throttle.time.time', return_value=now - 100):
+            for i in range(4):
+                throttle.fail('grey')
+        with mock.patch('bluelog.throttle.time.time', return_value=now):
+            self.assertEqual(throttle.check('grey'), 100)
+        # the first failure leaves the window
+        with mock.patch('bluelog.throttle.time.time', return_value=now + 101):
+            self.assertEqual(throttle.check('grey'), 0)
+
+    def test_shared_store(self):
+        path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(path, 'attempts', 'login.db')
+            current_app.extensions['bluelog_throttle'] = _ThrottleState(SQLiteStore(filename))
+            self.fail_logins(5)
+            # another worker process reads the same database
+            current_app.extensions['bluelog_throttle'] = _ThrottleState(SQLiteStore(filename))
+            self.assertEqual(self.login().status_code, 429)
+        finally:
+            shutil.rmtree(path)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+import shutil
+import tempfile
+
+from flask import current_app, url_for
+
+from bluelog.uploads import _UploadCache
+from tests.base import BaseTestCase
+
+
+class UploadsTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(UploadsTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        current_app.config['BLUELOG_UPLOAD_PATH'] = self.path
+        self.data = self.write('photo.png', bytes(range(256)) * 4)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(UploadsTestCase, self).tearDown()
+
+    def write(self, filename, data):
+        with open(os.path.join(self.path, filename), 'wb') as f:
+            f.write(data)
+        return data
+
+    def set_cache_size(self, size):
+        current_app.config['BLUELOG_UPLOAD_CACHE_SIZE'] = size
+        current_app.extensions['bluelog_uploads'] = _UploadCache(size)
+
+    def get(self, filename='photo.png', **headers):
+        return self.client.get(url_for('admin.get_image', filename=filename), headers=headers)
+
+    def test_conditional_and_range_requests(self):
+        # sent by send_file(), then from the memory cache
+        for cache_size in (0, 1024 * 1024):
+            with self.subTest(cache_size=cache_size):
+                self.set_cache_size(cache_size)
+                response = self.get()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get_data(), self.data)
+                self.assertEqual(response.mimetype, 'image/png')
+                self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+                etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+
+                self.assertEqual(self.get(**{'If-None-Match': etag}).status_code, 304)
+                self.assertEqual(self.get(**{'If-Modified-Since': last_modified}).status_code, 304)
+
+                response = self.get(Range='bytes=10-19')
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response.headers['Content-Range'], 'bytes 10-19/1024')
+                self.assertEqual(response.get_data(), self.data[10:20])
+                self.assertEqual(self.get(Range='bytes=2000-').status_code, 416)
+
+    def test_memory_cache(self):
+        self.set_cache_size(1500)
+        other = self.write('other.png', b'x' * 1000)
+        self.write('large.png', b'x' * (64 * 1024 + 1))
+        cache = current_app.extensions['bluelog_uploads']
+
+        self.get()
+        self.get('large.png')
+        self.assertEqual(list(cache.entries), [os.path.join(self.path, 'photo.png')])
+        self.assertEqual(self.get('other.png').get_data(), other)
+        # the least recently used file made room for the other one
+        self.assertEqual(list(cache.entries), [os.path.join(self.path, 'other.png')])
+        self.assertEqual(cache.size, 1000)
+
+        # a file written again is read again
+        data = self.write('other.png', b'y' * 999)
+        self.assertEqual(self.get('other.png').get_data(), data)
+
+    def test_offload(self):
+        self.write('a photo.png', self.data)
+        current_app.config['BLUELOG_UPLOAD_OFFLOAD'] = 'sendfile'
+        response = self.get('a photo.png')
+        self.assertEqual(response.headers['X-Sendfile'], os.path.join(self.path, 'a photo.png'))
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertEqual(response.get_data(), b'')
+
+        current_app.config['BLUELOG_UPLOAD_OFFLOAD'] = 'accel'
+        response = self.get('a photo.png')
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected-uploads/a%20photo.png')
+        self.assertEqual(response.get_data(), b'')
+
+    def test_missing_files(self):
+        self.assertEqual(self.get('missing.png').status_code, 404)
+        self.assertEqual(self.client.get('/admin/uploads/../settings.py').status_code, 404)
+        os.mkdir(os.path.join(self.path, 'folder'))
+        self.assertEqual(self.get('folder').status_code, 404)